@@ -10,22 +10,31 @@ from ci_jobs_trigger.libs.addons_webhook_trigger.addons_webhook_trigger import (
     process_hook,
     ADDONS_WEBHOOK_JOBS_TRIGGER_CONFIG_STR,
 )
-from ci_jobs_trigger.libs.openshift_ci.re_trigger.re_trigger import JobTriggering
+from ci_jobs_trigger.libs.openshift_ci.re_trigger.job_queue import ReTriggerQueue
 from ci_jobs_trigger.libs.openshift_ci.zstream_trigger.zstream_trigger import (
     OPENSHIFT_CI_ZSTREAM_TRIGGER_CONFIG_OS_ENV_STR,
+    get_zstream_trigger_metrics,
     process_and_trigger_jobs,
     monitor_and_trigger,
 )
-from ci_jobs_trigger.libs.operators_iib_trigger.iib_trigger import run_iib_update
+from ci_jobs_trigger.libs.operators_iib_trigger.iib_trigger import (
+    CI_IIB_JOBS_TRIGGER_CONFIG_OS_ENV_STR,
+    IIBCycleCoordinator,
+    run_iib_update,
+)
 from ci_jobs_trigger.utils.general import (
     get_config,
     process_webhook_exception,
     run_in_process,
 )
+from ci_jobs_trigger.utils.http_client import get_http_client
+from ci_jobs_trigger.utils.slack_notifier import flush_slack_messages_on_sigterm
 
 APP = Flask("ci-jobs-trigger")
 APP.logger.removeHandler(default_handler)
 APP.logger.addHandler(get_logger(APP.logger.name).handlers[0])
+RE_TRIGGER_QUEUE = ReTriggerQueue(logger=APP.logger)
+IIB_CYCLE_COORDINATOR = IIBCycleCoordinator()
 
 
 @APP.route("/healthcheck")
@@ -33,6 +42,12 @@ def healthcheck():
     return "alive"
 
 
+@APP.route("/http-client/metrics", methods=["GET"])
+def http_client_metrics():
+    # Outgoing requests made by the app process (routes, re-trigger workers, slack notifications)
+    return get_http_client().stats()
+
+
 @APP.route("/openshift-ci-zstream-trigger", methods=["POST"])
 def zstream_trigger():
     try:
@@ -50,12 +65,17 @@ def zstream_trigger():
         )
 
 
+@APP.route("/openshift-ci-zstream-trigger/metrics", methods=["GET"])
+def zstream_trigger_metrics():
+    return get_zstream_trigger_metrics(logger=APP.logger)
+
+
 @APP.route("/openshift-ci-re-trigger", methods=["POST"])
 def openshift_ci_job_re_trigger():
     hook_data = request.json
     try:
-        job_triggering = JobTriggering(hook_data=hook_data, logger=APP.logger)
-        return job_triggering.execute_trigger()
+        request_id = RE_TRIGGER_QUEUE.enqueue(hook_data=hook_data)
+        return {"id": request_id, "status": "queued"}, 202
 
     except Exception as ex:
         return process_webhook_exception(
@@ -66,6 +86,51 @@ def openshift_ci_job_re_trigger():
         )
 
 
+@APP.route("/openshift-ci-re-trigger/metrics", methods=["GET"])
+def openshift_ci_job_re_trigger_metrics():
+    return RE_TRIGGER_QUEUE.metrics()
+
+
+@APP.route("/openshift-ci-re-trigger/<request_id>", methods=["GET"])
+def openshift_ci_job_re_trigger_status(request_id):
+    if status := RE_TRIGGER_QUEUE.status(request_id=request_id):
+        return status
+
+    return {"id": request_id, "error": "Request not found"}, 404
+
+
+@APP.route("/operators-iib-trigger", methods=["POST"])
+def operators_iib_trigger():
+    try:
+        if not IIB_CYCLE_COORDINATOR.is_cycle_process_alive():
+            return {"error": "Operators IIB process is not running"}, 503
+
+        APP.logger.info("Requesting an immediate operators IIB cycle")
+        cycle_results = IIB_CYCLE_COORDINATOR.request_cycle(
+            timeout=int(os.environ.get("CI_JOBS_TRIGGER_IIB_TRIGGER_TIMEOUT", 600))
+        )
+        if cycle_results is None:
+            if not IIB_CYCLE_COORDINATOR.is_cycle_process_alive():
+                return {"error": "Operators IIB process is not running"}, 503
+
+            return {"error": "Timeout waiting for operators IIB cycle"}, 504
+
+        if cycle_results.get("error"):
+            return cycle_results, 500
+
+        return cycle_results
+
+    except Exception as ex:
+        return process_webhook_exception(
+            logger=APP.logger,
+            ex=ex,
+            route="operators-iib-trigger",
+            slack_errors_webhook_url=get_config(
+                os_environ=CI_IIB_JOBS_TRIGGER_CONFIG_OS_ENV_STR, logger=APP.logger
+            ).get("slack_errors_webhook_url"),
+        )
+
+
 @APP.route("/addons-trigger", methods=["POST"])
 def process_addons_trigger():
     try:
@@ -89,12 +154,19 @@ def process_addons_trigger():
 
 
 if __name__ == "__main__":
-    run_in_process(
+    flush_slack_messages_on_sigterm()
+    processes = run_in_process(
         targets={
             monitor_and_trigger: {"logger": APP.logger},
-            run_iib_update: {"logger": APP.logger, "tmp_dir": tempfile.mkdtemp(dir="/tmp", prefix="ci-jobs-trigger")},
+            run_iib_update: {
+                "logger": APP.logger,
+                "tmp_dir": tempfile.mkdtemp(dir="/tmp", prefix="ci-jobs-trigger"),
+                "cycle_coordinator": IIB_CYCLE_COORDINATOR,
+            },
         }
     )
+    IIB_CYCLE_COORDINATOR.process = processes[run_iib_update]
+    RE_TRIGGER_QUEUE.start()
     APP.logger.info(f"Starting {APP.name} app")
     APP.run(
         port=int(os.environ.get("CI_JOBS_TRIGGER_LISTEN_PORT", 5000)),
@@ -4,6 +4,8 @@ import gitlab
 
 from ci_jobs_trigger.libs.utils.general import trigger_ci_job
 from ci_jobs_trigger.utils.general import get_config, AddonsWebhookTriggerError
+from ci_jobs_trigger.utils.slack_notifier import slack_digest
+from ci_jobs_trigger.utils.trigger_dispatcher import TriggerDispatcher
 
 ADDONS_WEBHOOK_JOBS_TRIGGER_CONFIG_STR = "ADDONS_WEBHOOK_JOBS_TRIGGER_CONFIG"
 
@@ -35,6 +37,15 @@ def get_merge_request(repository_data, object_attributes, project, logger):
 
 
 def process_hook(data, logger):
+    config_data = get_config(os_environ=ADDONS_WEBHOOK_JOBS_TRIGGER_CONFIG_STR, logger=logger)
+    # With `slack_digest`, the hook notifications are sent as one message when it is processed
+    with slack_digest(
+        title=f"{data['repository']['name']}: Addons jobs", logger=logger, enabled=config_data.get("slack_digest")
+    ):
+        return _process_hook(data=data, config_data=config_data, logger=logger)
+
+
+def _process_hook(data, config_data, logger):
     def _trigger_jobs(
         _addon,
         _ocm_env,
@@ -63,39 +74,37 @@ def process_hook(data, logger):
             return False
 
         failed_triggered_jobs = {}
-        for _job in _openshift_ci_jobs:
-            try:
-                trigger_ci_job(
-                    job=_job,
-                    product=_addon,
-                    _type="addon",
-                    ci=openshift_ci,
-                    config_data=_config_data,
-                    logger=_logger,
-                )
-            except AddonsWebhookTriggerError:
-                failed_triggered_jobs.setdefault(openshift_ci, []).append(_job)
-                continue
-
-        for _job in _jenkins_ci_jobs:
-            try:
-                trigger_ci_job(
-                    job=_job,
-                    product=_addon,
-                    _type="addon",
-                    ci=jenkins_ci,
-                    config_data=_config_data,
-                    logger=_logger,
+        # Jobs are triggered concurrently (waiting for Jenkins builds to start included), with per CI backend
+        # concurrency and rate limits (`trigger_limits`), so the hook is not held by one trigger after the other
+        with TriggerDispatcher(limits=_config_data.get("trigger_limits")) as dispatcher:
+            jobs_futures = [
+                (
+                    _job,
+                    _ci,
+                    dispatcher.submit(
+                        backend=_ci,
+                        func=trigger_ci_job,
+                        job=_job,
+                        product=_addon,
+                        _type="addon",
+                        ci=_ci,
+                        config_data=_config_data,
+                        logger=_logger,
+                    ),
                 )
-            except AddonsWebhookTriggerError:
-                failed_triggered_jobs.setdefault(jenkins_ci, []).append(_job)
-                continue
+                for _ci, _jobs in ((openshift_ci, _openshift_ci_jobs), (jenkins_ci, _jenkins_ci_jobs))
+                for _job in _jobs
+            ]
+            for _job, _ci, future in jobs_futures:
+                try:
+                    future.result()
+                except AddonsWebhookTriggerError:
+                    failed_triggered_jobs.setdefault(_ci, []).append(_job)
 
         return failed_triggered_jobs
 
     object_attributes = data["object_attributes"]
     if object_attributes.get("action") == "merge":
-        config_data = get_config(os_environ=ADDONS_WEBHOOK_JOBS_TRIGGER_CONFIG_STR, logger=logger)
         repository_name = data["repository"]["name"]
         repository_data = repo_data_from_config(repository_name=repository_name, config_data=config_data)
         project = data["project"]["id"]
@@ -1,61 +1,147 @@
+import json
 import os
+import threading
+import time
+from typing import Any, Dict, Tuple
+from urllib.parse import quote
 
 import jenkins
+import requests
+from pyhelper_utils.general import tts
 from timeout_sampler import TimeoutExpiredError, TimeoutSampler
 
+JOB_NAME_TREE = "name"
+JOB_PARAMS_TREE = "property[parameterDefinitions[defaultParameterValue[name,value]]]"
+# Triggers wait at most this long for their build to start, a build still queued is reported by its queue item
+DEFAULT_JENKINS_BUILD_START_TIMEOUT = "10s"
+DEFAULT_JENKINS_BUILD_START_POLL_INTERVAL = "1s"
 
-def jenkins_trigger_job(job, config_data, logger, operator_iib=False):
-    os.environ["PYTHONHTTPSVERIFY"] = "0"
+# (url, user): (token, client)
+_JENKINS_APIS: Dict[Tuple[str, str], Tuple[str, jenkins.Jenkins]] = {}
+# (server, job): (expires at, parameters defaults)
+_JOB_PARAMS_CACHE: Dict[Tuple[str, str], Tuple[float, Dict[str, Any]]] = {}
+_JENKINS_LOCK = threading.Lock()
 
-    api = jenkins.Jenkins(
-        url=config_data["jenkins_url"],
-        username=config_data["jenkins_username"],
-        password=config_data["jenkins_token"],
-    )
 
-    if not api.job_exists(name=job):
-        logger.error(f"Jenkins job {job} not found.")
-        return False, None
+def get_jenkins_api(config_data):
+    # One client per (url, user) so the crumb and the http session are reused between triggers
+    key = (config_data["jenkins_url"], config_data["jenkins_username"])
+    with _JENKINS_LOCK:
+        password, api = _JENKINS_APIS.get(key, (None, None))
+        if not api or password != config_data["jenkins_token"]:
+            api = jenkins.Jenkins(
+                url=config_data["jenkins_url"],
+                username=config_data["jenkins_username"],
+                password=config_data["jenkins_token"],
+            )
+            _JENKINS_APIS[key] = (config_data["jenkins_token"], api)
+
+        return api
+
 
+def get_jenkins_job_url(api, job):
+    # Jobs in folders are addressed as `folder/job`, `api.server` always ends with `/`
+    return api.server + "".join(f"job/{quote(name)}/" for name in job.split("/"))
+
+
+def get_jenkins_job_info(api, job, tree):
+    # Only the `tree` fields of the job, None if the job does not exist
     try:
-        last_build_number = api.get_job_info(job)["lastBuild"]["number"]
-    except TypeError:
-        last_build_number = 0
+        response = api.jenkins_open(
+            requests.Request("GET", f"{get_jenkins_job_url(api=api, job=job)}api/json", params={"tree": tree})
+        )
+    except jenkins.NotFoundException:
+        return None
 
-    api.build_job(name=job, parameters=set_job_params(api=api, job=job, operator_iib=operator_iib))
+    return json.loads(response)
 
-    return wait_for_job_started_in_jenkins(api=api, job=job, last_build_number=last_build_number, logger=logger)
 
+def get_cached_job_params(api, job):
+    with _JENKINS_LOCK:
+        expires_at, job_params = _JOB_PARAMS_CACHE.get((api.server, job), (0, None))
 
-def set_job_params(api, job, operator_iib):
-    job_params = {}
-    install_from_iib_job_param_str = "INSTALL_FROM_IIB"
+    return job_params if expires_at > time.monotonic() else None
 
-    for _property in api.get_job_info(name=job)["property"]:
-        for param in _property.get("parameterDefinitions", []):
-            param_dict = param["defaultParameterValue"]
-            param_name = param_dict["name"]
 
-            if operator_iib and param_name == install_from_iib_job_param_str:
-                job_params[install_from_iib_job_param_str] = True
-                continue
+def cache_job_params(api, job, job_info, ttl):
+    job_params = {
+        param["defaultParameterValue"]["name"]: param["defaultParameterValue"]["value"]
+        for _property in job_info.get("property", [])
+        for param in _property.get("parameterDefinitions", [])
+        if param.get("defaultParameterValue")
+    }
+    with _JENKINS_LOCK:
+        _JOB_PARAMS_CACHE[(api.server, job)] = (time.monotonic() + ttl, job_params)
 
-            job_params[param_name] = param_dict["value"]
+    return job_params
+
+
+def jenkins_trigger_job(job, config_data, logger, operator_iib=False):
+    os.environ["PYTHONHTTPSVERIFY"] = "0"
+
+    api = get_jenkins_api(config_data=config_data)
+
+    # A single job info request is used for the existence check and (when not cached) the parameters
+    job_params = get_cached_job_params(api=api, job=job)
+    job_info = get_jenkins_job_info(
+        api=api,
+        job=job,
+        tree=JOB_NAME_TREE if job_params is not None else f"{JOB_NAME_TREE},{JOB_PARAMS_TREE}",
+    )
+    if not job_info:
+        logger.error(f"Jenkins job {job} not found.")
+        return False, None
+
+    if job_params is None:
+        job_params = cache_job_params(
+            api=api, job=job, job_info=job_info, ttl=tts(ts=config_data.get("jenkins_job_params_cache_ttl", "10m"))
+        )
+
+    queue_id = api.build_job(name=job, parameters=set_job_params(job_params=job_params, operator_iib=operator_iib))
+
+    return wait_for_job_started_in_jenkins(
+        api=api,
+        job=job,
+        queue_id=queue_id,
+        logger=logger,
+        timeout=tts(ts=config_data.get("jenkins_build_start_timeout", DEFAULT_JENKINS_BUILD_START_TIMEOUT)),
+        poll_interval=tts(
+            ts=config_data.get("jenkins_build_start_poll_interval", DEFAULT_JENKINS_BUILD_START_POLL_INTERVAL)
+        ),
+    )
+
+
+def set_job_params(job_params, operator_iib):
+    job_params = dict(job_params)
+    install_from_iib_job_param_str = "INSTALL_FROM_IIB"
+
+    if operator_iib and install_from_iib_job_param_str in job_params:
+        job_params[install_from_iib_job_param_str] = True
 
     return job_params
 
 
-def wait_for_job_started_in_jenkins(api, job, last_build_number, logger):
-    for job_info in TimeoutSampler(
-        wait_timeout=3,
-        sleep=1,
-        func=api.get_job_info,
-        name=job,
-    ):
+def wait_for_job_started_in_jenkins(api, job, queue_id, logger, timeout, poll_interval):
+    # Follows the queue item created by our build request, so the returned build is the one we caused even if others
+    # trigger the same job. With `timeout` 0, or if the build is still queued when it expires, the queue item is returned
+    # with `queued` set, the build did not start (yet).
+    queue_item_url = f"{api.server.rstrip('/')}/queue/item/{queue_id}/"
+    if timeout:
         try:
-            if (job_info_last_build := job_info["lastBuild"]) and job_info_last_build["number"] > last_build_number:
-                return True, job_info_last_build
+            for queue_item in TimeoutSampler(
+                wait_timeout=timeout,
+                sleep=poll_interval,
+                func=api.get_queue_item,
+                number=queue_id,
+            ):
+                if queue_item.get("cancelled"):
+                    logger.error(f"Jenkins job {job} build was cancelled while queued: {queue_item_url}")
+                    return False, None
+
+                if executable := queue_item.get("executable"):
+                    return True, executable
 
         except TimeoutExpiredError:
-            logger.error(f"Jenkins job {job} new build not triggered.")
-            return False, None
+            logger.warning(f"Jenkins job {job} build did not start within {timeout} seconds, still queued")
+
+    return True, {"url": queue_item_url, "queue_id": queue_id, "queued": True}
@@ -1,55 +1,292 @@
-import random
+import json
+import os
 import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
+from typing import Dict, Tuple
 
-from timeout_sampler import TimeoutSampler
+from pyhelper_utils.general import tts
+
+DEFAULT_JOB_DB_PATH = Path("/tmp", "openshift_ci_job_re_trigger.db")
+JOBS_UNIQUE_INDEX = "jobs_job_name_prow_job_id"
+JOB_DB_RETENTION_OS_ENV_STR = "OPENSHIFT_CI_RE_TRIGGER_DB_RETENTION"
+JOB_DB_COMPACTION_INTERVAL_OS_ENV_STR = "OPENSHIFT_CI_RE_TRIGGER_DB_COMPACTION_INTERVAL"
+JOB_DB_COMPACTION_BATCH_SIZE_OS_ENV_STR = "OPENSHIFT_CI_RE_TRIGGER_DB_COMPACTION_BATCH_SIZE"
+JOB_DB_MAX_WAL_SIZE = 64 * 1024 * 1024
+INCREMENTAL_AUTO_VACUUM = 2
+
+# (pid, db path): (connection, lock)
+_DB_CONNECTIONS: Dict[Tuple[int, str], Tuple[sqlite3.Connection, threading.RLock]] = {}
+_DB_CONNECTIONS_LOCK = threading.Lock()
+
+
+def get_db_connection(db_path):
+    # One connection per database file and process, shared by all the threads; statements are serialized by the
+    # returned lock. The schema is created once, when the connection is opened.
+    key = (os.getpid(), str(db_path))
+    with _DB_CONNECTIONS_LOCK:
+        if key not in _DB_CONNECTIONS:
+            connection = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+            # Deleted rows pages are freed by the compaction (`incremental_vacuum`), must be set before creating tables
+            connection.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(f"PRAGMA journal_size_limit={JOB_DB_MAX_WAL_SIZE}")
+            create_tables(connection=connection)
+            _DB_CONNECTIONS[key] = (connection, threading.RLock())
+
+        return _DB_CONNECTIONS[key]
+
+
+def close_db_connections():
+    with _DB_CONNECTIONS_LOCK:
+        for (pid, _), (connection, lock) in list(_DB_CONNECTIONS.items()):
+            if pid == os.getpid():
+                with lock:
+                    connection.close()
+
+        _DB_CONNECTIONS.clear()
+
+
+def create_tables(connection):
+    with connection:
+        connection.execute("CREATE TABLE IF NOT EXISTS jobs(job_name TEXT, prow_job_id TEXT, created_at REAL)")
+        if "created_at" not in [column[1] for column in connection.execute("PRAGMA table_info(jobs)")]:
+            # Rows saved before the column was added expire one retention window from now
+            connection.execute("ALTER TABLE jobs ADD COLUMN created_at REAL")
+            connection.execute("UPDATE jobs SET created_at = ?", (time.time(),))
+
+        connection.execute("CREATE INDEX IF NOT EXISTS jobs_created_at ON jobs (created_at)")
+        if not connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (JOBS_UNIQUE_INDEX,)
+        ).fetchone():
+            # Databases created before the index may have duplicated rows
+            connection.execute(
+                "DELETE FROM jobs WHERE rowid NOT IN (SELECT MIN(rowid) FROM jobs GROUP BY job_name, prow_job_id)"
+            )
+            connection.execute(f"CREATE UNIQUE INDEX {JOBS_UNIQUE_INDEX} ON jobs (job_name, prow_job_id)")
+
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS queue("
+            "request_id TEXT PRIMARY KEY, hook_data TEXT, status TEXT, result TEXT, error TEXT, "
+            "created_at TEXT, updated_at TEXT)"
+        )
 
 
 class DB:
     def __init__(self, job_db_path=None):
-        self.db_path = job_db_path or Path("/tmp", "openshift_ci_job_re_trigger.db")
+        self.db_path = job_db_path or DEFAULT_JOB_DB_PATH
         self.connection = None
-        self.cursor = None
+        self._lock = None
 
         self.table_name = "jobs"
-        self.job_name_column = "job_name"
-        self.prow_job_id_column = "prow_job_id"
+        self.queue_table_name = "queue"
 
     def __enter__(self):
-        self.connection = sqlite3.connect(self.db_path)
-        self.cursor = self.connection.cursor()
-        self.cursor.execute(
-            f"CREATE TABLE if not exists {self.table_name}("
-            f"{self.job_name_column} TEXT, {self.prow_job_id_column} TEXT)"
-        )
-
+        self.connection, self._lock = get_db_connection(db_path=self.db_path)
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.connection.close()
+        # The connection is kept open for the next users
+        self.connection = self._lock = None
+
+    def _execute(self, query, params=()):
+        # Runs `query` in its own transaction, returns its cursor
+        with self._lock, self.connection:
+            return self.connection.execute(query, params)
 
     def check_prow_job_id_in_db(self, job_name, prow_job_id):
-        query = (
-            f'SELECT EXISTS(SELECT "{prow_job_id}" FROM {self.table_name} '
-            f'WHERE {self.job_name_column} == "{job_name}" '
-            f'AND {self.prow_job_id_column} == "{prow_job_id}") LIMIT 1'
+        with self._lock:
+            return bool(
+                self.connection.execute(
+                    f"SELECT EXISTS(SELECT 1 FROM {self.table_name} WHERE job_name = ? AND prow_job_id = ?)",
+                    (job_name, prow_job_id),
+                ).fetchone()[0]
+            )
+
+    def write(self, job_name, prow_job_id):
+        # Idempotent, returns False if the job was already saved
+        return (
+            self._execute(
+                f"INSERT INTO {self.table_name} (job_name, prow_job_id, created_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (job_name, prow_job_id) DO NOTHING",
+                (job_name, prow_job_id, time.time()),
+            ).rowcount
+            == 1
+        )
+
+    def add_queue_item(self, request_id, hook_data, status):
+        now = datetime.now(timezone.utc).isoformat()
+        self._execute(
+            f"INSERT INTO {self.queue_table_name} "
+            "(request_id, hook_data, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (request_id, json.dumps(hook_data), status, now, now),
         )
 
-        result = self.cursor.execute(query).fetchone()[0]
+    def update_queue_item(self, request_id, status, result=None, error=None, clear_hook_data=False):
+        # The hook data (with the trigger token) is not kept once the request is finished
+        self._execute(
+            f"UPDATE {self.queue_table_name} SET status = ?, result = ?, error = ?, updated_at = ?"
+            f"{', hook_data = NULL' if clear_hook_data else ''} WHERE request_id = ?",
+            (status, json.dumps(result), error, datetime.now(timezone.utc).isoformat(), request_id),
+        )
 
-        return result
+    def clear_queue_items_hook_data(self, statuses):
+        return self._execute(
+            f"UPDATE {self.queue_table_name} SET hook_data = NULL "
+            f"WHERE status IN ({', '.join('?' * len(statuses))}) AND hook_data IS NOT NULL",
+            tuple(statuses),
+        ).rowcount
 
-    def write(self, job_name, prow_job_id):
-        def _insert_to_db(_job_name, _prow_job_id):
-            self.cursor.execute(
-                f"INSERT INTO {self.table_name} " f"(job_name, prow_job_id) VALUES ('{_job_name}', '{_prow_job_id}')"
-            )
+    def get_queue_item(self, request_id):
+        with self._lock:
+            row = self.connection.execute(
+                f"SELECT request_id, hook_data, status, result, error, created_at, updated_at "
+                f"FROM {self.queue_table_name} WHERE request_id = ?",
+                (request_id,),
+            ).fetchone()
 
-        for _ in TimeoutSampler(
-            wait_timeout=20,
-            sleep=random.randint(1, 5),
-            func=_insert_to_db,
-            _job_name=job_name,
-            _prow_job_id=prow_job_id,
+        if not row:
+            return None
+
+        return {
+            "id": row[0],
+            "hook_data": json.loads(row[1]) if row[1] else None,
+            "status": row[2],
+            "result": json.loads(row[3]) if row[3] else None,
+            "error": row[4],
+            "created_at": row[5],
+            "updated_at": row[6],
+        }
+
+    def get_queue_items_by_status(self, statuses):
+        with self._lock:
+            rows = self.connection.execute(
+                f"SELECT request_id FROM {self.queue_table_name} "
+                f"WHERE status IN ({', '.join('?' * len(statuses))}) ORDER BY created_at",
+                tuple(statuses),
+            ).fetchall()
+
+        return [row[0] for row in rows]
+
+
+def get_db_metrics(db_path):
+    # Size (database and WAL files) and row counts, read with a separate connection
+    connection = sqlite3.connect(db_path, timeout=30)
+    try:
+        page_size, page_count, freelist_count = (
+            connection.execute(f"PRAGMA {pragma}").fetchone()[0]
+            for pragma in ("page_size", "page_count", "freelist_count")
+        )
+        return {
+            "size_bytes": sum(os.path.getsize(path) for path in (db_path, f"{db_path}-wal") if os.path.exists(path)),
+            "free_bytes": freelist_count * page_size,
+            "pages": page_count,
+            "jobs_rows": connection.execute("SELECT COUNT(*) FROM jobs").fetchone()[0],
+            "queue_rows": connection.execute("SELECT COUNT(*) FROM queue").fetchone()[0],
+        }
+
+    finally:
+        connection.close()
+
+
+def compact_db(db_path, retention, finished_statuses, batch_size=1000, pause=0.01):
+    # Deletes jobs older than `retention` seconds, and finished queue items not updated since, then returns the freed
+    # pages to the file system.
+    # A separate connection is used and every batch is a short transaction, so requests (which use the shared
+    # connection) wait at most for one batch.
+    start_time = time.monotonic()
+    connection = sqlite3.connect(db_path, timeout=30)
+    try:
+        deleted = {"jobs": 0, "queue": 0}
+        statuses_placeholders = ", ".join("?" * len(finished_statuses))
+        for table, query, params in (
+            ("jobs", "SELECT rowid FROM jobs WHERE created_at < ? LIMIT ?", (time.time() - retention,)),
+            (
+                "queue",
+                f"SELECT rowid FROM queue WHERE status IN ({statuses_placeholders}) AND updated_at < ? LIMIT ?",
+                (*finished_statuses, (datetime.now(timezone.utc) - timedelta(seconds=retention)).isoformat()),
+            ),
         ):
-            return self.connection.commit()
+            while True:
+                with connection:
+                    rowcount = connection.execute(
+                        f"DELETE FROM {table} WHERE rowid IN ({query})", (*params, batch_size)
+                    ).rowcount
+
+                deleted[table] += rowcount
+                if rowcount < batch_size:
+                    break
+
+                time.sleep(pause)
+
+        if connection.execute("PRAGMA auto_vacuum").fetchone()[0] != INCREMENTAL_AUTO_VACUUM:
+            # Databases created before incremental auto vacuum are rebuilt once
+            connection.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            connection.execute("VACUUM")
+
+        vacuumed_pages = 0
+        while free_pages := connection.execute("PRAGMA freelist_count").fetchone()[0]:
+            # Every step frees one page, all the steps must be fetched
+            connection.execute(f"PRAGMA incremental_vacuum({batch_size})").fetchall()
+            if not (freed_pages := free_pages - connection.execute("PRAGMA freelist_count").fetchone()[0]):
+                break
+
+            vacuumed_pages += freed_pages
+            time.sleep(pause)
+
+        return {"deleted": deleted, "vacuumed_pages": vacuumed_pages, "duration": time.monotonic() - start_time}
+
+    finally:
+        connection.close()
+
+
+class JobDBCompactor:
+    # Runs `compact_db` every `interval` seconds in a background thread
+    def __init__(self, logger, finished_statuses, job_db_path=None, retention=None, interval=None, batch_size=None):
+        self.logger = logger
+        self.finished_statuses = finished_statuses
+        self.db_path = str(job_db_path or DEFAULT_JOB_DB_PATH)
+        self.retention = retention or tts(ts=os.environ.get(JOB_DB_RETENTION_OS_ENV_STR, "720h"))
+        self.interval = interval or tts(ts=os.environ.get(JOB_DB_COMPACTION_INTERVAL_OS_ENV_STR, "1h"))
+        self.batch_size = batch_size or int(os.environ.get(JOB_DB_COMPACTION_BATCH_SIZE_OS_ENV_STR, 1000))
+        self.last_compaction = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if not self._thread:
+            self._thread = threading.Thread(target=self._run, name="job-db-compactor", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+
+    def compact(self):
+        # Makes sure the schema is up to date before deleting by `created_at`
+        get_db_connection(db_path=self.db_path)
+        self.last_compaction = compact_db(
+            db_path=self.db_path,
+            retention=self.retention,
+            finished_statuses=self.finished_statuses,
+            batch_size=self.batch_size,
+        )
+        self.last_compaction["finished_at"] = datetime.now(timezone.utc).isoformat()
+        self.logger.info(f"Re-trigger DB compaction: {self.last_compaction}, metrics: {self.metrics()}")
+        return self.last_compaction
+
+    def metrics(self):
+        return {**get_db_metrics(db_path=self.db_path), "last_compaction": self.last_compaction}
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.compact()
+            except Exception as ex:
+                self.logger.error(f"Re-trigger DB compaction failed: {ex}")
+
+            self._stop_event.wait(timeout=self.interval)
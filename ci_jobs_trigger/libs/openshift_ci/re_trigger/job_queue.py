@@ -0,0 +1,136 @@
+import os
+import queue
+import threading
+
+import shortuuid
+
+from ci_jobs_trigger.libs.openshift_ci.re_trigger.job_db import DB, JobDBCompactor
+from ci_jobs_trigger.libs.openshift_ci.re_trigger.re_trigger import JobTriggering
+from ci_jobs_trigger.utils.general import process_webhook_exception
+
+RE_TRIGGER_WORKERS_OS_ENV_STR = "OPENSHIFT_CI_RE_TRIGGER_WORKERS"
+QUEUED_STATUS = "queued"
+RUNNING_STATUS = "running"
+DONE_STATUS = "done"
+FAILED_STATUS = "failed"
+# Only the hook data used by the workers is stored in the queue
+QUEUE_HOOK_DATA_KEYS = (
+    "job_name",
+    "build_id",
+    "prow_job_id",
+    "trigger_token",
+    "slack_webhook_url",
+    "slack_errors_webhook_url",
+)
+
+
+class ReTriggerQueue:
+    def __init__(self, logger, workers=None, job_db_path=None):
+        self.logger = logger
+        self.workers = workers or int(os.environ.get(RE_TRIGGER_WORKERS_OS_ENV_STR, 4))
+        self.job_db_path = job_db_path
+        self.compactor = JobDBCompactor(
+            logger=logger, finished_statuses=(DONE_STATUS, FAILED_STATUS), job_db_path=job_db_path
+        )
+        self._queue = queue.Queue()
+        # Requests in `_queue` or being processed, a request is never queued twice
+        self._pending = set()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+
+            # Requests are persisted before they are queued; pick up whatever was not finished before a restart
+            with DB(job_db_path=self.job_db_path) as database:
+                unfinished_requests = database.get_queue_items_by_status(statuses=(QUEUED_STATUS, RUNNING_STATUS))
+                # Finished requests stored by older versions still have their hook data
+                database.clear_queue_items_hook_data(statuses=(DONE_STATUS, FAILED_STATUS))
+
+            for request_id in unfinished_requests:
+                if request_id in self._pending:
+                    continue
+
+                self.logger.info(f"Re-queue unfinished re-trigger request {request_id}")
+                self._pending.add(request_id)
+                self._queue.put(request_id)
+
+            for _ in range(self.workers):
+                thread = threading.Thread(target=self._worker, daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+            # Expired rows are removed in the background
+            self.compactor.start()
+
+    def enqueue(self, hook_data):
+        # Validate the hook data before accepting the request
+        JobTriggering(hook_data=hook_data, logger=self.logger)
+
+        request_id = shortuuid.random(length=10)
+        with self._lock:
+            with DB(job_db_path=self.job_db_path) as database:
+                database.add_queue_item(
+                    request_id=request_id,
+                    hook_data={key: hook_data[key] for key in QUEUE_HOOK_DATA_KEYS if key in hook_data},
+                    status=QUEUED_STATUS,
+                )
+
+            self._pending.add(request_id)
+            self._queue.put(request_id)
+
+        self.logger.info(f"Queued re-trigger request {request_id} for job {hook_data.get('job_name')}")
+        return request_id
+
+    def status(self, request_id):
+        with DB(job_db_path=self.job_db_path) as database:
+            item = database.get_queue_item(request_id=request_id)
+
+        if item:
+            item.pop("hook_data")
+
+        return item
+
+    def metrics(self):
+        return {**self.compactor.metrics(), "queued_requests": self._queue.qsize()}
+
+    def join(self):
+        self._queue.join()
+
+    def _worker(self):
+        while True:
+            request_id = self._queue.get()
+            try:
+                self._process(request_id=request_id)
+            finally:
+                with self._lock:
+                    self._pending.discard(request_id)
+
+                self._queue.task_done()
+
+    def _process(self, request_id):
+        with DB(job_db_path=self.job_db_path) as database:
+            hook_data = database.get_queue_item(request_id=request_id)["hook_data"]
+            database.update_queue_item(request_id=request_id, status=RUNNING_STATUS)
+
+        try:
+            result = JobTriggering(hook_data=hook_data, logger=self.logger).execute_trigger(
+                job_db_path=self.job_db_path
+            )
+            status, error = DONE_STATUS, None
+
+        except Exception as ex:
+            process_webhook_exception(
+                logger=self.logger,
+                ex=ex,
+                route="openshift-ci-re-trigger",
+                slack_errors_webhook_url=hook_data.get("slack_errors_webhook_url"),
+            )
+            result, status, error = None, FAILED_STATUS, str(ex)
+
+        with DB(job_db_path=self.job_db_path) as database:
+            database.update_queue_item(
+                request_id=request_id, status=status, result=result, error=error, clear_hook_data=True
+            )
@@ -1,29 +1,29 @@
 import json
-import xml
+from xml.etree import ElementTree
 
 import requests
 import shortuuid
-import xmltodict
-import yaml
-from timeout_sampler import TimeoutSampler
 
 from ci_jobs_trigger.libs.openshift_ci.re_trigger.job_db import DB
-from ci_jobs_trigger.libs.openshift_ci.utils.constants import GANGWAY_API_URL, PROW_LOGS_URL_PREFIX
+from ci_jobs_trigger.libs.openshift_ci.re_trigger.status_poller import get_prow_job_status_poller
+from ci_jobs_trigger.libs.openshift_ci.utils.constants import PROW_LOGS_URL_PREFIX
 from ci_jobs_trigger.utils.general import OpenshiftCiReTriggerError, send_slack_message
-from ci_jobs_trigger.libs.openshift_ci.utils.general import (
-    get_authorization_header,
-    openshift_ci_trigger_job,
-)
+from ci_jobs_trigger.utils.http_client import get_http_client
+from ci_jobs_trigger.utils.junit_stream import iter_junit_testcases
+from ci_jobs_trigger.libs.openshift_ci.utils.general import openshift_ci_trigger_job
+
+PRE_PHASE_TESTCASE_NAME = "Run multi-stage test pre phase"
+JUNIT_STREAM_CHUNK_SIZE = 64 * 1024
 
 
 class JobTriggering:
-    def __init__(self, hook_data, logger):
+    def __init__(self, hook_data, logger, status_poller=None):
         self.logger = logger
+        self.status_poller = status_poller or get_prow_job_status_poller(logger=logger)
 
         self.log_prefix = f"[{shortuuid.random(length=10)}]"
         self.hook_data = hook_data
         self.trigger_token = self.hook_data.get("trigger_token")
-        self.trigger_url = GANGWAY_API_URL
         self.build_id = self.hook_data.get("build_id")
         self.job_name = self.hook_data.get("job_name")
         self.prow_job_id = self.hook_data.get("prow_job_id")
@@ -33,10 +33,6 @@ class JobTriggering:
 
         self.slack_msg_prefix = self.generate_slack_msg_prefix()
 
-        self.logger.info(
-            f"{self.log_prefix} Start processing flow for Job {self.job_name}|build {self.build_id}|prow {self.prow_job_id}"
-        )
-
     def verify_hook_data(self):
         if not self.trigger_token:
             self.logger.error(f"{self.log_prefix} openshift ci token is mandatory.")
@@ -54,6 +50,9 @@ class JobTriggering:
             raise ValueError(f"{self.log_prefix} Missing parameters")
 
     def execute_trigger(self, job_db_path=None):
+        self.logger.info(
+            f"{self.log_prefix} Start processing flow for Job {self.job_name}|build {self.build_id}|prow {self.prow_job_id}"
+        )
         with DB(job_db_path=job_db_path) as database:
             if database.check_prow_job_id_in_db(job_name=self.job_name, prow_job_id=self.prow_job_id):
                 self.logger.warning(f"{self.log_prefix} Job was already auto-triggered. Exiting.")
@@ -74,10 +73,7 @@ class JobTriggering:
 
             raise OpenshiftCiReTriggerError(log_prefix=self.log_prefix, msg=err_msg)
 
-        tests_dict = self.get_testsuites_testcase_from_junit_operator(
-            junit_xml=self.get_tests_from_junit_operator_by_build_id()
-        )
-        if self.is_build_failed_on_setup(tests_dict=tests_dict):
+        if self.is_build_failed_on_setup(tests_dict=self.get_tests_from_junit_operator_by_build_id()):
             prow_job_id = self._trigger_job()
             send_slack_message(
                 message=f"{self.slack_msg_prefix}Job failed during `pre phase`, re-triggering job",
@@ -91,34 +87,19 @@ class JobTriggering:
 
         return True
 
-    def get_prow_job_status(self):
-        self.logger.info(f"{self.log_prefix}  Get job status.")
-        try:
-            response = self.get_url_content(
-                url=f"{self.trigger_url}/{self.prow_job_id}",
-                headers=get_authorization_header(trigger_token=self.trigger_token),
-            )
-
-            return yaml.safe_load(response).get("job_status")
-
-        except requests.exceptions.RequestException:
-            return ""
-
     def wait_for_job_completed(self):
         self.logger.info(f"{self.log_prefix} Waiting for build to end.")
-        sampler = TimeoutSampler(
-            wait_timeout=600,
-            sleep=60,
-            print_log=False,
-            func=self.get_prow_job_status,
-        )
-        for job_status in sampler:
-            if not job_status:
-                self.logger.error(f"{self.log_prefix} Prow build not found")
-                return False
-            if job_status != "PENDING":
-                self.logger.info(f"{self.log_prefix} Job ended. Status: {job_status}")
-                return True
+        job_status = self.status_poller.wait(prow_job_id=self.prow_job_id, trigger_token=self.trigger_token)
+        if job_status is None:
+            self.logger.error(f"{self.log_prefix} Timeout waiting for prow build to end")
+            return False
+
+        if not job_status:
+            self.logger.error(f"{self.log_prefix} Prow build not found")
+            return False
+
+        self.logger.info(f"{self.log_prefix} Job ended. Status: {job_status}")
+        return True
 
     def _trigger_job(self):
         self.logger.info(f"{self.log_prefix} Trigger job.")
@@ -142,43 +123,45 @@ class JobTriggering:
         return prow_job_id
 
     def get_tests_from_junit_operator_by_build_id(self):
+        # The testcases are yielded while junit_operator.xml is downloaded; the download stops when the consumer stops
         self.logger.info(f"{self.log_prefix} Get tests from junit_operator.xml")
         url = (
             "https://gcsweb-ci.apps.ci.l2s4.p1.openshiftapps.com/gcs/test-platform-results/logs/"
             f"{self.job_name}/{self.build_id}/artifacts/junit_operator.xml"
         )
-        response = self.get_url_content(url=url)
-
+        response = self.get_url_response(url=url, stream=True)
         try:
-            return xmltodict.parse(response)
-        except xml.parsers.expat.ExpatError as _:
-            self.logger.error(f"{self.log_prefix} Failed to read {url}. Response: {response}")
+            yield from iter_junit_testcases(chunks=response.iter_content(chunk_size=JUNIT_STREAM_CHUNK_SIZE))
+
+        except ElementTree.ParseError as ex:
+            self.logger.error(f"{self.log_prefix} Failed to read {url}: {ex}")
             raise
 
-    @staticmethod
-    def get_testsuites_testcase_from_junit_operator(junit_xml):
-        return junit_xml["testsuites"]["testsuite"]["testcase"]
+        finally:
+            response.close()
 
     def is_build_failed_on_setup(self, tests_dict):
+        # Stops at the pre phase testcase, the rest of a streamed junit is not read
         for test in tests_dict:
-            if test.get("failure") and test["@name"] == "Run multi-stage test pre phase":
-                self.logger.info(f"{self.log_prefix} Job failed during `pre phase`.")
-                return True
+            if test["@name"] == PRE_PHASE_TESTCASE_NAME:
+                if test.get("failure"):
+                    self.logger.info(f"{self.log_prefix} Job failed during `pre phase`.")
+                    return True
+
+                break
 
         self.logger.info(f"{self.log_prefix} Job did not fail during `pre phase` and will not be re-triggered.")
         return False
 
-    def get_url_content(self, **kwargs):
+    def get_url_response(self, **kwargs):
         url = kwargs["url"]
         self.logger.info(f"{self.log_prefix} Get content from {url}")
-        response = requests.get(**kwargs)
-
-        response_text = response.text
+        response = get_http_client().get(**kwargs)
         if response.ok:
-            return response_text
+            return response
 
         raise requests.exceptions.RequestException(
-            f"Failed to retrieve url {url} on {response_text}. Status {response.status_code}"
+            f"Failed to retrieve url {url} on {response.text}. Status {response.status_code}"
         )
 
     def generate_slack_msg_prefix(self):
@@ -0,0 +1,116 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import yaml
+
+from ci_jobs_trigger.libs.openshift_ci.utils.constants import GANGWAY_API_URL
+from ci_jobs_trigger.libs.openshift_ci.utils.general import get_authorization_header
+from ci_jobs_trigger.utils.http_client import get_http_client
+
+PENDING_STATUS = "PENDING"
+_POLLER = None
+_POLLER_LOCK = threading.Lock()
+
+
+class _Waiter:
+    def __init__(self):
+        self.event = threading.Event()
+        self.status = None
+
+
+class ProwJobStatusPoller:
+    def __init__(self, logger, interval=60, max_workers=8, session=None):
+        self.logger = logger
+        self.interval = interval
+        self.max_workers = max_workers
+        self.session = session or get_http_client()
+        self.requests_count = 0
+        self._waiters = {}
+        self._trigger_tokens = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def wait(self, prow_job_id, trigger_token, timeout=600):
+        # Returns the job status once it is not `PENDING`, an empty string if the job was not found or None on timeout
+        waiter = _Waiter()
+        with self._lock:
+            self._waiters.setdefault(prow_job_id, []).append(waiter)
+            self._trigger_tokens[prow_job_id] = trigger_token
+            if not self._thread:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+        if not waiter.event.wait(timeout=timeout):
+            with self._lock:
+                if waiter in self._waiters.get(prow_job_id, []):
+                    self._waiters[prow_job_id].remove(waiter)
+                    if not self._waiters[prow_job_id]:
+                        self._waiters.pop(prow_job_id)
+                        self._trigger_tokens.pop(prow_job_id)
+
+        return waiter.status
+
+    def poll(self):
+        with self._lock:
+            prow_job_ids = {_id: self._trigger_tokens[_id] for _id in self._waiters}
+
+        if not prow_job_ids:
+            return
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            statuses = dict(
+                zip(
+                    prow_job_ids,
+                    executor.map(self.get_prow_job_status, prow_job_ids, prow_job_ids.values()),
+                )
+            )
+
+        with self._lock:
+            for prow_job_id, job_status in statuses.items():
+                if job_status == PENDING_STATUS:
+                    continue
+
+                for waiter in self._waiters.pop(prow_job_id, []):
+                    waiter.status = job_status
+                    waiter.event.set()
+
+                self._trigger_tokens.pop(prow_job_id, None)
+
+    def get_prow_job_status(self, prow_job_id, trigger_token):
+        self.logger.info(f"Get prow job {prow_job_id} status.")
+        with self._lock:
+            self.requests_count += 1
+
+        try:
+            response = self.session.get(
+                url=f"{GANGWAY_API_URL}/{prow_job_id}",
+                headers=get_authorization_header(trigger_token=trigger_token),
+            )
+            if not response.ok:
+                return ""
+
+            return yaml.safe_load(response.text).get("job_status")
+
+        except requests.exceptions.RequestException:
+            return ""
+
+    def _run(self):
+        while True:
+            try:
+                self.poll()
+            except Exception as ex:
+                self.logger.error(f"Failed to poll prow jobs status. error: {ex}")
+
+            time.sleep(self.interval)
+
+
+def get_prow_job_status_poller(logger):
+    global _POLLER
+
+    with _POLLER_LOCK:
+        if not _POLLER:
+            _POLLER = ProwJobStatusPoller(logger=logger)
+
+        return _POLLER
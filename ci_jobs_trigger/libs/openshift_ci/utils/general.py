@@ -1,10 +1,9 @@
-import requests
-
 from ci_jobs_trigger.libs.openshift_ci.utils.constants import GANGWAY_API_URL
+from ci_jobs_trigger.utils.http_client import get_http_client
 
 
 def openshift_ci_trigger_job(job_name, trigger_token):
-    return requests.post(
+    return get_http_client().post(
         url=f"{GANGWAY_API_URL}/{job_name}",
         headers=get_authorization_header(trigger_token=trigger_token),
         json={"job_execution_type": "1"},
@@ -0,0 +1,265 @@
+from __future__ import annotations
+import json
+import logging
+import os
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+from semver import Version
+
+JOBS_LEDGER_KEY: str = "jobs_ledger"
+JOB_SUCCEEDED_STATUS: str = "succeeded"
+JOB_PENDING_STATUS: str = "pending"
+JOB_TRIGGERING_STATUS: str = "triggering"
+
+
+def get_version_sort_key(version: str) -> str:
+    # Text key which sorts like the versions (4.13.9 < 4.13.10, 4.14.0-rc.2 < 4.14.0-rc.10 < 4.14.0)
+    _version = Version.parse(version)
+    if _version.prerelease:
+        prerelease = ".".join(
+            part.zfill(10) if part.isdigit() else part for part in str(_version.prerelease).split(".")
+        )
+        release = f"0{prerelease}"
+    else:
+        release = "1"
+
+    return f"{_version.major:010d}.{_version.minor:010d}.{_version.patch:010d}.{release}"
+
+
+def get_processed_versions_db_path(config: Dict) -> str:
+    if db_path := config.get("processed_versions_db_path"):
+        return db_path
+
+    return str(Path(config["processed_versions_file_path"]).with_suffix(".db"))
+
+
+class ProcessedVersionsDB:
+    def __init__(self, db_path: str, logger: logging.Logger, json_file_path: str | None = None) -> None:
+        self.db_path = db_path
+        self.logger = logger
+        self.json_file_path = json_file_path
+        self._connection: sqlite3.Connection | None = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            raise sqlite3.ProgrammingError(
+                f"{self.db_path} is not open, use {type(self).__name__} as a context manager"
+            )
+
+        return self._connection
+
+    def __enter__(self) -> ProcessedVersionsDB:
+        # The scheduled run and the `/openshift-ci-zstream-trigger` route may write at the same time, writers wait for
+        # the lock instead of failing
+        self._connection = sqlite3.connect(self.db_path, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS processed_versions("
+                "base_version TEXT NOT NULL, version TEXT NOT NULL, sort_key TEXT NOT NULL, processed_at REAL, "
+                "PRIMARY KEY (base_version, version))"
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS processed_versions_sort_key "
+                "ON processed_versions (base_version, sort_key)"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS jobs_ledger("
+                "base_version TEXT NOT NULL, version TEXT NOT NULL, job TEXT NOT NULL, status TEXT, "
+                "attempts INTEGER, next_retry_at REAL, execution_id TEXT, PRIMARY KEY (base_version, version, job))"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS imported_files(path TEXT PRIMARY KEY, imported_at REAL)"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS accepted_versions_cache("
+                "id INTEGER PRIMARY KEY CHECK (id = 0), versions TEXT, fetched_at REAL, hits INTEGER, misses INTEGER)"
+            )
+
+        if self.json_file_path:
+            self.import_json_file(json_file_path=self.json_file_path)
+
+        return self
+
+    def __exit__(self, exc_type: Any, exc_val: Any, exc_tb: Any) -> None:
+        if self._connection:
+            self._connection.close()
+            self._connection = None
+
+    def import_json_file(self, json_file_path: str) -> bool:
+        # One-time import of a processed versions json file (`{<base version>: [<version>, ...], "jobs_ledger": ...}`)
+        json_file_path = os.path.abspath(json_file_path)
+        if not os.path.isfile(json_file_path):
+            return False
+
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            if self.connection.execute("SELECT 1 FROM imported_files WHERE path = ?", (json_file_path,)).fetchone():
+                return False
+
+            try:
+                with open(json_file_path) as fd:
+                    content = json.load(fd)
+            except Exception as exp:
+                self.logger.error(f"Failed to load processed versions file: {json_file_path}. error: {exp}")
+                content = {}
+
+            jobs_ledger = content.pop(JOBS_LEDGER_KEY, {})
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO processed_versions (base_version, version, sort_key, processed_at) "
+                "VALUES (?, ?, ?, ?)",
+                [
+                    (base_version, version, get_version_sort_key(version=version), None)
+                    for base_version, versions in content.items()
+                    for version in versions
+                ],
+            )
+            for base_version, ledger in jobs_ledger.items():
+                self._write_jobs_ledger(
+                    base_version=base_version, version=ledger["version"], jobs_ledger=ledger["jobs"]
+                )
+
+            self.connection.execute(
+                "INSERT INTO imported_files (path, imported_at) VALUES (?, ?)", (json_file_path, time.time())
+            )
+
+        self.logger.info(f"Imported processed versions file {json_file_path} into {self.db_path}")
+        return True
+
+    def add_processed_version(self, base_version: str, version: str) -> None:
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR IGNORE INTO processed_versions (base_version, version, sort_key, processed_at) "
+                "VALUES (?, ?, ?, ?)",
+                (base_version, version, get_version_sort_key(version=version), time.time()),
+            )
+
+    def get_latest_processed_version(self, base_version: str) -> str | None:
+        row = self.connection.execute(
+            "SELECT version FROM processed_versions WHERE base_version = ? ORDER BY sort_key DESC LIMIT 1",
+            (base_version,),
+        ).fetchone()
+        return row[0] if row else None
+
+    def get_processed_versions(self, base_version: str) -> List[str]:
+        rows = self.connection.execute(
+            "SELECT version FROM processed_versions WHERE base_version = ? ORDER BY sort_key DESC",
+            (base_version,),
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def is_processed(self, base_version: str, version: str) -> bool:
+        # True if `version` or a newer version of `base_version` was processed
+        return bool(
+            self.connection.execute(
+                "SELECT EXISTS(SELECT 1 FROM processed_versions WHERE base_version = ? AND sort_key >= ?)",
+                (base_version, get_version_sort_key(version=version)),
+            ).fetchone()[0]
+        )
+
+    def get_jobs_ledger(self, base_version: str, version: str) -> Dict:
+        rows = self.connection.execute(
+            "SELECT job, status, attempts, next_retry_at, execution_id FROM jobs_ledger "
+            "WHERE base_version = ? AND version = ?",
+            (base_version, version),
+        ).fetchall()
+        jobs_ledger: Dict = {}
+        for job, status, attempts, next_retry_at, execution_id in rows:
+            jobs_ledger[job] = {"status": status, "attempts": attempts, "execution_id": execution_id}
+            if next_retry_at is not None:
+                jobs_ledger[job]["next_retry_at"] = next_retry_at
+
+        return jobs_ledger
+
+    def claim_jobs(self, base_version: str, version: str, jobs: List[str], claim_timeout: int) -> Dict[str, int]:
+        # Marks the `jobs` of `version` which are due (not succeeded and not waiting for a retry) as triggering, in one
+        # transaction, and returns their attempts. Concurrent runs never claim the same job; a claim expires after
+        # `claim_timeout` seconds in case its run died before writing the trigger result.
+        now = time.time()
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            self.connection.execute(
+                "DELETE FROM jobs_ledger WHERE base_version = ? AND version != ?", (base_version, version)
+            )
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO jobs_ledger (base_version, version, job, status, attempts) VALUES (?, ?, ?, ?, 0)",
+                [(base_version, version, job, JOB_PENDING_STATUS) for job in jobs],
+            )
+            rows = self.connection.execute(
+                "SELECT job, attempts FROM jobs_ledger WHERE base_version = ? AND version = ? AND status != ? "
+                "AND COALESCE(next_retry_at, 0) <= ?",
+                (base_version, version, JOB_SUCCEEDED_STATUS, now),
+            ).fetchall()
+            claimed_jobs = {job: attempts for job, attempts in rows if job in jobs}
+            self.connection.executemany(
+                "UPDATE jobs_ledger SET status = ?, next_retry_at = ? WHERE base_version = ? AND version = ? AND job = ?",
+                [(JOB_TRIGGERING_STATUS, now + claim_timeout, base_version, version, job) for job in claimed_jobs],
+            )
+
+        return claimed_jobs
+
+    def get_accepted_versions(self, ttl: int) -> Dict | None:
+        # The cached accepted cluster versions (counted as a hit), or None if they were fetched `ttl` seconds ago or more
+        with self.connection:
+            row = self.connection.execute(
+                "SELECT versions, fetched_at FROM accepted_versions_cache WHERE id = 0"
+            ).fetchone()
+            if not row or row[0] is None or time.time() - row[1] >= ttl:
+                return None
+
+            self.connection.execute("UPDATE accepted_versions_cache SET hits = hits + 1 WHERE id = 0")
+
+        return json.loads(row[0])
+
+    def set_accepted_versions(self, versions: Dict | None) -> None:
+        # Stores newly fetched accepted cluster versions (counted as a miss); None is not cached
+        with self.connection:
+            self.connection.execute(
+                "INSERT INTO accepted_versions_cache (id, versions, fetched_at, hits, misses) VALUES (0, ?, ?, 0, 1) "
+                "ON CONFLICT (id) DO UPDATE SET versions = excluded.versions, fetched_at = excluded.fetched_at, "
+                "misses = misses + 1",
+                (None if versions is None else json.dumps(versions), time.time()),
+            )
+
+    def get_accepted_versions_stats(self) -> Dict:
+        row = self.connection.execute(
+            "SELECT fetched_at, hits, misses FROM accepted_versions_cache WHERE id = 0"
+        ).fetchone()
+        fetched_at, hits, misses = row or (None, 0, 0)
+        return {
+            "age": round(time.time() - fetched_at, 3) if fetched_at else None,
+            "hits": hits,
+            "misses": misses,
+        }
+
+    def update_jobs_ledger(self, base_version: str, version: str, jobs_ledger: Dict) -> None:
+        with self.connection:
+            self._write_jobs_ledger(base_version=base_version, version=version, jobs_ledger=jobs_ledger)
+
+    def _write_jobs_ledger(self, base_version: str, version: str, jobs_ledger: Dict) -> None:
+        # Only the ledger of the latest version of `base_version` is kept
+        self.connection.execute(
+            "DELETE FROM jobs_ledger WHERE base_version = ? AND version != ?", (base_version, version)
+        )
+        self.connection.executemany(
+            "INSERT INTO jobs_ledger (base_version, version, job, status, attempts, next_retry_at, execution_id) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (base_version, version, job) DO UPDATE SET "
+            "status = excluded.status, attempts = excluded.attempts, next_retry_at = excluded.next_retry_at, "
+            "execution_id = excluded.execution_id",
+            [
+                (
+                    base_version,
+                    version,
+                    job,
+                    job_ledger.get("status"),
+                    job_ledger.get("attempts", 0),
+                    job_ledger.get("next_retry_at"),
+                    job_ledger.get("execution_id"),
+                )
+                for job, job_ledger in jobs_ledger.items()
+            ],
+        )
@@ -1,61 +1,98 @@
 from __future__ import annotations
-import json
 import logging
+import threading
 import time
-import datetime
+from concurrent.futures import ThreadPoolExecutor
 
-from croniter import CroniterBadCronError, croniter
-from pyhelper_utils.general import stt, tts
-from typing import Dict, List
+from typing import Dict, List, Optional
 
 from ocp_utilities.cluster_versions import get_accepted_cluster_versions
-from semver import Version
-import packaging.version
+from pyhelper_utils.general import tts
 
-from ci_jobs_trigger.utils.constant import DAYS_TO_SECONDS
 from ci_jobs_trigger.utils.general import get_config, send_slack_message
+from ci_jobs_trigger.utils.http_client import get_http_client
+from ci_jobs_trigger.utils.scheduler import get_scheduler
+from ci_jobs_trigger.utils.slack_notifier import slack_digest
 from ci_jobs_trigger.libs.openshift_ci.utils.general import openshift_ci_trigger_job
+from ci_jobs_trigger.libs.openshift_ci.zstream_trigger.processed_versions_db import (
+    JOB_PENDING_STATUS,
+    JOB_SUCCEEDED_STATUS,
+    ProcessedVersionsDB,
+    get_processed_versions_db_path,
+)
 
 
 OPENSHIFT_CI_ZSTREAM_TRIGGER_CONFIG_OS_ENV_STR: str = "OPENSHIFT_CI_ZSTREAM_TRIGGER_CONFIG"
 LOG_PREFIX: str = "Zstream trigger:"
+DEFAULT_MAX_PARALLEL_TRIGGERS: int = 5
+# A job claimed by a run which died before writing its trigger result can be claimed again after this long
+JOB_CLAIM_TIMEOUT: str = "15m"
 
 
-def processed_versions_file(processed_versions_file_path: str, logger: logging.Logger) -> Dict:
-    try:
-        with open(processed_versions_file_path) as fd:
-            return json.load(fd)
-    except Exception as exp:
-        logger.error(
-            f"{LOG_PREFIX} Failed to load processed versions file: {processed_versions_file_path}. error: {exp}"
-        )
-        return {}
+class AcceptedClusterVersionsCache:
+    # The accepted release graph is the same for all versions of a run; keep it for a short time so bursts of manual
+    # triggers do not fetch it again. It is stored in the processed versions DB, so the scheduled runs and the
+    # `/openshift-ci-zstream-trigger` route (separate processes) share it. Concurrent callers of a process wait for a
+    # single fetch.
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+
+    def get(self, config: Dict, logger: logging.Logger, ttl: int) -> Optional[Dict]:
+        with self._lock, get_processed_versions_db(config=config, logger=logger) as processed_versions_db:
+            if (versions := processed_versions_db.get_accepted_versions(ttl=ttl)) is not None:
+                return versions
+
+            versions = get_accepted_cluster_versions()
+            processed_versions_db.set_accepted_versions(versions=versions)
+            return versions
 
+    @staticmethod
+    def stats(config: Dict, logger: logging.Logger) -> Dict:
+        with get_processed_versions_db(config=config, logger=logger) as processed_versions_db:
+            return processed_versions_db.get_accepted_versions_stats()
 
-def update_processed_version(
-    base_version: str, version: str, processed_versions_file_path: str, logger: logging.Logger
-) -> None:
-    processed_versions_file_content = processed_versions_file(
-        processed_versions_file_path=processed_versions_file_path, logger=logger
+
+ACCEPTED_CLUSTER_VERSIONS_CACHE = AcceptedClusterVersionsCache()
+
+
+def get_processed_versions_db(config: Dict, logger: logging.Logger) -> ProcessedVersionsDB:
+    # An existing processed versions json file is imported on first use
+    return ProcessedVersionsDB(
+        db_path=get_processed_versions_db_path(config=config),
+        logger=logger,
+        json_file_path=config.get("processed_versions_file_path"),
     )
-    processed_versions_file_content.setdefault(base_version, []).append(version)
-    processed_versions_file_content[base_version] = list(set(processed_versions_file_content[base_version]))
-    processed_versions_file_content[base_version].sort(key=packaging.version.Version, reverse=True)
-    with open(processed_versions_file_path, "w") as fd:
-        json.dump(processed_versions_file_content, fd)
 
 
-def already_processed_version(
-    base_version: str, new_version: str, processed_versions_file_path: str, logger: logging.Logger
-) -> bool:
-    if all_versions := processed_versions_file(
-        processed_versions_file_path=processed_versions_file_path, logger=logger
-    ).get(base_version):
-        return Version.parse(new_version) <= Version.parse(all_versions[0])
-    return False
+def get_retry_backoff(attempts: int, backoff: int, max_backoff: int) -> int:
+    return min(backoff * 2 ** max(attempts - 1, 0), max_backoff)
 
 
-def trigger_jobs(config: Dict, jobs: List, logger: logging.Logger, zstream_version: str) -> bool:
+def trigger_job(job: str, trigger_token: str, logger: logging.Logger) -> Dict:
+    job_res: Dict = {"ok": False, "execution_id": None, "latency": None}
+    start_time = time.monotonic()
+    try:
+        res = openshift_ci_trigger_job(job_name=job, trigger_token=trigger_token)
+        job_res["ok"] = bool(res.ok)
+        if res.ok:
+            try:
+                job_res["execution_id"] = res.json().get("id")
+            except ValueError:
+                logger.warning(f"{LOG_PREFIX} Could not get execution id for job {job}")
+
+        else:
+            job_res["error"] = f"{res.status_code}: {res.text}"
+
+    except Exception as ex:
+        job_res["error"] = str(ex)
+
+    job_res["latency"] = round(time.monotonic() - start_time, 3)
+    return job_res
+
+
+def trigger_jobs(config: Dict, jobs: List, logger: logging.Logger, zstream_version: str) -> Dict:
+    # Returns {"triggered": <bool>, "jobs": {<job>: {"ok", "execution_id", "latency"[, "error"]}}}
+    trigger_res: Dict = {"triggered": False, "jobs": {}}
     failed_triggers_jobs: List = []
     successful_triggers_jobs: List = []
     if not jobs:
@@ -66,16 +103,22 @@ def trigger_jobs(config: Dict, jobs: List, logger: logging.Logger, zstream_versi
             webhook_url=config.get("slack_errors_webhook_url"),
             logger=logger,
         )
-        return False
+        return trigger_res
 
     else:
-        for job in jobs:
-            res = openshift_ci_trigger_job(job_name=job, trigger_token=config["trigger_token"])
+        max_parallel_triggers = min(int(config.get("max_parallel_triggers", DEFAULT_MAX_PARALLEL_TRIGGERS)), len(jobs))
+        with ThreadPoolExecutor(max_workers=max(max_parallel_triggers, 1)) as executor:
+            jobs_res = executor.map(
+                lambda _job: trigger_job(job=_job, trigger_token=config["trigger_token"], logger=logger), jobs
+            )
+            for job, job_res in zip(jobs, jobs_res):
+                trigger_res["jobs"][job] = job_res
+                if job_res["ok"]:
+                    successful_triggers_jobs.append(job)
+                else:
+                    failed_triggers_jobs.append(job)
 
-            if res.ok:
-                successful_triggers_jobs.append(job)
-            else:
-                failed_triggers_jobs.append(job)
+        logger.info(f"{LOG_PREFIX} Trigger results for version {zstream_version}: {trigger_res['jobs']}")
 
         if successful_triggers_jobs:
             success_msg: str = f"Triggered {len(successful_triggers_jobs)} jobs: {successful_triggers_jobs} for version {zstream_version}"
@@ -85,7 +128,7 @@ def trigger_jobs(config: Dict, jobs: List, logger: logging.Logger, zstream_versi
                 webhook_url=config.get("slack_webhook_url"),
                 logger=logger,
             )
-            return True
+            trigger_res["triggered"] = True
 
         if failed_triggers_jobs:
             err_msg: str = f"Failed to trigger {len(failed_triggers_jobs)} jobs: {failed_triggers_jobs} for version {zstream_version}"
@@ -95,21 +138,26 @@ def trigger_jobs(config: Dict, jobs: List, logger: logging.Logger, zstream_versi
                 webhook_url=config.get("slack_errors_webhook_url"),
                 logger=logger,
             )
-            return False
 
-    return False
+    return trigger_res
 
 
 def process_and_trigger_jobs(logger: logging.Logger, version: str | None = None) -> Dict:
-    trigger_res: Dict = {}
     config = get_config(
         os_environ=OPENSHIFT_CI_ZSTREAM_TRIGGER_CONFIG_OS_ENV_STR,
         logger=logger,
     )
     if not config:
         logger.error(f"{LOG_PREFIX} Could not get config.")
-        return trigger_res
+        return {}
+
+    # With `slack_digest`, the run notifications are sent as one message when it ends
+    with slack_digest(title=f"{LOG_PREFIX} Z-stream jobs", logger=logger, enabled=config.get("slack_digest")):
+        return _process_and_trigger_jobs(config=config, logger=logger, version=version)
+
 
+def _process_and_trigger_jobs(config: Dict, logger: logging.Logger, version: str | None) -> Dict:
+    trigger_res: Dict = {}
     if not (versions_from_config := config.get("versions")):
         logger.error(f"{LOG_PREFIX} No versions found in config.yaml")
         return trigger_res
@@ -120,14 +168,13 @@ def process_and_trigger_jobs(logger: logging.Logger, version: str | None = None)
             raise ValueError(f"Version {version} not found in config.yaml")
 
         logger.info(f"{LOG_PREFIX} Triggering all jobs from config file under version {version}")
-        triggered = trigger_jobs(
+        trigger_res[version] = trigger_jobs(
             config=config, jobs=versions_from_config[version], logger=logger, zstream_version=version
         )
-        trigger_res[version] = triggered
         return trigger_res
 
     else:
-        _processed_versions_file_path = config["processed_versions_file_path"]
+        _all_versions: Dict = {}
         for _version, _jobs in versions_from_config.items():
             if not _jobs:
                 slack_error_url = config.get("slack_webhook_error_url")
@@ -147,14 +194,35 @@ def process_and_trigger_jobs(logger: logging.Logger, version: str | None = None)
                 _wanted_version = _version
                 _version_channel = "stable"
 
-            _all_versions = get_accepted_cluster_versions()
-            _latest_version = _all_versions.get(_version_channel)[_wanted_version][0]
-            if already_processed_version(
-                base_version=_version,
-                new_version=_latest_version,
-                processed_versions_file_path=_processed_versions_file_path,
-                logger=logger,
-            ):
+            if not _all_versions:
+                _all_versions = (
+                    ACCEPTED_CLUSTER_VERSIONS_CACHE.get(
+                        config=config, logger=logger, ttl=tts(ts=config.get("accepted_versions_cache_ttl", "5m"))
+                    )
+                    or {}
+                )
+                logger.info(
+                    f"{LOG_PREFIX} Accepted cluster versions cache: "
+                    f"{ACCEPTED_CLUSTER_VERSIONS_CACHE.stats(config=config, logger=logger)}"
+                )
+
+            _channel_versions = _all_versions.get(_version_channel) or {}
+            if not _channel_versions.get(_wanted_version):
+                no_version_msg = f"{LOG_PREFIX} No accepted version found for {_wanted_version}:{_version_channel}"
+                logger.error(no_version_msg)
+                send_slack_message(
+                    message=no_version_msg,
+                    webhook_url=config.get("slack_errors_webhook_url"),
+                    logger=logger,
+                )
+                trigger_res[_version] = "No accepted version found"
+                continue
+
+            _latest_version = _channel_versions[_wanted_version][0]
+            with get_processed_versions_db(config=config, logger=logger) as processed_versions_db:
+                _already_processed = processed_versions_db.is_processed(base_version=_version, version=_latest_version)
+
+            if _already_processed:
                 logger.info(f"{LOG_PREFIX} Version {_wanted_version}:{_version_channel} already processed, skipping")
                 trigger_res[_version] = "Already processed"
                 continue
@@ -162,61 +230,105 @@ def process_and_trigger_jobs(logger: logging.Logger, version: str | None = None)
             logger.info(
                 f"{LOG_PREFIX} New Z-stream version {_latest_version}:{_version_channel} found, triggering jobs: {_jobs}"
             )
-            if trigger_jobs(config=config, jobs=_jobs, logger=logger, zstream_version=_latest_version):
-                update_processed_version(
-                    base_version=_version,
-                    version=str(_latest_version),
-                    processed_versions_file_path=_processed_versions_file_path,
-                    logger=logger,
+            trigger_res[_version] = trigger_pending_jobs(
+                config=config,
+                base_version=_version,
+                version=str(_latest_version),
+                jobs=_jobs,
+                logger=logger,
+            )
+
+        return trigger_res
+
+
+def trigger_pending_jobs(config: Dict, base_version: str, version: str, jobs: List, logger: logging.Logger) -> Dict:
+    # Triggers the jobs of `version` which did not succeed yet, failed jobs are retried on the next runs with exponential
+    # backoff. The version is marked as processed only once all its jobs were triggered.
+    # The scheduled run and the `/openshift-ci-zstream-trigger` route may run at the same time; a job is triggered only
+    # by the run which claimed it.
+    with get_processed_versions_db(config=config, logger=logger) as processed_versions_db:
+        claimed_jobs = processed_versions_db.claim_jobs(
+            base_version=base_version, version=version, jobs=jobs, claim_timeout=tts(ts=JOB_CLAIM_TIMEOUT)
+        )
+
+    trigger_res: Dict = {"jobs": {}}
+    if claimed_jobs:
+        if retried_jobs := [job for job, attempts in claimed_jobs.items() if attempts]:
+            logger.info(f"{LOG_PREFIX} Version {version}: retrying jobs {retried_jobs}")
+
+        trigger_res["jobs"] = trigger_jobs(
+            config=config, jobs=list(claimed_jobs), logger=logger, zstream_version=version
+        )["jobs"]
+        backoff = tts(ts=config.get("trigger_retry_backoff", "10m"))
+        max_backoff = tts(ts=config.get("trigger_retry_max_backoff", "24h"))
+        now = time.time()
+        claimed_jobs_ledger: Dict = {}
+        for job, job_res in trigger_res["jobs"].items():
+            job_ledger = claimed_jobs_ledger[job] = {
+                "attempts": claimed_jobs[job] + 1,
+                "execution_id": job_res["execution_id"],
+            }
+            if job_res["ok"]:
+                job_ledger["status"] = JOB_SUCCEEDED_STATUS
+            else:
+                job_ledger["status"] = JOB_PENDING_STATUS
+                job_ledger["next_retry_at"] = now + get_retry_backoff(
+                    attempts=job_ledger["attempts"], backoff=backoff, max_backoff=max_backoff
                 )
-                trigger_res[_version] = "Triggered"
-                continue
 
+        with get_processed_versions_db(config=config, logger=logger) as processed_versions_db:
+            processed_versions_db.update_jobs_ledger(
+                base_version=base_version, version=version, jobs_ledger=claimed_jobs_ledger
+            )
+
+    with get_processed_versions_db(config=config, logger=logger) as processed_versions_db:
+        jobs_ledger = processed_versions_db.get_jobs_ledger(base_version=base_version, version=version)
+
+    # Jobs which were not claimed wait for their next retry or are being triggered by another run
+    pending_jobs = [job for job in jobs if jobs_ledger.get(job, {}).get("status") != JOB_SUCCEEDED_STATUS]
+    if pending_jobs and not claimed_jobs:
+        logger.info(f"{LOG_PREFIX} Version {version}: jobs {pending_jobs} are waiting for their next retry")
+        trigger_res["status"] = "Pending retry"
         return trigger_res
 
+    if not pending_jobs:
+        with get_processed_versions_db(config=config, logger=logger) as processed_versions_db:
+            processed_versions_db.add_processed_version(base_version=base_version, version=version)
+        trigger_res["status"] = "Triggered"
+
+    elif any(jobs_ledger.get(job, {}).get("status") == JOB_SUCCEEDED_STATUS for job in jobs):
+        trigger_res["status"] = "Partially triggered"
+
+    else:
+        trigger_res["status"] = "Failed"
+
+    return trigger_res
+
+
+def get_zstream_trigger_metrics(logger: logging.Logger) -> Dict:
+    config = get_config(os_environ=OPENSHIFT_CI_ZSTREAM_TRIGGER_CONFIG_OS_ENV_STR, logger=logger)
+    if not config:
+        return {}
+
+    return {"accepted_versions_cache": ACCEPTED_CLUSTER_VERSIONS_CACHE.stats(config=config, logger=logger)}
+
 
 def monitor_and_trigger(logger: logging.Logger) -> None:
-    cron = None
-    run_interval = 0
     _config = get_config(
         os_environ=OPENSHIFT_CI_ZSTREAM_TRIGGER_CONFIG_OS_ENV_STR,
         logger=logger,
     )
-
-    if cron_schedule := _config.get("cron_schedule"):
-        cron = get_cron_iter(cron_schedule=cron_schedule, config=_config, logger=logger)
-        if not cron:
-            return
-
-    else:
-        run_interval = tts(ts=_config.get("run_interval", "24h"))
+    scheduler = get_scheduler(config=_config, logger=logger, log_prefix=LOG_PREFIX)
+    if not scheduler:
+        return
 
     while True:
         try:
-            if cron:
-                run_interval = int((cron.get_next(datetime.datetime) - datetime.datetime.now()).total_seconds())
-
-            if run_interval > 0:
-                logger.info(f"{LOG_PREFIX} Sleeping for {stt(seconds=run_interval)}...")
-                time.sleep(run_interval)
-
+            scheduler.wait()
             process_and_trigger_jobs(logger=logger)
 
         except Exception as ex:
             logger.warning(f"{LOG_PREFIX} Error: {ex}")
-            time.sleep(DAYS_TO_SECONDS)
-
-
-def get_cron_iter(cron_schedule: str, config: Dict, logger: logging.Logger) -> croniter | None:
-    try:
-        return croniter(cron_schedule, start_time=datetime.datetime.now(), day_or=False)
-    except CroniterBadCronError:
-        err_msg: str = f"Invalid cron schedule: {cron_schedule}"
-        logger.error(f"{LOG_PREFIX} {err_msg}")
-        send_slack_message(
-            message=err_msg,
-            webhook_url=config.get("slack_errors_webhook_url"),
-            logger=logger,
-        )
 
-        return None
+        finally:
+            logger.info(f"{LOG_PREFIX} HTTP client stats: {get_http_client().stats()}")
@@ -1,40 +1,205 @@
 import copy
+import hashlib
 import json
+import multiprocessing
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from json import JSONDecodeError
-from time import sleep
 
-import requests
+from botocore.exceptions import ClientError, ParamValidationError
 
 from ci_jobs_trigger.libs.utils.general import trigger_ci_job
-from ci_jobs_trigger.utils.constant import DAYS_TO_SECONDS
+from ci_jobs_trigger.utils.atomic_file import atomic_write
 from ci_jobs_trigger.utils.general import (
     send_slack_message,
     get_config,
     AddonsWebhookTriggerError,
+    S3WriteConflictError,
 )
+from ci_jobs_trigger.utils.http_client import get_http_client
+from ci_jobs_trigger.utils.json_stream import iter_json_array_items
+from ci_jobs_trigger.utils.scheduler import get_scheduler
+from ci_jobs_trigger.utils.slack_notifier import slack_digest
+from ci_jobs_trigger.utils.trigger_dispatcher import TriggerDispatcher
 from clouds.aws.session_clients import s3_client
 
 LOG_PREFIX = "iib-trigger:"
+CI_IIB_JOBS_TRIGGER_CONFIG_OS_ENV_STR = "CI_IIB_JOBS_TRIGGER_CONFIG"
+DATAGREPPER_QUERY_URL = (
+    "https://datagrepper.engineering.redhat.com/raw?topic=/topic/VirtualTopic.eng.ci.redhat-container-image.index.built"
+)
+DEFAULT_MAX_CONCURRENCY = 4
+DATAGREPPER_ROWS_PER_PAGE = 100
+DATAGREPPER_STREAM_CHUNK_SIZE = 64 * 1024
+S3_NOT_MODIFIED_ERROR_CODES = ("304", "NotModified")
+S3_WRITE_CONFLICT_ERROR_CODES = ("412", "PreconditionFailed", "409", "ConditionalRequestConflict")
+S3_WRITE_CONFLICT_RETRIES = 3
+
+
+class OperatorsIIBIndex:
+    # Per-cycle cache of datagrepper results; each operator is fetched once and its messages are indexed by ocp_version.
+    # `marks` holds, per operator, the last seen datagrepper message and the latest index per ocp_version, so only
+    # messages newer than the last seen one are requested.
+    # When `ocp_versions` is set, messages for other versions are dropped as they are read.
+    def __init__(self, logger, marks=None, ocp_versions=None, stream=False):
+        self.logger = logger
+        self.marks = marks or {}
+        self.ocp_versions = set(ocp_versions) if ocp_versions else None
+        self.stream = stream
+        self.requests_count = 0
+        self.fetch_timings = {}
+        self._operators = {}
+        self._lock = threading.Lock()
+
+    def fetch(self, operators_names, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+        operators_names = sorted(set(operators_names) - set(self._operators))
+        with ThreadPoolExecutor(max_workers=max(max_concurrency, 1)) as executor:
+            operators_data = executor.map(lambda _name: self._fetch(operator_name=_name), operators_names)
+            self._operators.update(zip(operators_names, operators_data))
+
+    def get(self, operator_name, ocp_version):
+        if operator_name not in self._operators:
+            self._operators[operator_name] = self._fetch(operator_name=operator_name)
+
+        return self._operators[operator_name].get(ocp_version, [])
+
+    def _fetch(self, operator_name):
+        start_time = time.monotonic()
+        with self._lock:
+            operator_mark = copy.deepcopy(self.marks.get(operator_name, {}))
+
+        if self.ocp_versions and not self.ocp_versions.issubset(operator_mark.get("ocp_versions", [])):
+            # Messages of the newly wanted versions were dropped before; read the operator history again
+            operator_mark = {"latest": operator_mark.get("latest", {})}
+
+        latest_indexes = operator_mark.get("latest", {})
+        last_timestamp = operator_mark.get("timestamp")
+        last_msg_id = operator_mark.get("msg_id")
+        page = pages = 1
+        while page <= pages:
+            with self._lock:
+                self.requests_count += 1
+
+            raw_messages, metadata = get_operator_data_from_url(
+                operator_name=operator_name,
+                logger=self.logger,
+                start=operator_mark.get("timestamp"),
+                page=page,
+                stream=self.stream,
+            )
+            for raw_msg in raw_messages:
+                if last_msg_id and raw_msg.get("msg_id") == last_msg_id:
+                    continue
 
+                if (msg_timestamp := raw_msg.get("timestamp")) and msg_timestamp >= (last_timestamp or 0):
+                    last_timestamp = msg_timestamp
+                    last_msg_id = raw_msg.get("msg_id")
 
-def get_operator_data_from_url(operator_name, ocp_version, logger):
-    logger.info(f"{LOG_PREFIX} Getting IIB data for {operator_name}")
-    datagrepper_query_url = (
-        "https://datagrepper.engineering.redhat.com/raw?topic=/topic/"
-        "VirtualTopic.eng.ci.redhat-container-image.index.built"
-    )
+                _index = raw_msg["msg"]["index"]
+                if self.ocp_versions and _index["ocp_version"] not in self.ocp_versions:
+                    continue
 
-    res = requests.get(
-        f"{datagrepper_query_url}&contains={operator_name}",
-        verify=False,
-    )
-    logger.info(f"{LOG_PREFIX} Done getting IIB data for {operator_name}")
+                _latest_index = latest_indexes.get(_index["ocp_version"])
+                if not _latest_index or is_newer_iib(
+                    index_image=_index["index_image"], other_index_image=_latest_index["index_image"]
+                ):
+                    latest_indexes[_index["ocp_version"]] = _index
+
+            # With streaming, keys after `raw_messages` are read only once all the messages were consumed
+            pages = metadata.get("pages", 1)
+            page += 1
+
+        operator_mark = {"timestamp": last_timestamp, "msg_id": last_msg_id, "latest": latest_indexes}
+        if self.ocp_versions:
+            operator_mark["ocp_versions"] = sorted(self.ocp_versions)
+
+        with self._lock:
+            self.marks[operator_name] = operator_mark
+            self.fetch_timings[operator_name] = round(time.monotonic() - start_time, 3)
+
+        return {_ocp_version: [_index] for _ocp_version, _index in latest_indexes.items()}
+
+
+def is_newer_iib(index_image, other_index_image):
+    return other_index_image.split("iib:")[-1] < index_image.split("iib:")[-1]
+
+
+def get_operator_data_from_url(operator_name, logger, start=None, page=1, stream=False):
+    logger.info(f"{LOG_PREFIX} Getting IIB data for {operator_name}, page {page}")
+    params = {"contains": operator_name, "order": "asc", "rows_per_page": DATAGREPPER_ROWS_PER_PAGE, "page": page}
+    if start:
+        params["start"] = start
+
+    if stream:
+        res = get_http_client().get(DATAGREPPER_QUERY_URL, params=params, verify=False, stream=True)
+        metadata = {}
+        return iter_streamed_raw_messages(response=res, metadata=metadata), metadata
+
+    res = get_http_client().get(DATAGREPPER_QUERY_URL, params=params, verify=False)
+    logger.info(f"{LOG_PREFIX} Done getting IIB data for {operator_name}, page {page}")
     json_res = res.json()
-    for raw_msg in json_res["raw_messages"]:
-        _index = raw_msg["msg"]["index"]
-        if _index["ocp_version"] == ocp_version:
-            yield _index
+    return json_res["raw_messages"], json_res
+
+
+def iter_streamed_raw_messages(response, metadata):
+    try:
+        yield from iter_json_array_items(
+            chunks=response.iter_content(chunk_size=DATAGREPPER_STREAM_CHUNK_SIZE),
+            array_key="raw_messages",
+            metadata=metadata,
+        )
+
+    finally:
+        response.close()
+
+
+def get_datagrepper_marks_file_path(config_data):
+    return f"{os.path.splitext(config_data['local_operators_latest_iib_filepath'])[0]}-datagrepper-marks.json"
+
+
+def get_datagrepper_marks_from_file(config_data):
+    try:
+        with open(get_datagrepper_marks_file_path(config_data=config_data)) as fd:
+            return json.load(fd)
+
+    except (JSONDecodeError, FileNotFoundError):
+        return {}
+
+
+def write_datagrepper_marks_to_file(config_data, marks):
+    atomic_write(path=get_datagrepper_marks_file_path(config_data=config_data), data=json.dumps(marks), lock=True)
+
+
+def get_s3_state_file_path(filename):
+    return f"{os.path.splitext(filename)[0]}-s3-state.json"
+
+
+def get_s3_state(filename):
+    # ETag and content hash of the object as last downloaded or uploaded
+    try:
+        with open(get_s3_state_file_path(filename=filename)) as fd:
+            return json.load(fd)
+
+    except (JSONDecodeError, FileNotFoundError):
+        return {}
+
+
+def write_s3_state(filename, etag, content):
+    atomic_write(
+        path=get_s3_state_file_path(filename=filename),
+        data=json.dumps({"etag": etag, "sha256": hashlib.sha256(content).hexdigest()}),
+    )
+
+
+def drop_s3_state(filename):
+    # The next download gets the whole object
+    try:
+        os.remove(get_s3_state_file_path(filename=filename))
+
+    except FileNotFoundError:
+        pass
 
 
 def upload_download_s3_bucket_file(
@@ -68,13 +233,56 @@ def upload_download_s3_bucket_file(
     try:
         client = boto_s3_client or s3_client(region_name=region)
 
+        s3_state = get_s3_state(filename=filename)
+
         if action == "upload":
+            with open(filename, "rb") as fd:
+                content = fd.read()
+
+            if hashlib.sha256(content).hexdigest() == s3_state.get("sha256"):
+                logger.info(f"{LOG_PREFIX} IIB file not changed, skipping upload to s3 {s3_bucket_file_full_path}")
+                return True
+
+            # Written only if the object was not changed (by another replica) since it was read
+            conditional_kwargs = {"IfMatch": s3_state["etag"]} if s3_state.get("etag") else {"IfNoneMatch": "*"}
             logger.info(f"{LOG_PREFIX} Uploading IIB file to s3 {s3_bucket_file_full_path}")
-            return client.upload_file(Filename=filename, Bucket=bucket, Key=key)
+            try:
+                response = client.put_object(Bucket=bucket, Key=key, Body=content, **conditional_kwargs)
+
+            except ClientError as ex:
+                if ex.response.get("Error", {}).get("Code") in S3_WRITE_CONFLICT_ERROR_CODES:
+                    raise S3WriteConflictError(msg=f"{s3_bucket_file_full_path} was changed since it was read")
+
+                raise
+
+            write_s3_state(filename=filename, etag=response["ETag"], content=content)
+            return True
 
         elif action == "download":
+            # The object is transferred only if it changed since the local copy was downloaded or uploaded
+            conditional_kwargs = {}
+            if s3_state.get("etag") and os.path.isfile(filename):
+                conditional_kwargs["IfNoneMatch"] = s3_state["etag"]
+
             logger.info(f"{LOG_PREFIX} Downloading IIB file from s3 {s3_bucket_file_full_path}")
-            return client.download_file(Bucket=bucket, Key=key, Filename=filename)
+            try:
+                response = client.get_object(Bucket=bucket, Key=key, **conditional_kwargs)
+
+            except ClientError as ex:
+                if ex.response.get("Error", {}).get("Code") not in S3_NOT_MODIFIED_ERROR_CODES:
+                    raise
+
+                logger.info(f"{LOG_PREFIX} IIB file not modified in s3 {s3_bucket_file_full_path}")
+                return True
+
+            content = response["Body"].read()
+            atomic_write(path=filename, data=content)
+            write_s3_state(filename=filename, etag=response["ETag"], content=content)
+            return True
+
+    except (S3WriteConflictError, ParamValidationError):
+        # Invalid request parameters (e.g. a botocore without conditional writes) fail every cycle, not only this one
+        raise
 
     except Exception as ex:
         error_msg = f"{LOG_PREFIX} S3 {action} failed: {ex}"
@@ -87,27 +295,119 @@ def upload_download_s3_bucket_file(
         return False
 
 
+def merge_iib_data(new_data, remote_data):
+    # `new_data` on top of the data another replica wrote; operators for which the other replica already recorded the
+    # same or a newer index image are not new anymore, so their jobs are not triggered twice
+    merged_data = copy.deepcopy(remote_data)
+    for _ocp_version, _jobs_data in new_data.items():
+        for _job_name, _job_data in _jobs_data.items():
+            remote_operators = remote_data.get(_ocp_version, {}).get(_job_name, {}).get("operators", {})
+            merged_job_data = copy.deepcopy(_job_data)
+            for _operator_name, _operator_data in merged_job_data.get("operators", {}).items():
+                remote_iib = remote_operators.get(_operator_name, {}).get("iib")
+                if remote_iib and not (
+                    _operator_data.get("iib")
+                    and is_newer_iib(index_image=_operator_data["iib"], other_index_image=remote_iib)
+                ):
+                    _operator_data["iib"] = remote_iib
+                    _operator_data["new-iib"] = False
+
+            merged_data.setdefault(_ocp_version, {})[_job_name] = merged_job_data
+
+    return merged_data
+
+
 def write_new_data_to_file_and_upload_to_s3(config_data, new_data, logger):
+    # Returns the data as stored, or None if it could not be stored in s3 (no job should be triggered then).
+    # When replicas share the s3 file, the upload is conditional on the object read at the start of the cycle; on
+    # conflict the latest object is merged in and the upload retried.
     iib_file = config_data["local_operators_latest_iib_filepath"]
+    s3_bucket_operators_latest_iib_path = config_data.get("s3_bucket_operators_latest_iib_path")
+    slack_errors_webhook_url = config_data.get("slack_errors_webhook_url")
 
-    with open(iib_file, "w") as fd:
-        fd.write(json.dumps(new_data))
+    try:
+        with open(iib_file, "rb") as fd:
+            previous_content = fd.read()
 
-    if s3_bucket_operators_latest_iib_path := config_data.get("s3_bucket_operators_latest_iib_path"):
-        return upload_download_s3_bucket_file(
-            action="upload",
-            filename=iib_file,
-            s3_bucket_file_full_path=s3_bucket_operators_latest_iib_path,
-            region=config_data["aws_region"],
-            logger=logger,
-            slack_errors_webhook_url=config_data.get("slack_errors_webhook_url"),
-        )
+    except FileNotFoundError:
+        previous_content = None
+
+    for _ in range(S3_WRITE_CONFLICT_RETRIES + 1):
+        atomic_write(path=iib_file, data=json.dumps(new_data), lock=True)
+        if not s3_bucket_operators_latest_iib_path:
+            return new_data
+
+        try:
+            if upload_download_s3_bucket_file(
+                action="upload",
+                filename=iib_file,
+                s3_bucket_file_full_path=s3_bucket_operators_latest_iib_path,
+                region=config_data["aws_region"],
+                logger=logger,
+                slack_errors_webhook_url=slack_errors_webhook_url,
+            ):
+                return new_data
+
+            break
+
+        except S3WriteConflictError as ex:
+            logger.info(f"{LOG_PREFIX} {ex}, merging with the latest IIB file")
+            if not upload_download_s3_bucket_file(
+                action="download",
+                filename=iib_file,
+                s3_bucket_file_full_path=s3_bucket_operators_latest_iib_path,
+                region=config_data["aws_region"],
+                logger=logger,
+                slack_errors_webhook_url=slack_errors_webhook_url,
+            ):
+                break
+
+            new_data = merge_iib_data(new_data=new_data, remote_data=get_iib_data_from_file(config_data=config_data))
+
+        except ParamValidationError:
+            restore_iib_file(iib_file=iib_file, previous_content=previous_content)
+            raise
 
+    # The new index images could not be recorded, another replica may trigger the same jobs.
+    error_msg = f"{LOG_PREFIX} Failed to update {s3_bucket_operators_latest_iib_path}, not triggering jobs"
+    logger.error(error_msg)
+    send_slack_message(message=error_msg, webhook_url=slack_errors_webhook_url, logger=logger)
+    restore_iib_file(iib_file=iib_file, previous_content=previous_content)
+    return None
 
-def get_new_iib(config_data, logger):
+
+def restore_iib_file(iib_file, previous_content):
+    # The local copy was never synced: put back the pre-cycle file and forget its ETag so it is not trusted next cycle.
+    if previous_content is None:
+        os.remove(iib_file)
+    else:
+        atomic_write(path=iib_file, data=previous_content, lock=True)
+
+    drop_s3_state(filename=iib_file)
+
+
+def get_new_iib(config_data, logger, cycle_results=None):
     new_trigger_data = False
     data_from_file = get_iib_data_from_file(config_data=config_data)
     new_data = copy.deepcopy(data_from_file)
+    operators_iib_index = OperatorsIIBIndex(
+        logger=logger,
+        marks=get_datagrepper_marks_from_file(config_data=config_data),
+        ocp_versions=[
+            _ocp_version for _ocp_version, _jobs_data in config_data.get("ci_jobs", {}).items() if _jobs_data
+        ],
+        stream=config_data.get("datagrepper_stream_response", False),
+    )
+    operators_iib_index.fetch(
+        operators_names=[
+            _operator
+            for _jobs_data in config_data.get("ci_jobs", {}).values()
+            if _jobs_data
+            for _ci_job in _jobs_data
+            for _operator in _ci_job["products"]
+        ],
+        max_concurrency=config_data.get("max_concurrency", DEFAULT_MAX_CONCURRENCY),
+    )
 
     for _ocp_version, _jobs_data in config_data.get("ci_jobs", {}).items():
         if _jobs_data:
@@ -122,18 +422,12 @@ def get_new_iib(config_data, logger):
                     _operator_data = new_data[_ocp_version][job_name]["operators"][_operator_name]
                     _operator_data["new-iib"] = False
                     logger.info(f"{LOG_PREFIX} Parsing new IIB data for {_operator_name}")
-                    for data_from_file in get_operator_data_from_url(
-                        operator_name=_operator,
-                        ocp_version=_ocp_version,
-                        logger=logger,
-                    ):
-                        index_image = data_from_file["index_image"]
+                    for _index in operators_iib_index.get(operator_name=_operator, ocp_version=_ocp_version):
+                        index_image = _index["index_image"]
 
                         iib_data_from_file = _operator_data.get("iib")
                         if iib_data_from_file:
-                            iib_from_url = data_from_file["index_image"].split("iib:")[-1]
-                            iib_from_file = iib_data_from_file.split("iib:")[-1]
-                            if iib_from_file < iib_from_url:
+                            if is_newer_iib(index_image=index_image, other_index_image=iib_data_from_file):
                                 _operator_data["iib"] = index_image
                                 _operator_data["new-iib"] = True
                                 new_trigger_data = True
@@ -145,10 +439,17 @@ def get_new_iib(config_data, logger):
 
             logger.info(f"{LOG_PREFIX} Done parsing new IIB data for {_jobs_data}")
 
+    logger.info(f"{LOG_PREFIX} Datagrepper requests made: {operators_iib_index.requests_count}")
+    if cycle_results is not None:
+        cycle_results["operators_fetch_timings"] = operators_iib_index.fetch_timings
+
+    write_datagrepper_marks_to_file(config_data=config_data, marks=operators_iib_index.marks)
+
     if new_trigger_data:
         logger.info(f"{LOG_PREFIX} New IIB data found: {new_data}\nOld IIB data: {data_from_file}")
 
-        write_new_data_to_file_and_upload_to_s3(config_data=config_data, new_data=new_data, logger=logger)
+        # None if the new data could not be stored
+        new_data = write_new_data_to_file_and_upload_to_s3(config_data=config_data, new_data=new_data, logger=logger)
 
     return new_data
 
@@ -182,6 +483,9 @@ def download_iib_file_from_s3_bucket(
 
         return True
 
+    except ParamValidationError:
+        raise
+
     except Exception as ex:
         error_msg = (
             f"{LOG_PREFIX} Failed to download IIB file from s3_bucket_operators_latest_iib_path: "
@@ -226,10 +530,25 @@ def verify_s3_or_local_file(
     return True
 
 
-def fetch_update_iib_and_trigger_jobs(logger, tmp_dir, config_dict=None):
+def fetch_update_iib_and_trigger_jobs(logger, tmp_dir, config_dict=None, cycle_results=None):
     logger.info(f"{LOG_PREFIX} Check for new operators IIB")
-    config_data = get_config(os_environ="CI_IIB_JOBS_TRIGGER_CONFIG", logger=logger)
+    config_data = get_config(os_environ=CI_IIB_JOBS_TRIGGER_CONFIG_OS_ENV_STR, logger=logger)
+    # With `slack_digest`, the cycle notifications are sent as one message when it ends
+    with slack_digest(title=f"{LOG_PREFIX} New operators IIB", logger=logger, enabled=config_data.get("slack_digest")):
+        return _fetch_update_iib_and_trigger_jobs(
+            logger=logger, tmp_dir=tmp_dir, config_data=config_data, cycle_results=cycle_results
+        )
+
+
+def set_cycle_error(cycle_results, error):
+    # The cycle failed before triggering jobs; the on-demand request is answered with the error
+    if cycle_results is not None:
+        cycle_results["error"] = error
 
+    return False
+
+
+def _fetch_update_iib_and_trigger_jobs(logger, tmp_dir, config_data, cycle_results):
     s3_bucket_operators_latest_iib_path = config_data.get("s3_bucket_operators_latest_iib_path")
     user_local_operators_latest_iib_filepath = config_data.get("local_operators_latest_iib_filepath")
 
@@ -239,7 +558,10 @@ def fetch_update_iib_and_trigger_jobs(logger, tmp_dir, config_dict=None):
         slack_errors_webhook_url=config_data.get("slack_errors_webhook_url"),
         logger=logger,
     ):
-        return False
+        return set_cycle_error(
+            cycle_results=cycle_results,
+            error="Cannot set both s3_bucket_operators_latest_iib_path and local_operators_latest_iib_filepath",
+        )
 
     # When using S3 or running locally with a tmp file
     if not user_local_operators_latest_iib_filepath:
@@ -255,22 +577,38 @@ def fetch_update_iib_and_trigger_jobs(logger, tmp_dir, config_dict=None):
                 logger=logger,
                 target_file_path=local_operators_latest_iib_filepath,
             ):
-                return False
+                return set_cycle_error(
+                    cycle_results=cycle_results,
+                    error=f"Failed to download IIB file from {s3_bucket_operators_latest_iib_path}",
+                )
 
     if (ci_jobs := config_data.get("ci_jobs", {})) is None:
         logger.error(f"{LOG_PREFIX} No ci_jobs found in config")
         return {}
 
-    trigger_dict = get_new_iib(config_data=config_data, logger=logger)
+    trigger_dict = get_new_iib(config_data=config_data, logger=logger, cycle_results=cycle_results)
+    if trigger_dict is None:
+        return set_cycle_error(
+            cycle_results=cycle_results,
+            error=f"Failed to update {s3_bucket_operators_latest_iib_path}, jobs were not triggered",
+        )
 
+    triggered_jobs = {}
+    queued_jobs = {}
     failed_triggered_jobs = {}
-    for _, _job_data in trigger_dict.items():
-        for _job_name, _job_dict in _job_data.items():
-            if _job_name in [job["name"] for jobs in ci_jobs.values() if jobs for job in jobs]:
-                operators = _job_dict["operators"]
-                if any([_value["new-iib"] for _value in operators.values()]):
-                    try:
-                        trigger_ci_job(
+    trigger_errors = {}
+    ci_jobs_names = {job["name"] for jobs in ci_jobs.values() if jobs for job in jobs}
+    # Jobs are triggered concurrently, with per CI backend concurrency and rate limits (`trigger_limits`)
+    with TriggerDispatcher(limits=config_data.get("trigger_limits")) as dispatcher:
+        jobs_futures = []
+        for _, _job_data in trigger_dict.items():
+            for _job_name, _job_dict in _job_data.items():
+                if _job_name in ci_jobs_names:
+                    operators = _job_dict["operators"]
+                    if any([_value["new-iib"] for _value in operators.values()]):
+                        future = dispatcher.submit(
+                            backend=_job_dict["ci"],
+                            func=trigger_ci_job,
                             job=_job_name,
                             product=", ".join(operators.keys()),
                             _type="operator",
@@ -280,27 +618,159 @@ def fetch_update_iib_and_trigger_jobs(logger, tmp_dir, config_dict=None):
                             config_data=config_data,
                             operator_iib=True,
                         )
-                    except AddonsWebhookTriggerError:
-                        failed_triggered_jobs.setdefault(_job_dict["ci"], []).append(_job_name)
-                        continue
+                        jobs_futures.append((_job_name, _job_dict["ci"], future))
+
+        for _job_name, _ci, future in jobs_futures:
+            try:
+                # Jenkins builds which did not leave the queue within `jenkins_build_start_timeout` did not start yet
+                if future.result().get("queued"):
+                    queued_jobs.setdefault(_ci, []).append(_job_name)
+                else:
+                    triggered_jobs.setdefault(_ci, []).append(_job_name)
+            except AddonsWebhookTriggerError:
+                failed_triggered_jobs.setdefault(_ci, []).append(_job_name)
+
+            except Exception as ex:
+                # One broken trigger does not stop collecting the results of the others
+                failed_triggered_jobs.setdefault(_ci, []).append(_job_name)
+                trigger_errors[_job_name] = str(ex)
+                error_msg = f"{LOG_PREFIX} Failed to trigger {_job_name}: {ex}"
+                logger.error(error_msg)
+                send_slack_message(
+                    message=error_msg,
+                    webhook_url=config_data.get("slack_errors_webhook_url"),
+                    logger=logger,
+                )
+
+    if dispatcher.rate_limit_waits:
+        logger.info(f"{LOG_PREFIX} Triggers rate limit waits (seconds): {dispatcher.rate_limit_waits}")
+
+    if cycle_results is not None:
+        cycle_results["triggered_jobs"] = triggered_jobs
+        cycle_results["queued_jobs"] = queued_jobs
+        cycle_results["failed_triggered_jobs"] = failed_triggered_jobs
+        if trigger_errors:
+            cycle_results["trigger_errors"] = trigger_errors
+
     return failed_triggered_jobs
 
 
-def run_iib_update(logger, tmp_dir):
+class IIBCycleCoordinator:
+    # Shared between the app process and the process running `run_iib_update`.
+    # The app asks for an immediate cycle and waits for its results; requests made while a cycle is in flight are
+    # answered with the results of that cycle instead of starting another scan.
+    def __init__(self):
+        self.run_now_event = multiprocessing.Event()
+        self._in_flight = multiprocessing.Event()
+        self._in_flight_lock = multiprocessing.Lock()
+        self._results_queue = multiprocessing.Queue()
+        self._init_app_state()
+
+    def __getstate__(self):
+        return {
+            "run_now_event": self.run_now_event,
+            "_in_flight": self._in_flight,
+            "_in_flight_lock": self._in_flight_lock,
+            "_results_queue": self._results_queue,
+        }
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_app_state()
+
+    def _init_app_state(self):
+        self._condition = threading.Condition()
+        self._results = {}
+        self._reader = None
+        # The process running `run_iib_update`, set by the app
+        self.process = None
+
+    def is_cycle_process_alive(self):
+        # Without a process the cycles are run by a thread of this process
+        return self.process is None or self.process.is_alive()
+
+    def cycle_started(self):
+        # Requests made before the cycle started are served by it
+        with self._in_flight_lock:
+            self._in_flight.set()
+            self.run_now_event.clear()
+
+    def cycle_done(self, results):
+        results["finished_at"] = time.time()
+        self._in_flight.clear()
+        self._results_queue.put(results)
+
+    def request_cycle(self, timeout):
+        with self._condition:
+            if not self._reader:
+                self._reader = threading.Thread(target=self._read_results, daemon=True)
+                self._reader.start()
+
+            # Results of cycles which finished before the request are stale
+            requested_at = time.time()
+            with self._in_flight_lock:
+                if not self._in_flight.is_set():
+                    self.run_now_event.set()
+
+            # Stop waiting if the process running the cycles exited (e.g. invalid cron schedule)
+            deadline = time.monotonic() + timeout
+            while self._results.get("finished_at", 0) < requested_at:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self.is_cycle_process_alive():
+                    return None
+
+                self._condition.wait(timeout=min(remaining, 1))
+
+            return self._results
+
+    def _read_results(self):
+        while True:
+            try:
+                results = self._results_queue.get()
+            except (EOFError, OSError):
+                return
+
+            with self._condition:
+                self._results = results
+                self._condition.notify_all()
+
+
+def run_iib_update(logger, tmp_dir, cycle_coordinator=None):
+    scheduler = get_scheduler(
+        config=get_config(os_environ=CI_IIB_JOBS_TRIGGER_CONFIG_OS_ENV_STR, logger=logger),
+        logger=logger,
+        log_prefix=LOG_PREFIX,
+        run_now_event=cycle_coordinator.run_now_event if cycle_coordinator else None,
+    )
+    if not scheduler:
+        return
+
     while True:
+        cycle_results = {}
+        if cycle_coordinator:
+            cycle_coordinator.cycle_started()
+
         try:
-            failed_triggered_jobs = fetch_update_iib_and_trigger_jobs(logger=logger, tmp_dir=tmp_dir)
+            failed_triggered_jobs = fetch_update_iib_and_trigger_jobs(
+                logger=logger, tmp_dir=tmp_dir, cycle_results=cycle_results
+            )
             if failed_triggered_jobs:
                 logger.info(f"{LOG_PREFIX} Failed triggered jobs: {failed_triggered_jobs}")
 
         except Exception as ex:
+            cycle_results["error"] = str(ex)
             err_msg = f"{LOG_PREFIX} Fail to run run_iib_update function. {ex}"
             logger.error(err_msg)
-            slack_errors_webhook_url = get_config(os_environ="CI_IIB_JOBS_TRIGGER_CONFIG", logger=logger).get(
+            slack_errors_webhook_url = get_config(os_environ=CI_IIB_JOBS_TRIGGER_CONFIG_OS_ENV_STR, logger=logger).get(
                 "slack_errors_webhook_url"
             )
             send_slack_message(message=err_msg, webhook_url=slack_errors_webhook_url, logger=logger)
 
         finally:
-            logger.info(f"{LOG_PREFIX} Done check for new operators IIB, sleeping for 1 day")
-            sleep(DAYS_TO_SECONDS)
+            logger.info(
+                f"{LOG_PREFIX} Done check for new operators IIB, HTTP client stats: {get_http_client().stats()}"
+            )
+            if cycle_coordinator:
+                cycle_coordinator.cycle_done(results=cycle_results)
+
+            scheduler.wait()
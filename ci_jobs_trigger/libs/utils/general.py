@@ -71,7 +71,8 @@ curl -X GET -d -H "Authorization: Bearer $OPENSHIFT_CI_TOKEN" {GANGWAY_API_URL}/
 """
 
     elif jenkins_ci:
-        openshift_ci_response = ""
+        # The build may still be queued when the start wait ended
+        openshift_ci_response = "build is queued, not started yet" if res.get("queued") else ""
         status_info_command = res["url"]
 
     message = f"""
@@ -1,3 +1,5 @@
+import threading
+
 import pytest
 from gitlab import Gitlab
 from gitlab.v4.objects import ProjectManager, ProjectMergeRequestManager
@@ -5,6 +7,7 @@ from gitlab.v4.objects import ProjectManager, ProjectMergeRequestManager
 from simple_logger.logger import get_logger
 
 from ci_jobs_trigger.libs.addons_webhook_trigger.addons_webhook_trigger import process_hook
+from ci_jobs_trigger.utils.general import AddonsWebhookTriggerError
 
 LOGGER = get_logger("test_addons_webhook_trigger")
 
@@ -90,3 +93,27 @@ def test_process_hook(mocker, functions_mocker, webhook_data, config_dict, get_c
     get_config_mocker.return_value = config_dict
 
     process_hook(data=webhook_data, logger=LOGGER)
+
+
+def test_process_hook_triggers_jobs_concurrently(mocker, webhook_data, config_dict, get_config_mocker):
+    # Every job waits for the others to be triggered; one trigger after the other would never get past the barrier
+    mocker.patch.object(Gitlab, "auth", return_value=True)
+    mocker.patch.object(ProjectManager, "get", return_value=MockGitlabProjectManager())
+    mocker.patch.object(ProjectMergeRequestManager, "get", return_value=MockProjectMergeRequestManager())
+    config_dict["repositories"]["managed-tenants"]["products_jobs_mapping"]["jenkins"]["addon"]["stage"] = [
+        "jenkins-job-1",
+        "jenkins-job-2",
+    ]
+    get_config_mocker.return_value = config_dict
+    barrier = threading.Barrier(parties=3, timeout=5)
+
+    def _trigger_ci_job(job, ci, **kwargs):
+        barrier.wait()
+        if job == "jenkins-job-2":
+            raise AddonsWebhookTriggerError(msg="failed")
+
+    mocker.patch(
+        "ci_jobs_trigger.libs.addons_webhook_trigger.addons_webhook_trigger.trigger_ci_job", side_effect=_trigger_ci_job
+    )
+
+    assert process_hook(data=webhook_data, logger=LOGGER) == {"jenkins": ["jenkins-job-2"]}
@@ -0,0 +1,152 @@
+import json
+import multiprocessing
+import os
+import random
+import signal
+import threading
+import time
+
+import pytest
+from simple_logger.logger import get_logger
+
+from ci_jobs_trigger.libs.operators_iib_trigger.iib_trigger import (
+    get_iib_data_from_file,
+    write_new_data_to_file_and_upload_to_s3,
+)
+from ci_jobs_trigger.utils.atomic_file import atomic_write, file_lock
+
+LOGGER = get_logger("test_atomic_file")
+FORK_CTX = multiprocessing.get_context("fork")
+OLD_DATA = {"v4.15": {"operators": {"operator-1": {"iib": "iib:1", "triggered": True}}}}
+
+
+@pytest.fixture()
+def state_file(tmp_path):
+    state_file = tmp_path / "state.json"
+    state_file.write_text(json.dumps(OLD_DATA))
+    return state_file
+
+
+def get_big_data(value, operators=20000):
+    return {f"operator-{idx}": {"iib": f"iib:{value}", "triggered": False} for idx in range(operators)}
+
+
+def tmp_files(path):
+    return [_file for _file in os.listdir(path.parent) if _file.endswith(".tmp")]
+
+
+def kill_self(*args, **kwargs):
+    os.kill(os.getpid(), signal.SIGKILL)
+
+
+def run_killed_writer(target, **kwargs):
+    process = FORK_CTX.Process(target=target, kwargs=kwargs)
+    process.start()
+    process.join(timeout=60)
+    assert process.exitcode == -signal.SIGKILL
+
+
+def write_and_kill_on(path, data, killed_function):
+    # Runs in a child process, `killed_function` kills the writer
+    setattr(os, killed_function, kill_self)
+    atomic_write(path=path, data=data)
+
+
+def write_iib_file_and_kill_on_fsync(config_data, new_data):
+    os.fsync = kill_self
+    write_new_data_to_file_and_upload_to_s3(config_data=config_data, new_data=new_data, logger=LOGGER)
+
+
+def write_in_loop(path):
+    for value in range(1000000):
+        atomic_write(path=path, data=json.dumps(get_big_data(value=value % 2)))
+
+
+def test_atomic_write(tmp_path):
+    path = tmp_path / "state.json"
+    atomic_write(path=path, data="text")
+    assert path.read_text() == "text"
+    assert oct(os.stat(path).st_mode & 0o777) == oct(0o644)
+
+    os.chmod(path, 0o600)
+    atomic_write(path=path, data=b"bytes", lock=True)
+    assert path.read_bytes() == b"bytes"
+    assert oct(os.stat(path).st_mode & 0o777) == oct(0o600)
+    assert not tmp_files(path=path)
+
+
+def test_atomic_write_failure_keeps_previous_content(mocker, state_file):
+    mocker.patch("os.fsync", side_effect=OSError("No space left on device"))
+
+    with pytest.raises(OSError):
+        atomic_write(path=state_file, data=json.dumps(get_big_data(value=1)))
+
+    assert json.loads(state_file.read_text()) == OLD_DATA
+    assert not tmp_files(path=state_file)
+
+
+@pytest.mark.parametrize("killed_function", ["fsync", "replace"])
+def test_atomic_write_killed_writer_keeps_previous_content(state_file, killed_function):
+    run_killed_writer(
+        target=write_and_kill_on,
+        path=str(state_file),
+        data=json.dumps(get_big_data(value=1)),
+        killed_function=killed_function,
+    )
+
+    assert json.loads(state_file.read_text()) == OLD_DATA
+
+
+def test_atomic_write_killed_at_random_points(state_file):
+    # Kill the writer at random points while it rewrites the file, every kill must leave a complete file
+    valid_data = [OLD_DATA, get_big_data(value=0), get_big_data(value=1)]
+    for _ in range(10):
+        process = FORK_CTX.Process(target=write_in_loop, kwargs={"path": str(state_file)})
+        process.start()
+        time.sleep(random.uniform(0.01, 0.1))
+        os.kill(process.pid, signal.SIGKILL)
+        process.join(timeout=60)
+
+        assert json.loads(state_file.read_text()) in valid_data
+
+
+def test_atomic_write_concurrent_reader(state_file):
+    stop = threading.Event()
+    reads = []
+
+    def _read():
+        while not stop.is_set():
+            reads.append(json.loads(state_file.read_text()))
+
+    reader = threading.Thread(target=_read)
+    reader.start()
+    try:
+        for value in range(30):
+            atomic_write(path=state_file, data=json.dumps(get_big_data(value=value, operators=2000)))
+    finally:
+        stop.set()
+        reader.join()
+
+    assert reads
+
+
+def test_atomic_write_lock(state_file):
+    with file_lock(path=state_file):
+        process = FORK_CTX.Process(
+            target=atomic_write, kwargs={"path": str(state_file), "data": "new content", "lock": True}
+        )
+        process.start()
+        process.join(timeout=0.3)
+        # The writer waits for the lock
+        assert process.is_alive()
+        assert json.loads(state_file.read_text()) == OLD_DATA
+
+    process.join(timeout=10)
+    assert state_file.read_text() == "new content"
+
+
+def test_iib_file_killed_writer_keeps_previous_data(state_file):
+    config_data = {"local_operators_latest_iib_filepath": str(state_file)}
+    run_killed_writer(target=write_iib_file_and_kill_on_fsync, config_data=config_data, new_data=get_big_data(value=1))
+
+    assert get_iib_data_from_file(config_data=config_data) == OLD_DATA
@@ -0,0 +1,64 @@
+import pytest
+from pyaml_env import parse_config
+from simple_logger.logger import get_logger
+
+from ci_jobs_trigger.utils.general import ConfigCache, get_config
+
+LOGGER = get_logger("test_config_cache")
+CONFIG_OS_ENV_STR = "CI_JOBS_TRIGGER_TEST_CONFIG"
+
+
+@pytest.fixture()
+def config_file(tmp_path):
+    config_file = tmp_path / "config.yaml"
+    config_file.write_text('trigger_token: !ENV "${CI_JOBS_TRIGGER_TEST_TOKEN}"\nversions:\n  "4.15":\n    - job-1\n')
+    return config_file
+
+
+@pytest.fixture()
+def config_env(monkeypatch, config_file):
+    monkeypatch.setenv(CONFIG_OS_ENV_STR, str(config_file))
+    monkeypatch.setenv("CI_JOBS_TRIGGER_TEST_TOKEN", "token")
+
+
+def test_config_cached(config_file):
+    config_cache = ConfigCache()
+    for _ in range(3):
+        assert config_cache.get(path=str(config_file), logger=LOGGER)["trigger_token"] == ""
+
+    assert config_cache.reloads[str(config_file)] == 1
+
+
+def test_config_reloaded_on_file_change(config_file):
+    config_cache = ConfigCache()
+    config_cache.get(path=str(config_file), logger=LOGGER)
+    config_file.write_text("versions:\n  4.16:\n    - job-2\n    - job-3\n")
+    assert config_cache.get(path=str(config_file), logger=LOGGER) == {"versions": {4.16: ["job-2", "job-3"]}}
+    assert config_cache.reloads[str(config_file)] == 2
+
+
+def test_config_reloaded_on_env_change(monkeypatch, config_file):
+    config_cache = ConfigCache()
+    monkeypatch.setenv("CI_JOBS_TRIGGER_TEST_TOKEN", "token")
+    assert config_cache.get(path=str(config_file), logger=LOGGER)["trigger_token"] == "token"
+    monkeypatch.setenv("CI_JOBS_TRIGGER_TEST_TOKEN", "new-token")
+    assert config_cache.get(path=str(config_file), logger=LOGGER)["trigger_token"] == "new-token"
+    assert config_cache.reloads[str(config_file)] == 2
+
+
+def test_cached_config_not_modified_by_callers(config_env):
+    get_config(os_environ=CONFIG_OS_ENV_STR, logger=LOGGER)["versions"]["4.15"].append("job-2")
+    assert get_config(os_environ=CONFIG_OS_ENV_STR, logger=LOGGER)["versions"]["4.15"] == ["job-1"]
+
+
+def test_get_config_missing_file(monkeypatch):
+    monkeypatch.setenv(CONFIG_OS_ENV_STR, "/non-existing-config.yaml")
+    assert get_config(os_environ=CONFIG_OS_ENV_STR, logger=LOGGER) == {}
+
+
+def test_get_config_parsed_once(mocker, config_env):
+    parse_config_mock = mocker.patch("ci_jobs_trigger.utils.general.parse_config", wraps=parse_config)
+    for _ in range(200):
+        assert get_config(os_environ=CONFIG_OS_ENV_STR, logger=LOGGER)["trigger_token"] == "token"
+
+    assert parse_config_mock.call_count == 1
@@ -1,16 +1,20 @@
+import threading
+
 import jenkins
 import pytest
-import requests
 
-from ci_jobs_trigger.tests.utils import MockJenkinsBuild, MockJenkinsJob, MockRequestPost
+from ci_jobs_trigger.tests.utils import MockJenkinsBuild, MockJenkinsJob, MockRequestPost, StubServer
+from ci_jobs_trigger.utils.http_client import HttpClient
 
 
 @pytest.fixture()
 def functions_mocker(mocker):
-    mocker.patch.object(requests, "post", return_value=MockRequestPost())
+    mocker.patch.object(HttpClient, "post", return_value=MockRequestPost())
 
-    mocker.patch.object(jenkins.Jenkins, "get_job_info", return_value=MockJenkinsJob())
-    mocker.patch.object(jenkins.Jenkins, "job_exists", return_value=MockJenkinsJob())
+    mocker.patch(
+        "ci_jobs_trigger.libs.jenkins.utils.general.get_jenkins_job_info",
+        return_value=MockJenkinsJob.get_job_info(),
+    )
     mocker.patch.object(jenkins.Jenkins, "build_job", return_value=MockJenkinsBuild())
 
     mocker.patch("ci_jobs_trigger.libs.jenkins.utils.general.set_job_params", return_value={})
@@ -20,3 +24,24 @@ def functions_mocker(mocker):
     )
 
     yield
+
+
+@pytest.fixture()
+def start_stub_server():
+    # Starts a StubServer with the suite handler, `attributes` are the initial server state
+    servers = []
+
+    def _start_stub_server(handler_class, **attributes):
+        server = StubServer(("127.0.0.1", 0), handler_class)
+        for name, value in attributes.items():
+            setattr(server, name, value)
+
+        threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield _start_stub_server
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,96 @@
+import multiprocessing
+
+import pytest
+
+from ci_jobs_trigger.tests.utils import StubHandler
+from ci_jobs_trigger.utils.http_client import HttpClient, get_http_client
+
+
+class HttpClientStubHandler(StubHandler):
+    # Answers `statuses` in order, then 200
+    def _respond(self):
+        self.server.requests.append((self.command, self.path))
+        self._send(status=self.server.statuses.pop(0) if self.server.statuses else 200, body=b"ok")
+
+    def do_GET(self):  # noqa N802
+        self._respond()
+
+    def do_POST(self):  # noqa N802
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self._respond()
+
+
+@pytest.fixture()
+def stub_server(start_stub_server):
+    return start_stub_server(handler_class=HttpClientStubHandler, requests=[], statuses=[])
+
+
+@pytest.fixture()
+def stub_url(stub_server):
+    return stub_server.url
+
+
+@pytest.fixture()
+def http_client():
+    return HttpClient(retries=2, backoff_factor=0)
+
+
+def test_connection_reused(http_client, stub_url):
+    for _ in range(5):
+        assert http_client.get(url=f"{stub_url}/test").ok
+
+    host_stats = http_client.stats()[stub_url.split("//")[1]]
+    assert host_stats["requests"] == 5
+    assert host_stats["new_connections"] == 1
+    assert host_stats["reused_connections"] == 4
+    assert host_stats["max_latency"] > 0
+
+
+def test_session_per_host(http_client, stub_url):
+    assert http_client.session(url=f"{stub_url}/a") is http_client.session(url=f"{stub_url}/b")
+    assert http_client.session(url=stub_url) is not http_client.session(url="https://other-host")
+
+
+@pytest.mark.parametrize("status", [429, 503])
+def test_get_retried(http_client, stub_server, stub_url, status):
+    stub_server.statuses = [status]
+    assert http_client.get(url=stub_url).ok
+    assert len(stub_server.requests) == 2
+
+
+def test_post_retried_on_too_many_requests(http_client, stub_server, stub_url):
+    stub_server.statuses = [429]
+    assert http_client.post(url=stub_url, json={}).ok
+    assert len(stub_server.requests) == 2
+
+
+def test_post_not_retried_on_server_error(http_client, stub_server, stub_url):
+    stub_server.statuses = [500]
+    assert http_client.post(url=stub_url, json={}).status_code == 500
+    assert len(stub_server.requests) == 1
+
+
+def test_post_retries_override(http_client, stub_server, stub_url):
+    # The caller handles 429 itself, the response is returned as is
+    stub_server.statuses = [429]
+    assert http_client.post(url=stub_url, json={}, retries=0).status_code == 429
+    assert http_client.post(url=stub_url, json={}).ok
+    assert len(stub_server.requests) == 2
+    assert http_client.stats()[stub_url.split("//")[1]]["requests"] == 2
+
+
+def test_http_client_per_process():
+    http_client = get_http_client()
+    assert get_http_client() is http_client
+
+    queue = multiprocessing.get_context("fork").SimpleQueue()
+    process = multiprocessing.get_context("fork").Process(target=lambda: queue.put(get_http_client() is http_client))
+    process.start()
+    process.join(timeout=30)
+    assert queue.get() is False
+
+
+def test_default_timeout(mocker, http_client, stub_url):
+    request_mock = mocker.patch("requests.Session.request")
+    http_client.get(url=stub_url)
+    assert request_mock.call_args.kwargs["timeout"] == http_client.timeout
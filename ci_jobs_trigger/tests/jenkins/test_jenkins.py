@@ -0,0 +1,201 @@
+import json
+from collections import Counter
+from urllib.parse import parse_qs, urlparse
+
+import jenkins
+import pytest
+from simple_logger.logger import get_logger
+
+from ci_jobs_trigger.libs.jenkins.utils.general import (
+    get_jenkins_api,
+    get_jenkins_job_url,
+    jenkins_trigger_job,
+    wait_for_job_started_in_jenkins,
+)
+from ci_jobs_trigger.tests.utils import StubHandler
+
+LOGGER = get_logger("test_jenkins")
+JOB_NAME = "test-job"
+
+
+def start_build(server):
+    server.last_build_number += 1
+    return {"number": server.last_build_number, "url": f"http://jenkins/job/{JOB_NAME}/{server.last_build_number}/"}
+
+
+class JenkinsStubHandler(StubHandler):
+    # Minimal Jenkins: job info (honoring `tree`), buildWithParameters, queue items and no crumb issuer.
+    # A queued build starts (gets the next build number) after `queued_polls` polls of its queue item.
+    def do_GET(self):  # noqa N802
+        url = urlparse(self.path)
+        if url.path == "/crumbIssuer/api/json":
+            self.server.requests["crumb"] += 1
+            return self._send(status=404)
+
+        if url.path.startswith("/queue/item/"):
+            return self._send_queue_item(queue_id=int(url.path.split("/")[3]))
+
+        if url.path != f"/job/{JOB_NAME}/api/json":
+            return self._send(status=404)
+
+        tree = parse_qs(url.query).get("tree", [""])[0]
+        self.server.requests["job_info_with_params" if "property" in tree else "job_info"] += 1
+        job_info = {"name": JOB_NAME}
+        if "property" in tree:
+            job_info["property"] = [
+                {},
+                {
+                    "parameterDefinitions": [
+                        {"defaultParameterValue": {"name": "INSTALL_FROM_IIB", "value": False}},
+                        {"defaultParameterValue": {"name": "CLUSTER_NAME", "value": "cluster"}},
+                    ]
+                },
+            ]
+
+        return self._send(status=200, body=json.dumps(job_info).encode())
+
+    def do_POST(self):  # noqa N802
+        url = urlparse(self.path)
+        if url.path != f"/job/{JOB_NAME}/buildWithParameters":
+            return self._send(status=404)
+
+        self.server.requests["build"] += 1
+        self.server.builds_params.append({key: value[0] for key, value in parse_qs(url.query).items()})
+        queue_id = len(self.server.builds_params)
+        self.server.queue_items[queue_id] = {"id": queue_id, "why": "Waiting for next available executor"}
+        return self._send(status=201, headers={"Location": f"http://jenkins/queue/item/{queue_id}/"})
+
+    def _send_queue_item(self, queue_id):
+        self.server.requests["queue_item"] += 1
+        queue_item = self.server.queue_items.get(queue_id)
+        if not queue_item:
+            return self._send(status=404)
+
+        queue_item.setdefault("polls", 0)
+        queue_item["polls"] += 1
+        if self.server.cancel_queued and "executable" not in queue_item:
+            queue_item["cancelled"] = True
+        elif "executable" not in queue_item:
+            if queue_item["polls"] > self.server.queued_polls:
+                queue_item.pop("why")
+                queue_item["executable"] = start_build(server=self.server)
+
+        return self._send(status=200, body=json.dumps(queue_item).encode())
+
+
+@pytest.fixture()
+def jenkins_stub(start_stub_server):
+    return start_stub_server(
+        handler_class=JenkinsStubHandler,
+        last_build_number=10,
+        builds_params=[],
+        queue_items={},
+        queued_polls=0,
+        cancel_queued=False,
+        requests=Counter(),
+    )
+
+
+@pytest.fixture()
+def jenkins_config_data(jenkins_stub):
+    return {
+        "jenkins_url": jenkins_stub.url,
+        "jenkins_username": "user",
+        "jenkins_token": "token",
+        "jenkins_build_start_timeout": "5s",
+        "jenkins_build_start_poll_interval": 0,
+    }
+
+
+def test_jenkins_trigger_job_requests_count(jenkins_stub, jenkins_config_data):
+    for _ in range(3):
+        rc, res = jenkins_trigger_job(job=JOB_NAME, config_data=jenkins_config_data, logger=LOGGER, operator_iib=True)
+        assert rc
+        assert res["number"] == jenkins_stub.last_build_number
+
+    # Per trigger: one job info request, the build and one queue item poll; the crumb and the parameters are fetched once
+    assert jenkins_stub.requests == {"crumb": 1, "job_info_with_params": 1, "job_info": 2, "build": 3, "queue_item": 3}
+    assert jenkins_stub.builds_params[-1] == {"INSTALL_FROM_IIB": "True", "CLUSTER_NAME": "cluster"}
+
+
+def test_jenkins_trigger_job_params_cache_expired(jenkins_stub, jenkins_config_data):
+    jenkins_config_data["jenkins_job_params_cache_ttl"] = 0
+    for _ in range(2):
+        assert jenkins_trigger_job(job=JOB_NAME, config_data=jenkins_config_data, logger=LOGGER)[0]
+
+    assert jenkins_stub.requests["job_info_with_params"] == 2
+    assert jenkins_stub.builds_params[-1] == {"INSTALL_FROM_IIB": "False", "CLUSTER_NAME": "cluster"}
+
+
+def test_jenkins_trigger_missing_job(jenkins_stub, jenkins_config_data):
+    assert jenkins_trigger_job(job="missing-job", config_data=jenkins_config_data, logger=LOGGER) == (False, None)
+    assert not jenkins_stub.requests["build"]
+
+
+def test_get_jenkins_api_cached(jenkins_config_data):
+    api = get_jenkins_api(config_data=jenkins_config_data)
+    assert get_jenkins_api(config_data=dict(jenkins_config_data)) is api
+    assert get_jenkins_api(config_data={**jenkins_config_data, "jenkins_username": "other-user"}) is not api
+    # A rotated token gets a new client
+    assert get_jenkins_api(config_data={**jenkins_config_data, "jenkins_token": "new-token"}) is not api
+
+
+def test_get_jenkins_job_url(jenkins_config_data):
+    api = get_jenkins_api(config_data=jenkins_config_data)
+    assert get_jenkins_job_url(api=api, job="folder/my job") == f"{api.server}job/folder/job/my%20job/"
+
+
+def test_jenkins_trigger_job_returns_own_build(mocker, jenkins_stub, jenkins_config_data):
+    # Other users trigger the same job while our build waits in the queue, the returned build is still ours
+    jenkins_stub.queued_polls = 3
+    other_builds = []
+    get_queue_item = jenkins.Jenkins.get_queue_item
+
+    def _get_queue_item(api, number, *args, **kwargs):
+        other_builds.append(start_build(server=jenkins_stub))
+        return get_queue_item(api, number, *args, **kwargs)
+
+    mocker.patch.object(jenkins.Jenkins, "get_queue_item", autospec=True, side_effect=_get_queue_item)
+
+    rc, res = jenkins_trigger_job(job=JOB_NAME, config_data=jenkins_config_data, logger=LOGGER)
+    assert rc
+    assert jenkins_stub.requests["queue_item"] == 4
+    assert res == jenkins_stub.queue_items[1]["executable"]
+    assert res["number"] == other_builds[-1]["number"] + 1
+    assert res["url"] == f"http://jenkins/job/{JOB_NAME}/{res['number']}/"
+
+
+def test_jenkins_trigger_job_still_queued(jenkins_stub, jenkins_config_data):
+    # A build waiting for an executor was triggered but did not start, the queue item is returned as queued
+    jenkins_stub.queued_polls = 1000
+    jenkins_config_data["jenkins_build_start_timeout"] = 0
+    assert jenkins_trigger_job(job=JOB_NAME, config_data=jenkins_config_data, logger=LOGGER)[0]
+
+    rc, res = wait_for_job_started_in_jenkins(
+        api=get_jenkins_api(config_data=jenkins_config_data),
+        job=JOB_NAME,
+        queue_id=1,
+        logger=LOGGER,
+        timeout=0.2,
+        poll_interval=0.01,
+    )
+    assert rc
+    assert res == {"url": f"{jenkins_config_data['jenkins_url']}/queue/item/1/", "queue_id": 1, "queued": True}
+    assert jenkins_stub.requests["queue_item"] > 1
+
+
+def test_jenkins_trigger_job_no_wait(jenkins_stub, jenkins_config_data):
+    jenkins_config_data["jenkins_build_start_timeout"] = 0
+
+    rc, res = jenkins_trigger_job(job=JOB_NAME, config_data=jenkins_config_data, logger=LOGGER)
+    assert rc
+    assert res["queue_id"] == 1
+    assert res["queued"]
+    assert not jenkins_stub.requests["queue_item"]
+
+
+def test_jenkins_trigger_job_cancelled_in_queue(jenkins_stub, jenkins_config_data):
+    jenkins_stub.queued_polls = 1000
+    jenkins_stub.cancel_queued = True
+
+    assert jenkins_trigger_job(job=JOB_NAME, config_data=jenkins_config_data, logger=LOGGER) == (False, None)
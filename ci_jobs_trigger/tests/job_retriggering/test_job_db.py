@@ -0,0 +1,262 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+from simple_logger.logger import get_logger
+
+from ci_jobs_trigger.libs.openshift_ci.re_trigger.job_db import (
+    DB,
+    INCREMENTAL_AUTO_VACUUM,
+    JOBS_UNIQUE_INDEX,
+    JobDBCompactor,
+    close_db_connections,
+    compact_db,
+    get_db_connection,
+    get_db_metrics,
+)
+from ci_jobs_trigger.libs.openshift_ci.re_trigger.job_queue import DONE_STATUS, FAILED_STATUS, ReTriggerQueue
+
+LOGGER = get_logger(name=__name__)
+FINISHED_STATUSES = (DONE_STATUS, FAILED_STATUS)
+DAY = 24 * 60 * 60
+JOB_DB_MODULE_PATH = "ci_jobs_trigger.libs.openshift_ci.re_trigger.job_db"
+
+
+@pytest.fixture()
+def job_db_path(tmp_path):
+    yield tmp_path / "jobs.db"
+    close_db_connections()
+
+
+def create_legacy_db(db_path, rows):
+    # A jobs table as created before the unique index, with `rows` jobs
+    connection = sqlite3.connect(db_path)
+    with connection:
+        connection.execute("CREATE TABLE jobs(job_name TEXT, prow_job_id TEXT)")
+        connection.executemany(
+            "INSERT INTO jobs VALUES (?, ?)", ((f"job-{idx % 100}", f"prow-{idx}") for idx in range(rows))
+        )
+
+    return connection
+
+
+def add_jobs(db_path, rows, age=0):
+    # `rows` jobs created `age` seconds ago
+    with DB(job_db_path=db_path) as database:
+        with database._lock, database.connection:
+            first_idx = database.connection.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+            database.connection.executemany(
+                "INSERT INTO jobs VALUES (?, ?, ?)",
+                ((f"job-{idx % 100}", f"prow-{idx}", time.time() - age) for idx in range(first_idx, first_idx + rows)),
+            )
+
+
+def test_job_db_write_idempotent(job_db_path):
+    with DB(job_db_path=job_db_path) as database:
+        assert not database.check_prow_job_id_in_db(job_name="job", prow_job_id="1")
+        assert database.write(job_name="job", prow_job_id="1")
+        assert not database.write(job_name="job", prow_job_id="1")
+        assert database.check_prow_job_id_in_db(job_name="job", prow_job_id="1")
+        assert not database.check_prow_job_id_in_db(job_name="other-job", prow_job_id="1")
+        # Values are bound, not formatted into the query
+        assert database.write(job_name='job" OR "1" == "1', prow_job_id="'2'")
+        assert database.check_prow_job_id_in_db(job_name='job" OR "1" == "1', prow_job_id="'2'")
+        assert not database.check_prow_job_id_in_db(job_name='job" OR "1" == "1', prow_job_id="2")
+
+    with DB(job_db_path=job_db_path) as database:
+        assert database.connection.execute("SELECT COUNT(*) FROM jobs").fetchone()[0] == 2
+
+
+def test_job_db_connection_reused(job_db_path):
+    with DB(job_db_path=job_db_path) as database:
+        connection = database.connection
+
+    with DB(job_db_path=job_db_path) as database:
+        assert database.connection is connection
+        assert database.connection.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_job_db_lookup_uses_index(job_db_path):
+    with DB(job_db_path=job_db_path) as database:
+        query_plan = database.connection.execute(
+            "EXPLAIN QUERY PLAN SELECT EXISTS(SELECT 1 FROM jobs WHERE job_name = ? AND prow_job_id = ?)",
+            ("job", "1"),
+        ).fetchall()
+
+    assert f"USING COVERING INDEX {JOBS_UNIQUE_INDEX}" in str(query_plan)
+
+
+def test_job_db_legacy_duplicates_removed(job_db_path):
+    connection = create_legacy_db(db_path=job_db_path, rows=10)
+    with connection:
+        connection.executemany("INSERT INTO jobs VALUES (?, ?)", [("job-1", "prow-1"), ("job-1", "prow-1")])
+
+    connection.close()
+    with DB(job_db_path=job_db_path) as database:
+        assert database.connection.execute("SELECT COUNT(*) FROM jobs").fetchone()[0] == 10
+        assert not database.write(job_name="job-1", prow_job_id="prow-1")
+
+
+def test_job_db_concurrent_writers(job_db_path):
+    errors = []
+
+    def _write(thread_idx):
+        try:
+            for idx in range(200):
+                with DB(job_db_path=job_db_path) as database:
+                    # Every job is written by two threads
+                    database.write(job_name="job", prow_job_id=str((thread_idx // 2) * 200 + idx))
+                    database.add_queue_item(request_id=f"{thread_idx}-{idx}", hook_data={}, status="queued")
+        except Exception as ex:
+            errors.append(ex)
+
+    threads = [threading.Thread(target=_write, args=(thread_idx,)) for thread_idx in range(8)]
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    connection, _ = get_db_connection(db_path=job_db_path)
+    assert connection.execute("SELECT COUNT(*) FROM jobs").fetchone()[0] == 800
+    assert connection.execute("SELECT COUNT(*) FROM queue").fetchone()[0] == 1600
+
+
+def test_job_db_created_at(job_db_path):
+    with DB(job_db_path=job_db_path) as database:
+        database.write(job_name="job", prow_job_id="1")
+        created_at = database.connection.execute("SELECT created_at FROM jobs").fetchone()[0]
+
+    assert time.time() - 5 < created_at <= time.time()
+
+
+def test_job_db_legacy_rows_get_created_at(job_db_path):
+    create_legacy_db(db_path=job_db_path, rows=10).close()
+    with DB(job_db_path=job_db_path) as database:
+        created_at = [row[0] for row in database.connection.execute("SELECT created_at FROM jobs")]
+
+    assert len(created_at) == 10
+    assert all(time.time() - 5 < _created_at <= time.time() for _created_at in created_at)
+
+
+def test_compact_db(job_db_path):
+    add_jobs(db_path=job_db_path, rows=5000, age=2 * DAY)
+    add_jobs(db_path=job_db_path, rows=100)
+    with DB(job_db_path=job_db_path) as database:
+        for request_id, status in (
+            ("old-done", DONE_STATUS),
+            ("old-failed", FAILED_STATUS),
+            ("old-running", "running"),
+        ):
+            database.add_queue_item(request_id=request_id, hook_data={}, status=status)
+            database.connection.execute(
+                "UPDATE queue SET updated_at = '2000-01-01T00:00:00+00:00' WHERE request_id = ?", (request_id,)
+            )
+
+        database.connection.commit()
+        database.add_queue_item(request_id="new-done", hook_data={}, status=DONE_STATUS)
+        size_before = get_db_metrics(db_path=job_db_path)["size_bytes"]
+
+    compaction = compact_db(db_path=job_db_path, retention=DAY, finished_statuses=FINISHED_STATUSES, batch_size=500)
+    assert compaction["deleted"] == {"jobs": 5000, "queue": 2}
+    assert compaction["vacuumed_pages"] > 0
+
+    with DB(job_db_path=job_db_path) as database:
+        assert database.connection.execute("SELECT COUNT(*) FROM jobs").fetchone()[0] == 100
+        assert database.get_queue_items_by_status(statuses=("running", DONE_STATUS)) == ["old-running", "new-done"]
+
+    connection, _ = get_db_connection(db_path=job_db_path)
+    connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    metrics = get_db_metrics(db_path=job_db_path)
+    assert metrics["jobs_rows"] == 100
+    assert metrics["queue_rows"] == 2
+    assert metrics["free_bytes"] == 0
+    assert metrics["size_bytes"] < size_before
+
+
+def test_compact_legacy_db_converted_to_incremental_vacuum(job_db_path):
+    create_legacy_db(db_path=job_db_path, rows=1000).close()
+    with DB(job_db_path=job_db_path) as database:
+        assert database.connection.execute("PRAGMA auto_vacuum").fetchone()[0] != INCREMENTAL_AUTO_VACUUM
+
+    compact_db(db_path=job_db_path, retention=DAY, finished_statuses=FINISHED_STATUSES)
+    with DB(job_db_path=job_db_path) as database:
+        # The header is read again by the next transaction
+        assert database.connection.execute("SELECT COUNT(*) FROM jobs").fetchone()[0] == 1000
+        assert database.connection.execute("PRAGMA auto_vacuum").fetchone()[0] == INCREMENTAL_AUTO_VACUUM
+
+
+def test_compact_db_does_not_block_requests(mocker, job_db_path):
+    # Every batch is its own transaction; a request made between two batches is served without waiting
+    add_jobs(db_path=job_db_path, rows=5000, age=2 * DAY)
+    old_rows = []
+
+    def _request_between_batches(_pause):
+        # With timeout=0 a request which has to wait for the compaction fails instead of waiting
+        connection = sqlite3.connect(job_db_path, timeout=0)
+        try:
+            with connection:
+                connection.execute("INSERT INTO jobs VALUES (?, ?, ?)", ("job", f"probe-{len(old_rows)}", time.time()))
+
+            old_rows.append(
+                connection.execute("SELECT COUNT(*) FROM jobs WHERE created_at < ?", (time.time() - DAY,)).fetchone()[0]
+            )
+
+        finally:
+            connection.close()
+
+    mocker.patch(f"{JOB_DB_MODULE_PATH}.time.sleep", side_effect=_request_between_batches)
+    compaction = compact_db(db_path=job_db_path, retention=DAY, finished_statuses=FINISHED_STATUSES, batch_size=1000)
+
+    assert compaction["deleted"]["jobs"] == 5000
+    # One committed batch of 1000 rows before each request of the delete phase
+    assert old_rows[:5] == [4000, 3000, 2000, 1000, 0]
+    assert get_db_metrics(db_path=job_db_path)["jobs_rows"] == len(old_rows)
+
+
+def test_job_db_compactor(mocker, job_db_path):
+    add_jobs(db_path=job_db_path, rows=10, age=2 * DAY)
+    compactor = JobDBCompactor(
+        logger=LOGGER, finished_statuses=FINISHED_STATUSES, job_db_path=job_db_path, retention=DAY, interval=0.01
+    )
+    compactions = []
+    second_compaction_done = threading.Event()
+    compact = compactor.compact
+
+    def _compact():
+        compactions.append(compact())
+        if len(compactions) == 1:
+            add_jobs(db_path=job_db_path, rows=10, age=2 * DAY)
+
+        else:
+            second_compaction_done.set()
+
+    # Runs again after `interval`
+    mocker.patch.object(compactor, "compact", side_effect=_compact)
+    compactor.start()
+    try:
+        assert second_compaction_done.wait(timeout=10)
+
+    finally:
+        compactor.stop()
+
+    assert [_compaction["deleted"]["jobs"] for _compaction in compactions[:2]] == [10, 10]
+    metrics = compactor.metrics()
+    assert metrics["jobs_rows"] == 0
+    assert metrics["last_compaction"]["finished_at"]
+
+
+def test_re_trigger_queue_metrics(job_db_path):
+    add_jobs(db_path=job_db_path, rows=10)
+    re_trigger_queue = ReTriggerQueue(logger=LOGGER, workers=1, job_db_path=job_db_path)
+    metrics = re_trigger_queue.metrics()
+    assert metrics["jobs_rows"] == 10
+    assert metrics["queue_rows"] == 0
+    assert metrics["queued_requests"] == 0
+    assert metrics["size_bytes"] > 0
+    assert metrics["last_compaction"] is None
+
+    re_trigger_queue.compactor.compact()
+    assert re_trigger_queue.metrics()["last_compaction"]["deleted"] == {"jobs": 0, "queue": 0}
@@ -1,19 +1,85 @@
 import copy
+import threading
+import tracemalloc
+from xml.etree import ElementTree
 
 import pytest
 from simple_logger.logger import get_logger
 
-import xmltodict
-
-from ci_jobs_trigger.libs.openshift_ci.re_trigger.re_trigger import JobTriggering
+from ci_jobs_trigger.libs.openshift_ci.re_trigger.job_db import DB
+from ci_jobs_trigger.libs.openshift_ci.re_trigger.job_queue import (
+    DONE_STATUS,
+    FAILED_STATUS,
+    QUEUED_STATUS,
+    ReTriggerQueue,
+)
+from ci_jobs_trigger.libs.openshift_ci.re_trigger.re_trigger import (
+    JUNIT_STREAM_CHUNK_SIZE,
+    PRE_PHASE_TESTCASE_NAME,
+    JobTriggering,
+)
+from ci_jobs_trigger.libs.openshift_ci.re_trigger.status_poller import ProwJobStatusPoller
+from ci_jobs_trigger.utils.junit_stream import iter_junit_testcases
 
 LOGGER = get_logger(name=__name__)
+JOB_TRIGGER_MODULE_PATH = "ci_jobs_trigger.libs.openshift_ci.re_trigger.re_trigger.JobTriggering"
+FAILED_PRE_PHASE_JUNIT = "ci_jobs_trigger/tests/job_retriggering/manifests/junit_operator_failed_pre_phase.xml"
+FAILED_TEST_PHASE_JUNIT = "ci_jobs_trigger/tests/job_retriggering/manifests/junit_operator_failed_test_phase.xml"
+
+
+class MockJunitResponse:
+    # Streamed junit_operator.xml response, counts the chunks read
+    def __init__(self, content, ok=True):
+        self.content = content
+        self.ok = ok
+        self.status_code = 200 if ok else 404
+        self.text = "" if ok else "Not Found"
+        self.chunks_read = 0
+        self.closed = False
+
+    def iter_content(self, chunk_size):
+        for idx in range(0, len(self.content), chunk_size):
+            self.chunks_read += 1
+            yield self.content[idx : idx + chunk_size]
+
+    def close(self):
+        self.closed = True
 
 
 @pytest.fixture()
-def junit_file(request):
-    with open(request.param) as fd:
-        return xmltodict.parse(fd.read())
+def junit_response(mocker, request):
+    content = request.param
+    if not isinstance(content, bytes):
+        with open(content, "rb") as fd:
+            content = fd.read()
+
+    response = MockJunitResponse(content=content)
+    mocker.patch(
+        "ci_jobs_trigger.libs.openshift_ci.re_trigger.re_trigger.get_http_client"
+    ).return_value.get.return_value = response
+    return response
+
+
+def _synthetic_junit(testcases_count, pre_phase_idx=None, pre_phase_failed=True, failure_size=1000):
+    # Multi-stage job junit, every container testcase failed with a `failure_size` log
+    testcases = []
+    for idx in range(testcases_count):
+        if idx == pre_phase_idx:
+            failure = '<failure message="">pre phase failed</failure>' if pre_phase_failed else ""
+            testcases.append(
+                f'<testcase name="{PRE_PHASE_TESTCASE_NAME}" time="1">{failure}'
+                "<system-out>The collected steps of multi-stage phase pre.</system-out></testcase>"
+            )
+        else:
+            testcases.append(
+                f'<testcase name="Run multi-stage test test - step-{idx} container test" time="1">'
+                f'<failure message="">{"x" * failure_size}</failure></testcase>'
+            )
+
+    return (
+        f'<testsuites><testsuite name="step graph" tests="{testcases_count}"><properties></properties>'
+        f"{''.join(testcases)}</testsuite></testsuites>"
+    ).encode()
 
 
 @pytest.fixture()
@@ -45,37 +111,82 @@ def test_verify_job_trigger_mandatory_params(hook_data_dict, param):
 
 
 @pytest.mark.parametrize(
-    "junit_file",
-    ["ci_jobs_trigger/tests/job_retriggering/manifests/junit_operator_failed_pre_phase.xml"],
-    indirect=True,
+    "junit_response, failed_on_setup",
+    [(FAILED_PRE_PHASE_JUNIT, True), (FAILED_TEST_PHASE_JUNIT, False)],
+    indirect=["junit_response"],
 )
-def test_failed_job_in_pre_phase(junit_file, job_triggering):
-    tests_dict = job_triggering.get_testsuites_testcase_from_junit_operator(junit_xml=junit_file)
-    assert job_triggering.is_build_failed_on_setup(tests_dict=tests_dict), "Job should fail on pre phase but did not"
+def test_failed_job_on_setup(junit_response, failed_on_setup, job_triggering):
+    assert (
+        job_triggering.is_build_failed_on_setup(tests_dict=job_triggering.get_tests_from_junit_operator_by_build_id())
+        is failed_on_setup
+    )
+    assert junit_response.closed
 
 
-@pytest.mark.parametrize(
-    "junit_file",
-    ["ci_jobs_trigger/tests/job_retriggering/manifests/junit_operator_failed_test_phase.xml"],
-    indirect=True,
-)
-def test_failed_job_in_tests_phase(junit_file, job_triggering):
-    tests_dict = job_triggering.get_testsuites_testcase_from_junit_operator(junit_xml=junit_file)
-    assert not job_triggering.is_build_failed_on_setup(
-        tests_dict=tests_dict
-    ), "Job should fail on test phase but did not"
+@pytest.mark.parametrize("junit_response", [_synthetic_junit(testcases_count=1, pre_phase_idx=0)], indirect=True)
+def test_single_testcase_junit(junit_response, job_triggering):
+    assert job_triggering.is_build_failed_on_setup(
+        tests_dict=job_triggering.get_tests_from_junit_operator_by_build_id()
+    ), "Job should fail on pre phase but did not"
+
+
+@pytest.mark.parametrize("junit_response", [FAILED_PRE_PHASE_JUNIT, FAILED_TEST_PHASE_JUNIT], indirect=True)
+@pytest.mark.parametrize("chunk_size", [1, 100, 64 * 1024])
+def test_streamed_junit_chunk_size(junit_response, chunk_size):
+    testcases = list(iter_junit_testcases(chunks=junit_response.iter_content(chunk_size=chunk_size)))
+    assert [(test["@name"], "failure" in test) for test in testcases] == [
+        (testcase.get("name"), testcase.find("failure") is not None)
+        for testcase in ElementTree.fromstring(junit_response.content).iter("testcase")
+    ]
+
+
+@pytest.mark.parametrize("pre_phase_failed", [True, False])
+def test_streamed_junit_stops_at_pre_phase(mocker, job_triggering, pre_phase_failed):
+    # The rest of junit_operator.xml is not downloaded once the pre phase testcase was read
+    response = MockJunitResponse(
+        content=_synthetic_junit(testcases_count=2000, pre_phase_idx=5, pre_phase_failed=pre_phase_failed)
+    )
+    mocker.patch(
+        "ci_jobs_trigger.libs.openshift_ci.re_trigger.re_trigger.get_http_client"
+    ).return_value.get.return_value = response
+    assert (
+        job_triggering.is_build_failed_on_setup(tests_dict=job_triggering.get_tests_from_junit_operator_by_build_id())
+        is pre_phase_failed
+    )
+    assert response.chunks_read == 1
+    assert response.closed
+
+
+@pytest.mark.parametrize("junit_response", [b"<testsuites><testsuite><testcase name="], indirect=True)
+def test_streamed_junit_malformed(junit_response, job_triggering):
+    with pytest.raises(ElementTree.ParseError):
+        job_triggering.is_build_failed_on_setup(tests_dict=job_triggering.get_tests_from_junit_operator_by_build_id())
+
+    assert junit_response.closed
+
+
+@pytest.mark.parametrize("junit_response", [_synthetic_junit(testcases_count=5000, failure_size=2000)], indirect=True)
+def test_streamed_junit_memory(junit_response, job_triggering):
+    # ~10MB junit_operator.xml without a pre phase testcase is read to the end, memory is bounded by the chunks
+    tracemalloc.start()
+    try:
+        assert not job_triggering.is_build_failed_on_setup(
+            tests_dict=job_triggering.get_tests_from_junit_operator_by_build_id()
+        )
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert junit_response.chunks_read == -(-len(junit_response.content) // JUNIT_STREAM_CHUNK_SIZE)
+    assert peak < len(junit_response.content) / 20
 
 
 class TestJobTriggering:
     JOB_NAME = "periodic-ci-CSPI-QE-MSI-openshift-ci-trigger-poc-test-fail-setup"
     PROW_JOB_ID = "123456"
 
-    @pytest.mark.parametrize(
-        "junit_file",
-        ["ci_jobs_trigger/tests/job_retriggering/manifests/junit_operator_failed_pre_phase.xml"],
-        indirect=True,
-    )
-    def test_add_job_trigger(self, mocker, db_filepath, junit_file, job_triggering):
+    @pytest.mark.parametrize("junit_response", [FAILED_PRE_PHASE_JUNIT], indirect=True)
+    def test_add_job_trigger(self, mocker, db_filepath, junit_response, job_triggering):
         job_trigger_module_path = "ci_jobs_trigger.libs.openshift_ci.re_trigger.re_trigger.JobTriggering"
         mocker.patch(
             f"{job_trigger_module_path}._trigger_job",
@@ -85,14 +196,158 @@ class TestJobTriggering:
             f"{job_trigger_module_path}.wait_for_job_completed",
             return_value=True,
         )
-        mocker.patch(
-            f"{job_trigger_module_path}.get_tests_from_junit_operator_by_build_id",
-            return_value=junit_file,
-        )
-
         assert job_triggering.execute_trigger(job_db_path=db_filepath), "Job should be triggered"
+        assert junit_response.closed
 
     def test_already_triggered(self, db_filepath, hook_data_dict):
         hook_data_dict["prow_job_id"] = TestJobTriggering.PROW_JOB_ID
         job_triggering = JobTriggering(hook_data=hook_data_dict, logger=LOGGER)
         assert not job_triggering.execute_trigger(db_filepath), "Job should not be triggered"
+
+
+class TestReTriggerQueue:
+    @pytest.fixture()
+    def queue_db_filepath(self, tmp_path):
+        return tmp_path / "job_re_triggering_queue_test.db"
+
+    def test_enqueue_missing_params(self, queue_db_filepath, hook_data_dict):
+        hook_data_dict.pop("job_name")
+        with pytest.raises(ValueError):
+            ReTriggerQueue(logger=LOGGER, workers=1, job_db_path=queue_db_filepath).enqueue(hook_data=hook_data_dict)
+
+    def test_enqueue_and_process(self, mocker, queue_db_filepath, hook_data_dict):
+        mocker.patch(f"{JOB_TRIGGER_MODULE_PATH}.execute_trigger", return_value=True)
+        re_trigger_queue = ReTriggerQueue(logger=LOGGER, workers=2, job_db_path=queue_db_filepath)
+        request_id = re_trigger_queue.enqueue(hook_data=hook_data_dict)
+        assert re_trigger_queue.status(request_id=request_id)["status"] == QUEUED_STATUS
+
+        re_trigger_queue.start()
+        re_trigger_queue.join()
+        status = re_trigger_queue.status(request_id=request_id)
+        assert status["status"] == DONE_STATUS
+        assert status["result"] is True
+        assert "hook_data" not in status
+
+    def test_failed_request(self, mocker, queue_db_filepath, hook_data_dict):
+        mocker.patch(f"{JOB_TRIGGER_MODULE_PATH}.execute_trigger", side_effect=ValueError("trigger failed"))
+        mocker.patch("ci_jobs_trigger.libs.openshift_ci.re_trigger.job_queue.process_webhook_exception")
+        re_trigger_queue = ReTriggerQueue(logger=LOGGER, workers=1, job_db_path=queue_db_filepath)
+        re_trigger_queue.start()
+        request_id = re_trigger_queue.enqueue(hook_data=hook_data_dict)
+        re_trigger_queue.join()
+        status = re_trigger_queue.status(request_id=request_id)
+        assert status["status"] == FAILED_STATUS
+        assert status["error"] == "trigger failed"
+
+    def test_unfinished_requests_resumed_on_start(self, mocker, queue_db_filepath, hook_data_dict):
+        execute_trigger_mock = mocker.patch(f"{JOB_TRIGGER_MODULE_PATH}.execute_trigger", return_value=True)
+        with DB(job_db_path=queue_db_filepath) as database:
+            database.add_queue_item(request_id="unfinished", hook_data=hook_data_dict, status=QUEUED_STATUS)
+
+        re_trigger_queue = ReTriggerQueue(logger=LOGGER, workers=1, job_db_path=queue_db_filepath)
+        re_trigger_queue.start()
+        re_trigger_queue.join()
+        assert execute_trigger_mock.call_count == 1
+        assert re_trigger_queue.status(request_id="unfinished")["status"] == DONE_STATUS
+
+    @pytest.mark.parametrize("execute_trigger", [{"return_value": True}, {"side_effect": ValueError("trigger failed")}])
+    def test_hook_data_cleared_when_finished(self, mocker, queue_db_filepath, hook_data_dict, execute_trigger):
+        mocker.patch(f"{JOB_TRIGGER_MODULE_PATH}.execute_trigger", **execute_trigger)
+        mocker.patch("ci_jobs_trigger.libs.openshift_ci.re_trigger.job_queue.process_webhook_exception")
+        re_trigger_queue = ReTriggerQueue(logger=LOGGER, workers=1, job_db_path=queue_db_filepath)
+        request_id = re_trigger_queue.enqueue(hook_data={**hook_data_dict, "unused": "value"})
+        with DB(job_db_path=queue_db_filepath) as database:
+            assert database.get_queue_item(request_id=request_id)["hook_data"] == hook_data_dict
+
+        re_trigger_queue.start()
+        re_trigger_queue.join()
+        with DB(job_db_path=queue_db_filepath) as database:
+            assert database.get_queue_item(request_id=request_id)["hook_data"] is None
+
+    def test_finished_requests_hook_data_cleared_on_start(self, queue_db_filepath, hook_data_dict):
+        with DB(job_db_path=queue_db_filepath) as database:
+            database.add_queue_item(request_id="done", hook_data=hook_data_dict, status=DONE_STATUS)
+
+        ReTriggerQueue(logger=LOGGER, workers=1, job_db_path=queue_db_filepath).start()
+        with DB(job_db_path=queue_db_filepath) as database:
+            assert database.get_queue_item(request_id="done")["hook_data"] is None
+
+    def test_unknown_request_status(self, queue_db_filepath):
+        assert not ReTriggerQueue(logger=LOGGER, workers=1, job_db_path=queue_db_filepath).status(request_id="unknown")
+
+
+class MockGangwaySession:
+    def __init__(self, pending_polls=1):
+        self.pending_polls = pending_polls
+        self.requests_per_job = {}
+        self._lock = threading.Lock()
+
+    def get(self, url, headers):
+        prow_job_id = url.rsplit("/", 1)[-1]
+        with self._lock:
+            self.requests_per_job[prow_job_id] = self.requests_per_job.get(prow_job_id, 0) + 1
+            polls = self.requests_per_job[prow_job_id]
+
+        return MockGangwayResponse(job_status="PENDING" if polls <= self.pending_polls else "FAILURE")
+
+
+class MockGangwayResponse:
+    def __init__(self, job_status):
+        self.ok = True
+        self.text = f"job_status: {job_status}"
+
+
+def _wait_for_jobs(poller, prow_job_ids, timeout=5):
+    results = {}
+
+    def _wait(_index, _prow_job_id):
+        results[_index] = poller.wait(prow_job_id=_prow_job_id, trigger_token="token", timeout=timeout)
+
+    threads = [threading.Thread(target=_wait, args=(idx, _id)) for idx, _id in enumerate(prow_job_ids)]
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    return results
+
+
+class TestProwJobStatusPoller:
+    def test_wait_for_job_completed(self, hook_data_dict):
+        poller = ProwJobStatusPoller(logger=LOGGER, interval=0.01, session=MockGangwaySession(pending_polls=2))
+        job_triggering = JobTriggering(hook_data=hook_data_dict, logger=LOGGER, status_poller=poller)
+        assert job_triggering.wait_for_job_completed(), "Job should be completed"
+        assert poller.requests_count == 3
+
+    def test_wait_for_job_not_found(self, hook_data_dict):
+        session = MockGangwaySession()
+        session.get = lambda url, headers: type("Response", (), {"ok": False, "text": ""})()
+        poller = ProwJobStatusPoller(logger=LOGGER, interval=0.01, session=session)
+        job_triggering = JobTriggering(hook_data=hook_data_dict, logger=LOGGER, status_poller=poller)
+        assert not job_triggering.wait_for_job_completed(), "Job should not be found"
+
+    def test_wait_timeout(self):
+        poller = ProwJobStatusPoller(logger=LOGGER, interval=0.01, session=MockGangwaySession(pending_polls=1000))
+        assert poller.wait(prow_job_id="123456", trigger_token="token", timeout=0.05) is None
+        assert not poller._waiters, "Timed out waiter should be removed"
+
+    @pytest.mark.parametrize("waiters", [1, 10, 50])
+    def test_request_volume_shared_prow_job(self, waiters):
+        # All waiters on the same prow job share one status request per tick
+        session = MockGangwaySession(pending_polls=3)
+        poller = ProwJobStatusPoller(logger=LOGGER, interval=0.05, session=session)
+        results = _wait_for_jobs(poller=poller, prow_job_ids=["123456"] * waiters)
+        assert set(results.values()) == {"FAILURE"}
+        LOGGER.info(f"{waiters} waiters on one prow job: {poller.requests_count} gangway requests")
+        assert poller.requests_count == 4, "Requests should not scale with the number of waiters"
+
+    @pytest.mark.parametrize("waiters", [1, 10, 50])
+    def test_request_volume_distinct_prow_jobs(self, waiters):
+        # Distinct prow jobs are polled once per tick each, never once per waiter loop
+        session = MockGangwaySession(pending_polls=3)
+        poller = ProwJobStatusPoller(logger=LOGGER, interval=0.05, max_workers=4, session=session)
+        results = _wait_for_jobs(poller=poller, prow_job_ids=[str(_id) for _id in range(waiters)])
+        assert set(results.values()) == {"FAILURE"}
+        LOGGER.info(f"{waiters} waiters on distinct prow jobs: {poller.requests_count} gangway requests")
+        assert set(session.requests_per_job.values()) == {4}
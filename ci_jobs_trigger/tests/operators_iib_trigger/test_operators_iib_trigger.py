@@ -1,7 +1,13 @@
+import io
+import json
+import multiprocessing
 import tempfile
+import threading
+import time
+import tracemalloc
+from urllib.parse import parse_qs, urlparse
 
 import pytest
-import requests
 from simple_logger.logger import get_logger
 
 from ci_jobs_trigger.libs.operators_iib_trigger.iib_trigger import (
@@ -9,9 +15,17 @@ from ci_jobs_trigger.libs.operators_iib_trigger.iib_trigger import (
     upload_download_s3_bucket_file,
     verify_s3_or_local_file,
     get_new_iib,
+    get_datagrepper_marks_from_file,
+    IIBCycleCoordinator,
+    OperatorsIIBIndex,
+    run_iib_update,
 )
+from ci_jobs_trigger.tests.utils import StubHandler
+from ci_jobs_trigger.utils.http_client import HttpClient
+from ci_jobs_trigger.utils.json_stream import iter_json_array_items
 
 LOGGER = get_logger("test_operators_iib_trigger")
+IIB_TRIGGER_MODULE_PATH = "ci_jobs_trigger.libs.operators_iib_trigger.iib_trigger"
 
 
 class MockRequestGet:
@@ -33,12 +47,12 @@ class MockRequestGet:
 
 class MockS3Client:
     @staticmethod
-    def download_file(Filename, Bucket, Key):  # noqa N803
-        return True
+    def get_object(Bucket, Key, **kwargs):  # noqa N803
+        return {"Body": io.BytesIO(b"{}"), "ETag": '"etag"'}
 
     @staticmethod
-    def upload_file(Filename, Bucket, Key):  # noqa N803
-        return True
+    def put_object(Bucket, Key, Body, **kwargs):  # noqa N803
+        return {"ETag": '"etag"'}
 
 
 @pytest.fixture()
@@ -98,7 +112,7 @@ def s3_client_mock(mocker):
 
 
 def test_fetch_update_iib_and_trigger_jobs_no_ci_jobs_config(mocker, functions_mocker, config_dict_no_ci_jobs):
-    mocker.patch.object(requests, "get", return_value=MockRequestGet())
+    mocker.patch.object(HttpClient, "get", return_value=MockRequestGet())
     assert not fetch_update_iib_and_trigger_jobs(
         config_dict=config_dict_no_ci_jobs,
         logger=LOGGER,
@@ -107,10 +121,50 @@ def test_fetch_update_iib_and_trigger_jobs_no_ci_jobs_config(mocker, functions_m
 
 
 def test_fetch_update_iib_and_trigger_jobs(mocker, functions_mocker, config_dict):
-    mocker.patch.object(requests, "get", return_value=MockRequestGet())
+    mocker.patch.object(HttpClient, "get", return_value=MockRequestGet())
     fetch_update_iib_and_trigger_jobs(config_dict=config_dict, logger=LOGGER, tmp_dir=tempfile.mkdtemp(dir="/tmp"))
 
 
+@pytest.mark.parametrize(
+    "cycle_config, new_iib, error",
+    [
+        pytest.param(
+            {
+                "s3_bucket_operators_latest_iib_path": "bucket/iib.json",
+                "local_operators_latest_iib_filepath": "iib.json",
+            },
+            {},
+            "Cannot set both",
+            id="s3_and_local_file",
+        ),
+        pytest.param(
+            {"s3_bucket_operators_latest_iib_path": "bucket/iib.json"}, {}, "Failed to download", id="s3_download"
+        ),
+        pytest.param(
+            {"s3_bucket_operators_latest_iib_path": "bucket/iib.json", "aws_region": "us-east-1"},
+            None,
+            "Failed to update",
+            id="s3_upload",
+        ),
+    ],
+)
+def test_fetch_update_iib_and_trigger_jobs_cycle_error(mocker, config_dict, cycle_config, new_iib, error):
+    config_dict.update(cycle_config)
+    mocker.patch(f"{IIB_TRIGGER_MODULE_PATH}.get_config", return_value=config_dict)
+    mocker.patch(f"{IIB_TRIGGER_MODULE_PATH}.send_slack_message")
+    mocker.patch(f"{IIB_TRIGGER_MODULE_PATH}.upload_download_s3_bucket_file", return_value=True)
+    mocker.patch(f"{IIB_TRIGGER_MODULE_PATH}.get_new_iib", return_value=new_iib)
+    cycle_results = {}
+
+    assert (
+        fetch_update_iib_and_trigger_jobs(
+            logger=LOGGER, tmp_dir=tempfile.mkdtemp(dir="/tmp"), cycle_results=cycle_results
+        )
+        is False
+    )
+    assert error in cycle_results["error"]
+
+
 def test_both_s3_and_local_file_configs():
     assert not verify_s3_or_local_file(
         s3_bucket_operators_latest_iib_path="s3_bucket_operators_latest_iib",
@@ -132,10 +186,10 @@ def test_invalid_upload_download_s3_action():
         )
 
 
-def test_download_file_from_s3_bucket(s3_client_mock):
+def test_download_file_from_s3_bucket(s3_client_mock, tmp_path):
     assert upload_download_s3_bucket_file(
         action="download",
-        filename="test",
+        filename=str(tmp_path / "test.json"),
         s3_bucket_file_full_path="non-existing-bucket/test",
         region=None,
         logger=LOGGER,
@@ -157,7 +211,7 @@ def test_upload_missing_file_from_s3_bucket(s3_client_mock):
 
 
 def test_get_new_iib(mocker, tmp_path, get_new_iib_config_dict):
-    mocker.patch.object(requests, "get", return_value=MockRequestGet())
+    mocker.patch.object(HttpClient, "get", return_value=MockRequestGet())
     new_data = get_new_iib(config_data=get_new_iib_config_dict, logger=LOGGER)
     expected_data = {
         "v4.15": {
@@ -169,3 +223,299 @@ def test_get_new_iib(mocker, tmp_path, get_new_iib_config_dict):
         "v4.16": {"jenkins-job-name": {"operators": {"operator": {"new-iib": False}}, "ci": "jenkins"}},
     }
     assert new_data == expected_data
+
+
+def test_get_new_iib_one_request_per_operator(mocker, get_new_iib_config_dict):
+    get_new_iib_config_dict["ci_jobs"]["v4.15"].append({
+        "name": "openshift-ci-job-name-2",
+        "ci": "openshift-ci",
+        "products": {"product": "operator", "product-2": "operator-2"},
+    })
+    get_new_iib_config_dict["ci_jobs"]["v4.16"][0]["products"]["product-2"] = "operator-2"
+    http_get_mock = mocker.patch.object(HttpClient, "get", return_value=MockRequestGet())
+
+    new_data = get_new_iib(config_data=get_new_iib_config_dict, logger=LOGGER)
+    assert http_get_mock.call_count == 2
+    assert new_data["v4.15"]["openshift-ci-job-name-2"]["operators"]["operator"]["iib"] == "iib:quay.io/iib:690654"
+
+
+def test_operators_iib_index_requests_count(mocker):
+    mocker.patch.object(HttpClient, "get", return_value=MockRequestGet())
+    operators_iib_index = OperatorsIIBIndex(logger=LOGGER)
+    for _ocp_version in ("v4.15", "v4.16"):
+        for _operator in ("operator", "operator-2", "operator"):
+            operators_iib_index.get(operator_name=_operator, ocp_version=_ocp_version)
+
+    assert operators_iib_index.requests_count == 2
+    assert operators_iib_index.get(operator_name="operator", ocp_version="v4.15") == [
+        {"ocp_version": "v4.15", "index_image": "iib:quay.io/iib:690654"}
+    ]
+    assert operators_iib_index.get(operator_name="operator", ocp_version="v4.16") == []
+
+
+class DatagrepperStubHandler(StubHandler):
+    # One index image per operator (`contains`), answered after `latency` seconds; counts the requests served at once
+    disable_nagle_algorithm = True
+
+    def do_GET(self):  # noqa N802
+        with self.server.lock:
+            self.server.requests_count += 1
+            self.server.in_flight += 1
+            self.server.max_in_flight = max(self.server.max_in_flight, self.server.in_flight)
+
+        time.sleep(self.server.latency)
+        with self.server.lock:
+            self.server.in_flight -= 1
+
+        operator_name = parse_qs(urlparse(self.path).query)["contains"][0]
+        body = json.dumps({
+            "raw_messages": [
+                {"msg": {"index": {"ocp_version": "v4.15", "index_image": f"quay.io/{operator_name}/iib:1"}}}
+            ]
+        }).encode()
+        self._send(status=200, body=body)
+
+
+@pytest.fixture()
+def datagrepper_stub(mocker, start_stub_server):
+    server = start_stub_server(
+        handler_class=DatagrepperStubHandler,
+        latency=0.05,
+        lock=threading.Lock(),
+        requests_count=0,
+        in_flight=0,
+        max_in_flight=0,
+    )
+    mocker.patch(f"{IIB_TRIGGER_MODULE_PATH}.DATAGREPPER_QUERY_URL", f"{server.url}/raw?topic=test")
+    return server
+
+
+@pytest.fixture()
+def many_operators_config_dict(get_new_iib_config_dict):
+    get_new_iib_config_dict["ci_jobs"] = {
+        "v4.15": [
+            {
+                "name": f"openshift-ci-job-name-{_job}",
+                "ci": "openshift-ci",
+                "products": {f"operator-{_operator}": f"operator-{_operator}" for _operator in range(16)},
+            }
+            for _job in range(3)
+        ]
+    }
+    return get_new_iib_config_dict
+
+
+@pytest.mark.parametrize("max_concurrency", [1, 4])
+def test_get_new_iib_concurrent_fetch(datagrepper_stub, many_operators_config_dict, max_concurrency):
+    # 16 distinct operators with 50ms injected latency each, the stub counts the requests served at the same time
+    many_operators_config_dict["max_concurrency"] = max_concurrency
+    new_data = get_new_iib(config_data=many_operators_config_dict, logger=LOGGER)
+    assert list(new_data["v4.15"]) == [f"openshift-ci-job-name-{_job}" for _job in range(3)]
+    assert datagrepper_stub.requests_count == 16
+    assert datagrepper_stub.max_in_flight == max_concurrency
+
+
+class MockDatagrepper:
+    def __init__(self, messages, rows_per_page=2):
+        self.messages = messages
+        self.rows_per_page = rows_per_page
+        self.requests_params = []
+
+    def get(self, url, params, **kwargs):
+        self.requests_params.append(params)
+        messages = [_msg for _msg in self.messages if _msg["timestamp"] >= params.get("start", 0)]
+        pages = max((len(messages) + self.rows_per_page - 1) // self.rows_per_page, 1)
+        first_row = (params["page"] - 1) * self.rows_per_page
+        return MockDatagrepperResponse(
+            json_res={"raw_messages": messages[first_row : first_row + self.rows_per_page], "pages": pages}
+        )
+
+
+class MockDatagrepperResponse:
+    def __init__(self, json_res):
+        self.json_res = json_res
+
+    def json(self):
+        return self.json_res
+
+
+def _datagrepper_message(msg_id, timestamp, iib):
+    return {
+        "msg_id": msg_id,
+        "timestamp": timestamp,
+        "msg": {"index": {"ocp_version": "v4.15", "index_image": f"quay.io/iib:{iib}"}},
+    }
+
+
+def test_get_new_iib_paginated_incremental(mocker, get_new_iib_config_dict):
+    datagrepper = MockDatagrepper(
+        messages=[_datagrepper_message(msg_id=f"id-{_id}", timestamp=100 + _id, iib=600 + _id) for _id in range(5)]
+    )
+    mocker.patch.object(HttpClient, "get", side_effect=datagrepper.get)
+
+    new_data = get_new_iib(config_data=get_new_iib_config_dict, logger=LOGGER)
+    assert [_params["page"] for _params in datagrepper.requests_params] == [1, 2, 3]
+    assert new_data["v4.15"]["openshift-ci-job-name"]["operators"]["operator"]["iib"] == "quay.io/iib:604"
+    marks = get_datagrepper_marks_from_file(config_data=get_new_iib_config_dict)
+    assert marks["product"]["timestamp"] == 104
+    assert marks["product"]["msg_id"] == "id-4"
+
+    # Next cycle only asks for messages newer than the mark
+    datagrepper.requests_params = []
+    datagrepper.messages.append(_datagrepper_message(msg_id="id-5", timestamp=105, iib=605))
+    new_data = get_new_iib(config_data=get_new_iib_config_dict, logger=LOGGER)
+    assert datagrepper.requests_params == [
+        {"contains": "product", "order": "asc", "rows_per_page": 100, "page": 1, "start": 104}
+    ]
+    assert new_data["v4.15"]["openshift-ci-job-name"]["operators"]["operator"]["iib"] == "quay.io/iib:605"
+    assert new_data["v4.15"]["openshift-ci-job-name"]["operators"]["operator"]["new-iib"]
+
+    # No new messages; the latest known index is kept and no job is marked for trigger
+    datagrepper.requests_params = []
+    new_data = get_new_iib(config_data=get_new_iib_config_dict, logger=LOGGER)
+    assert datagrepper.requests_params[0]["start"] == 105
+    assert new_data["v4.15"]["openshift-ci-job-name"]["operators"]["operator"]["iib"] == "quay.io/iib:605"
+    assert not new_data["v4.15"]["openshift-ci-job-name"]["operators"]["operator"]["new-iib"]
+
+
+def _synthetic_datagrepper_payload(messages_count):
+    return json.dumps({
+        "raw_messages": [
+            {
+                "msg_id": f"id-{_id}",
+                "timestamp": 100 + _id,
+                "msg": {
+                    "index": {
+                        "ocp_version": "v4.15" if _id % 100 == 0 else "v4.10",
+                        "index_image": f"quay.io/iib:{_id}",
+                        "build_details": "x" * 400,
+                    }
+                },
+            }
+            for _id in range(messages_count)
+        ],
+        "count": messages_count,
+        "pages": 1,
+    }).encode()
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64 * 1024])
+def test_iter_json_array_items(chunk_size):
+    payload = _synthetic_datagrepper_payload(messages_count=20)
+    metadata = {}
+    raw_messages = list(
+        iter_json_array_items(
+            chunks=(payload[_idx : _idx + chunk_size] for _idx in range(0, len(payload), chunk_size)),
+            array_key="raw_messages",
+            metadata=metadata,
+        )
+    )
+    assert raw_messages == json.loads(payload)["raw_messages"]
+    assert metadata == {"count": 20, "pages": 1}
+
+
+def test_get_new_iib_streamed_response(datagrepper_stub, get_new_iib_config_dict):
+    new_data = get_new_iib(config_data=get_new_iib_config_dict, logger=LOGGER)
+    get_new_iib_config_dict["local_operators_latest_iib_filepath"].write_text("")
+    get_new_iib_config_dict["datagrepper_stream_response"] = True
+    assert get_new_iib(config_data=get_new_iib_config_dict, logger=LOGGER) == new_data
+
+
+def test_streamed_datagrepper_response_memory():
+    # ~10MB payload where 1% of the messages match the wanted ocp_version, memory is bounded by the chunks
+    payload = _synthetic_datagrepper_payload(messages_count=20000)
+    chunk_size = 64 * 1024
+
+    tracemalloc.start()
+    try:
+        streamed_matched = [
+            _msg["msg"]["index"]["index_image"]
+            for _msg in iter_json_array_items(
+                chunks=(payload[_idx : _idx + chunk_size] for _idx in range(0, len(payload), chunk_size)),
+                array_key="raw_messages",
+                metadata={},
+            )
+            if _msg["msg"]["index"]["ocp_version"] == "v4.15"
+        ]
+        _, streamed_peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert streamed_matched == [f"quay.io/iib:{_id}" for _id in range(0, 20000, 100)]
+    assert streamed_peak < len(payload) / 20
+
+
+def test_iib_cycle_requests_coalesced(mocker):
+    mocker.patch(f"{IIB_TRIGGER_MODULE_PATH}.get_config", return_value={"run_interval": "1h"})
+    cycles = []
+
+    def _fetch_update_iib_and_trigger_jobs(logger, tmp_dir, cycle_results):
+        cycles.append(time.monotonic())
+        time.sleep(0.2)
+        cycle_results["triggered_jobs"] = {"openshift-ci": [f"job-{len(cycles)}"]}
+        return {}
+
+    mocker.patch(
+        f"{IIB_TRIGGER_MODULE_PATH}.fetch_update_iib_and_trigger_jobs", side_effect=_fetch_update_iib_and_trigger_jobs
+    )
+    cycle_coordinator = IIBCycleCoordinator()
+    threading.Thread(
+        target=run_iib_update,
+        kwargs={"logger": LOGGER, "tmp_dir": "/tmp", "cycle_coordinator": cycle_coordinator},
+        daemon=True,
+    ).start()
+
+    # Requests made while the first (scheduled) cycle is in flight get its results
+    time.sleep(0.05)
+    assert cycle_coordinator.request_cycle(timeout=5)["triggered_jobs"] == {"openshift-ci": ["job-1"]}
+    assert len(cycles) == 1
+
+    results = []
+    barrier = threading.Barrier(5)
+
+    def _request_cycle():
+        barrier.wait()
+        results.append(cycle_coordinator.request_cycle(timeout=5))
+
+    threads = [threading.Thread(target=_request_cycle) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    assert len(results) == 5
+    assert all(_results == results[0] for _results in results)
+    assert results[0]["triggered_jobs"] == {"openshift-ci": ["job-2"]}
+    assert len(cycles) == 2
+
+
+def test_iib_cycle_error_returned(mocker):
+    mocker.patch(f"{IIB_TRIGGER_MODULE_PATH}.get_config", return_value={"run_interval": "1h"})
+    mocker.patch(f"{IIB_TRIGGER_MODULE_PATH}.send_slack_message")
+    mocker.patch(f"{IIB_TRIGGER_MODULE_PATH}.fetch_update_iib_and_trigger_jobs", side_effect=ValueError("s3 is down"))
+    cycle_coordinator = IIBCycleCoordinator()
+    threading.Thread(
+        target=run_iib_update,
+        kwargs={"logger": LOGGER, "tmp_dir": "/tmp", "cycle_coordinator": cycle_coordinator},
+        daemon=True,
+    ).start()
+
+    assert cycle_coordinator.request_cycle(timeout=5)["error"] == "s3 is down"
+
+
+def test_iib_cycle_process_exited(mocker):
+    # An invalid cron schedule ends `run_iib_update`, requests do not wait for a cycle which never runs
+    mocker.patch(f"{IIB_TRIGGER_MODULE_PATH}.get_config", return_value={"cron_schedule": "invalid cron"})
+    mocker.patch("ci_jobs_trigger.utils.scheduler.send_slack_message")
+    cycle_coordinator = IIBCycleCoordinator()
+    cycle_coordinator.process = multiprocessing.get_context("fork").Process(
+        target=run_iib_update, kwargs={"logger": LOGGER, "tmp_dir": "/tmp", "cycle_coordinator": cycle_coordinator}
+    )
+    cycle_coordinator.process.start()
+    cycle_coordinator.process.join(timeout=5)
+
+    assert not cycle_coordinator.is_cycle_process_alive()
+    start_time = time.monotonic()
+    assert cycle_coordinator.request_cycle(timeout=60) is None
+    assert time.monotonic() - start_time < 5
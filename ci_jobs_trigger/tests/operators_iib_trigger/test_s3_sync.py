@@ -0,0 +1,307 @@
+import hashlib
+import json
+import os
+from collections import Counter
+
+import boto3
+import pytest
+from botocore.config import Config
+from botocore.exceptions import ParamValidationError
+from simple_logger.logger import get_logger
+
+from ci_jobs_trigger.libs.operators_iib_trigger.iib_trigger import (
+    download_iib_file_from_s3_bucket,
+    get_new_iib,
+    get_iib_data_from_file,
+    get_s3_state,
+    merge_iib_data,
+    write_new_data_to_file_and_upload_to_s3,
+)
+from ci_jobs_trigger.tests.operators_iib_trigger.test_operators_iib_trigger import MockRequestGet
+from ci_jobs_trigger.tests.utils import StubHandler
+from ci_jobs_trigger.utils.http_client import HttpClient
+
+LOGGER = get_logger("test_s3_sync")
+IIB_TRIGGER_MODULE_PATH = "ci_jobs_trigger.libs.operators_iib_trigger.iib_trigger"
+S3_PATH = "bucket/operators-latest-iib.json"
+IIB_DATA = {"v4.15": {"job-1": {"operators": {"operator-1": {"iib": "iib:1", "new-iib": True}}, "ci": "jenkins"}}}
+
+
+class S3StubHandler(StubHandler):
+    # Minimal path-style S3: GET/PUT of objects, with ETag, If-None-Match and If-Match support
+    def do_GET(self):  # noqa N802
+        obj = self.server.objects.get(self.path)
+        if not obj:
+            self.server.requests["GET 404"] += 1
+            return self._send(status=404, body=b"<Error><Code>NoSuchKey</Code></Error>")
+
+        if self.headers.get("If-None-Match") == obj["etag"]:
+            self.server.requests["GET 304"] += 1
+            return self._send(status=304, headers={"ETag": obj["etag"]})
+
+        self.server.requests["GET 200"] += 1
+        return self._send(status=200, body=obj["body"], headers={"ETag": obj["etag"]})
+
+    def do_PUT(self):  # noqa N802
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        if self.server.fail_puts:
+            self.server.requests["PUT 403"] += 1
+            return self._send(status=403, body=b"<Error><Code>AccessDenied</Code></Error>")
+
+        obj = self.server.objects.get(self.path)
+        if_match, if_none_match = self.headers.get("If-Match"), self.headers.get("If-None-Match")
+        if (if_match and (not obj or obj["etag"] != if_match)) or (if_none_match == "*" and obj):
+            self.server.requests["PUT 412"] += 1
+            return self._send(status=412, body=b"<Error><Code>PreconditionFailed</Code></Error>")
+
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        self.server.objects[self.path] = {"body": body, "etag": etag}
+        self.server.requests["PUT"] += 1
+        return self._send(status=200, headers={"ETag": etag})
+
+
+@pytest.fixture()
+def s3_stub(mocker, start_stub_server):
+    server = start_stub_server(handler_class=S3StubHandler, objects={}, requests=Counter(), fail_puts=False)
+    client = boto3.client(
+        "s3",
+        endpoint_url=server.url,
+        region_name="us-east-1",
+        aws_access_key_id="key",
+        aws_secret_access_key="secret",
+        config=Config(
+            s3={"addressing_style": "path"},
+            retries={"max_attempts": 1},
+        ),
+    )
+    mocker.patch(f"{IIB_TRIGGER_MODULE_PATH}.s3_client", return_value=client)
+    mocker.patch(f"{IIB_TRIGGER_MODULE_PATH}.send_slack_message")
+    return server
+
+
+@pytest.fixture()
+def config_data(tmp_path):
+    return {
+        "s3_bucket_operators_latest_iib_path": S3_PATH,
+        "aws_region": "us-east-1",
+        "local_operators_latest_iib_filepath": str(tmp_path / "operators_latest_iib.json"),
+    }
+
+
+def download(config_data):
+    return download_iib_file_from_s3_bucket(
+        s3_bucket_operators_latest_iib_path=config_data["s3_bucket_operators_latest_iib_path"],
+        aws_region=config_data["aws_region"],
+        slack_errors_webhook_url=None,
+        logger=LOGGER,
+        target_file_path=config_data["local_operators_latest_iib_filepath"],
+    )
+
+
+def test_s3_download_only_when_modified(s3_stub, config_data):
+    s3_stub.objects[f"/{S3_PATH}"] = {"body": json.dumps(IIB_DATA).encode(), "etag": '"etag-1"'}
+
+    for _ in range(3):
+        assert download(config_data=config_data)
+
+    assert get_iib_data_from_file(config_data=config_data) == IIB_DATA
+    assert s3_stub.requests == {"GET 200": 1, "GET 304": 2}
+    assert get_s3_state(filename=config_data["local_operators_latest_iib_filepath"])["etag"] == '"etag-1"'
+
+    # Changed in s3 by another writer
+    new_data = {"v4.16": {}}
+    s3_stub.objects[f"/{S3_PATH}"] = {"body": json.dumps(new_data).encode(), "etag": '"etag-2"'}
+    assert download(config_data=config_data)
+    assert get_iib_data_from_file(config_data=config_data) == new_data
+    assert s3_stub.requests["GET 200"] == 2
+
+
+def test_s3_download_missing_local_file(s3_stub, config_data):
+    s3_stub.objects[f"/{S3_PATH}"] = {"body": json.dumps(IIB_DATA).encode(), "etag": '"etag-1"'}
+    download(config_data=config_data)
+    os.remove(config_data["local_operators_latest_iib_filepath"])
+
+    # The etag is known but the local copy is gone, the object is transferred again
+    download(config_data=config_data)
+    assert get_iib_data_from_file(config_data=config_data) == IIB_DATA
+    assert s3_stub.requests == {"GET 200": 2}
+
+
+def test_s3_upload_only_when_changed(s3_stub, config_data):
+    for _ in range(3):
+        write_new_data_to_file_and_upload_to_s3(config_data=config_data, new_data=IIB_DATA, logger=LOGGER)
+
+    assert s3_stub.requests == {"PUT": 1}
+    assert json.loads(s3_stub.objects[f"/{S3_PATH}"]["body"]) == IIB_DATA
+
+    # The uploaded object is the local copy, no need to download it
+    assert download(config_data=config_data)
+    assert s3_stub.requests == {"PUT": 1, "GET 304": 1}
+
+    write_new_data_to_file_and_upload_to_s3(config_data=config_data, new_data={"v4.16": {}}, logger=LOGGER)
+    assert s3_stub.requests["PUT"] == 2
+
+
+def test_s3_download_missing_object(s3_stub, config_data):
+    download(config_data=config_data)
+    assert s3_stub.requests == {"GET 404": 1}
+    assert not os.path.exists(config_data["local_operators_latest_iib_filepath"])
+
+
+def get_iib_data(iib, new_iib=True):
+    return {"v4.15": {"job-1": {"operators": {"operator-1": {"iib": iib, "new-iib": new_iib}}, "ci": "jenkins"}}}
+
+
+@pytest.fixture()
+def replicas_config_data(tmp_path, s3_stub):
+    # Two replicas sharing the s3 file, both read it at the start of the cycle
+    s3_stub.objects[f"/{S3_PATH}"] = {"body": json.dumps(get_iib_data(iib="iib:1")).encode(), "etag": '"etag-0"'}
+    replicas_config_data = []
+    for replica in ("a", "b"):
+        replica_dir = tmp_path / replica
+        replica_dir.mkdir()
+        _config_data = {
+            "s3_bucket_operators_latest_iib_path": S3_PATH,
+            "aws_region": "us-east-1",
+            "local_operators_latest_iib_filepath": str(replica_dir / "operators_latest_iib.json"),
+        }
+        download(config_data=_config_data)
+        replicas_config_data.append(_config_data)
+
+    return replicas_config_data
+
+
+def test_s3_upload_conflict_same_iib_not_triggered_twice(s3_stub, replicas_config_data):
+    replica_a, replica_b = replicas_config_data
+    assert write_new_data_to_file_and_upload_to_s3(
+        config_data=replica_a, new_data=get_iib_data(iib="iib:2"), logger=LOGGER
+    ) == get_iib_data(iib="iib:2")
+
+    # Replica b found the same index image, replica a already recorded it
+    stored_data = write_new_data_to_file_and_upload_to_s3(
+        config_data=replica_b, new_data=get_iib_data(iib="iib:2"), logger=LOGGER
+    )
+    assert stored_data == get_iib_data(iib="iib:2", new_iib=False)
+    assert s3_stub.requests["PUT 412"] == 1
+    assert json.loads(s3_stub.objects[f"/{S3_PATH}"]["body"]) == stored_data
+    assert get_iib_data_from_file(config_data=replica_b) == stored_data
+
+
+def test_s3_upload_conflict_newer_iib(s3_stub, replicas_config_data):
+    replica_a, replica_b = replicas_config_data
+    write_new_data_to_file_and_upload_to_s3(config_data=replica_a, new_data=get_iib_data(iib="iib:2"), logger=LOGGER)
+
+    # Replica b found a newer index image than the one recorded by replica a
+    stored_data = write_new_data_to_file_and_upload_to_s3(
+        config_data=replica_b, new_data=get_iib_data(iib="iib:3"), logger=LOGGER
+    )
+    assert stored_data == get_iib_data(iib="iib:3")
+    assert json.loads(s3_stub.objects[f"/{S3_PATH}"]["body"]) == stored_data
+
+
+def test_s3_upload_new_object_conflict(s3_stub, config_data):
+    # The object was created by another replica after this one found it missing
+    download(config_data=config_data)
+    s3_stub.objects[f"/{S3_PATH}"] = {"body": json.dumps(get_iib_data(iib="iib:2")).encode(), "etag": '"etag-0"'}
+
+    stored_data = write_new_data_to_file_and_upload_to_s3(
+        config_data=config_data, new_data=get_iib_data(iib="iib:2"), logger=LOGGER
+    )
+    assert stored_data == get_iib_data(iib="iib:2", new_iib=False)
+    assert s3_stub.requests["PUT 412"] == 1
+
+
+def test_s3_upload_conflict_retries_exhausted(mocker, s3_stub, replicas_config_data):
+    _, replica_b = replicas_config_data
+    conflicts = []
+
+    def _merge_iib_data_and_conflict(new_data, remote_data):
+        # Another replica writes between every download and upload
+        conflicts.append(new_data)
+        s3_stub.objects[f"/{S3_PATH}"]["etag"] = f'"etag-conflict-{len(conflicts)}"'
+        return merge_iib_data(new_data=new_data, remote_data=remote_data)
+
+    mocker.patch(f"{IIB_TRIGGER_MODULE_PATH}.merge_iib_data", side_effect=_merge_iib_data_and_conflict)
+    s3_stub.objects[f"/{S3_PATH}"]["etag"] = '"etag-conflict-0"'
+
+    assert (
+        write_new_data_to_file_and_upload_to_s3(
+            config_data=replica_b, new_data=get_iib_data(iib="iib:2"), logger=LOGGER
+        )
+        is None
+    )
+    assert s3_stub.requests["PUT 412"] == 4
+    assert not s3_stub.requests["PUT"]
+    assert not get_s3_state(filename=replica_b["local_operators_latest_iib_filepath"])
+
+
+def test_s3_upload_failure_not_trusted_next_cycle(s3_stub, config_data):
+    s3_stub.objects[f"/{S3_PATH}"] = {"body": json.dumps(get_iib_data(iib="iib:1")).encode(), "etag": '"etag-1"'}
+    download(config_data=config_data)
+    s3_stub.fail_puts = True
+
+    # The new index image was not claimed in s3, nothing is triggered and the pre-cycle local file is put back
+    assert (
+        write_new_data_to_file_and_upload_to_s3(
+            config_data=config_data, new_data=get_iib_data(iib="iib:2"), logger=LOGGER
+        )
+        is None
+    )
+    assert s3_stub.requests["PUT 403"] == 1
+    assert get_iib_data_from_file(config_data=config_data) == get_iib_data(iib="iib:1")
+    assert not get_s3_state(filename=config_data["local_operators_latest_iib_filepath"])
+
+    # The next cycle gets the whole object instead of a 304 for the unsynced local copy
+    assert download(config_data=config_data)
+    assert s3_stub.requests["GET 200"] == 2
+    assert not s3_stub.requests["GET 304"]
+
+
+def test_s3_upload_invalid_params_raised(mocker, s3_stub, config_data):
+    s3_stub.objects[f"/{S3_PATH}"] = {"body": json.dumps(get_iib_data(iib="iib:1")).encode(), "etag": '"etag-1"'}
+    download(config_data=config_data)
+    mocker.patch(
+        "botocore.client.BaseClient._make_api_call",
+        side_effect=ParamValidationError(report='Unknown parameter in input: "IfMatch"'),
+    )
+
+    # Not reported as a failed upload of this cycle, and the pre-cycle local file is put back
+    with pytest.raises(ParamValidationError):
+        write_new_data_to_file_and_upload_to_s3(
+            config_data=config_data, new_data=get_iib_data(iib="iib:2"), logger=LOGGER
+        )
+
+    assert get_iib_data_from_file(config_data=config_data) == get_iib_data(iib="iib:1")
+    assert not get_s3_state(filename=config_data["local_operators_latest_iib_filepath"])
+
+
+def test_get_new_iib_s3_upload_failure_no_trigger(mocker, s3_stub, config_data):
+    mocker.patch.object(HttpClient, "get", return_value=MockRequestGet())
+    s3_stub.fail_puts = True
+    config_data["ci_jobs"] = {
+        "v4.15": [{"name": "openshift-ci-job-name", "ci": "openshift-ci", "products": {"product": "operator"}}]
+    }
+    assert get_new_iib(config_data=config_data, logger=LOGGER) is None
+    assert not os.path.exists(config_data["local_operators_latest_iib_filepath"])
+
+
+def test_merge_iib_data_keeps_other_replica_jobs():
+    remote_data = get_iib_data(iib="iib:1")
+    remote_data["v4.16"] = {"job-2": {"operators": {"operator-2": {"iib": "iib:5", "new-iib": True}}, "ci": "jenkins"}}
+
+    merged_data = merge_iib_data(new_data=get_iib_data(iib="iib:2"), remote_data=remote_data)
+    assert merged_data["v4.15"] == get_iib_data(iib="iib:2")["v4.15"]
+    assert merged_data["v4.16"] == remote_data["v4.16"]
+
+
+def test_get_new_iib_two_replicas_trigger_once(mocker, s3_stub, replicas_config_data):
+    mocker.patch.object(HttpClient, "get", return_value=MockRequestGet())
+    new_iibs = []
+    for _config_data in replicas_config_data:
+        _config_data["ci_jobs"] = {
+            "v4.15": [{"name": "openshift-ci-job-name", "ci": "openshift-ci", "products": {"product": "operator"}}]
+        }
+        new_data = get_new_iib(config_data=_config_data, logger=LOGGER)
+        new_iibs.append(new_data["v4.15"]["openshift-ci-job-name"]["operators"]["operator"]["new-iib"])
+
+    assert new_iibs == [True, False]
@@ -0,0 +1,55 @@
+import datetime
+import threading
+
+import pytest
+from simple_logger.logger import get_logger
+
+from ci_jobs_trigger.utils.scheduler import Scheduler, get_scheduler
+
+LOGGER = get_logger("test_scheduler")
+LOG_PREFIX = "scheduler-test:"
+
+
+@pytest.fixture
+def send_slack_message_mock(mocker):
+    return mocker.patch("ci_jobs_trigger.utils.scheduler.send_slack_message", return_value=None)
+
+
+def test_get_scheduler_default_interval():
+    scheduler = get_scheduler(config={}, logger=LOGGER, log_prefix=LOG_PREFIX)
+    assert scheduler.run_interval == 24 * 60 * 60
+    assert not scheduler.cron
+
+
+def test_get_scheduler_cron():
+    scheduler = get_scheduler(config={"cron_schedule": "0 0 * * *"}, logger=LOGGER, log_prefix=LOG_PREFIX)
+    next_run = scheduler.next_run()
+    assert (next_run.hour, next_run.minute) == (0, 0)
+    assert next_run > datetime.datetime.now()
+
+
+def test_get_scheduler_invalid_cron(send_slack_message_mock):
+    assert not get_scheduler(config={"cron_schedule": "invalid cron"}, logger=LOGGER, log_prefix=LOG_PREFIX)
+    send_slack_message_mock.assert_called_once()
+
+
+def test_scheduler_jitter():
+    scheduler = get_scheduler(
+        config={"run_interval": "1h", "run_interval_jitter": "10m"}, logger=LOGGER, log_prefix=LOG_PREFIX
+    )
+    seconds_to_next_run = (scheduler.next_run() - datetime.datetime.now()).total_seconds()
+    assert 3590 <= seconds_to_next_run <= 4200
+
+
+def test_scheduler_wait_interval():
+    scheduler = Scheduler(logger=LOGGER, log_prefix=LOG_PREFIX, run_interval=0)
+    assert not scheduler.wait(), "Scheduled run should not be reported as on demand"
+
+
+def test_scheduler_run_now():
+    scheduler = Scheduler(logger=LOGGER, log_prefix=LOG_PREFIX, run_interval=3600)
+    scheduled_run = scheduler.next_run()
+    threading.Timer(0.05, scheduler.run_now_event.set).start()
+    assert scheduler.wait(), "Scheduler should be woken up on demand"
+    assert scheduler.next_run() == scheduled_run, "On demand run should not move the scheduled run"
+    assert not scheduler.run_now_event.is_set()
@@ -0,0 +1,291 @@
+import json
+import multiprocessing
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+from simple_logger.logger import get_logger
+
+from ci_jobs_trigger.tests.utils import StubHandler
+from ci_jobs_trigger.utils.general import send_slack_message
+from ci_jobs_trigger.utils.http_client import get_http_client
+from ci_jobs_trigger.utils.slack_notifier import (
+    SLACK_MAX_MESSAGE_LENGTH,
+    SlackNotifier,
+    flush_slack_messages_on_sigterm,
+    get_slack_notifier,
+    slack_digest,
+    split_slack_message,
+)
+from ci_jobs_trigger.utils.trigger_dispatcher import TriggerDispatcher
+
+LOGGER = get_logger("test_slack_notifier")
+FORK_CTX = multiprocessing.get_context("fork")
+
+
+class SlackStubHandler(StubHandler):
+    # Records the posted texts; answers 429 (with `retry_after`) to the first `rate_limited` posts and delays each
+    # response by `latency`. While `blocked` is cleared, requests wait for it.
+    def do_POST(self):  # noqa N802
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.received.set()
+        self.server.blocked.wait()
+        time.sleep(self.server.latency)
+        if self.server.rate_limited:
+            self.server.rate_limited -= 1
+            return self._send(status=429, headers={"Retry-After": self.server.retry_after})
+
+        self.server.posts.append((time.monotonic(), body["text"]))
+        return self._send(status=200, body=b"ok")
+
+
+def start_slack_stub(start_stub_server):
+    blocked = threading.Event()
+    blocked.set()
+    return start_stub_server(
+        handler_class=SlackStubHandler,
+        posts=[],
+        rate_limited=0,
+        retry_after="0.1",
+        latency=0,
+        blocked=blocked,
+        received=threading.Event(),
+    )
+
+
+@pytest.fixture()
+def slack_stub(start_stub_server):
+    server = start_slack_stub(start_stub_server=start_stub_server)
+    yield server
+    server.blocked.set()
+
+
+@pytest.fixture()
+def webhook_url(slack_stub):
+    return f"{slack_stub.url}/services/webhook"
+
+
+def posted_texts(slack_stub):
+    return [text for _, text in slack_stub.posts]
+
+
+def notify_and_wait_for_sigterm(webhook_url, queued):
+    send_slack_message(message="message 1", webhook_url=webhook_url, logger=LOGGER)
+    send_slack_message(message="message 2", webhook_url=webhook_url, logger=LOGGER)
+    queued.set()
+    time.sleep(60)
+
+
+def test_send_slack_message_does_not_block(slack_stub, webhook_url):
+    slack_stub.latency = 0.3
+    start_time = time.monotonic()
+    send_slack_message(message="message", webhook_url=webhook_url, logger=LOGGER)
+    assert time.monotonic() - start_time < 0.1
+    assert get_slack_notifier().flush(timeout=5)
+    assert posted_texts(slack_stub=slack_stub) == ["message"]
+
+
+def test_slack_notifier_coalesces_queued_messages(slack_stub, webhook_url):
+    notifier = SlackNotifier(rate=20, burst=1)
+    notifier.notify(message="message 0", webhook_url=webhook_url, logger=LOGGER)
+    assert slack_stub.received.wait(timeout=5)
+    for idx in range(1, 10):
+        assert notifier.notify(message=f"message {idx}", webhook_url=webhook_url, logger=LOGGER)
+
+    assert notifier.flush(timeout=5)
+    # The first message is sent right away, the rest are queued while waiting for the next token
+    assert posted_texts(slack_stub=slack_stub) == ["message 0", "\n\n".join(f"message {idx}" for idx in range(1, 10))]
+    assert notifier.stats()[webhook_url]["sent"] == 10
+
+
+def test_slack_notifier_rate(slack_stub, webhook_url):
+    # Messages too long to be coalesced are posted one per token
+    notifier = SlackNotifier(rate=20, burst=1)
+    messages = [str(idx) * 3000 for idx in range(5)]
+    for message in messages:
+        notifier.notify(message=message, webhook_url=webhook_url, logger=LOGGER)
+
+    assert notifier.flush(timeout=5)
+    assert posted_texts(slack_stub=slack_stub) == messages
+    posted_at = [posted_at for posted_at, _ in slack_stub.posts]
+    assert posted_at[-1] - posted_at[0] >= 4 * 0.05 * 0.9
+
+
+def test_slack_notifier_retry_after(slack_stub, webhook_url):
+    slack_stub.rate_limited = 2
+    notifier = SlackNotifier(rate=0)
+    start_time = time.monotonic()
+    notifier.notify(message="message", webhook_url=webhook_url, logger=LOGGER)
+    assert notifier.flush(timeout=5)
+    assert time.monotonic() - start_time >= 0.2
+    assert posted_texts(slack_stub=slack_stub) == ["message"]
+    assert notifier.stats()[webhook_url] == {
+        "queued": 1,
+        "posts": 3,
+        "sent": 1,
+        "dropped": 0,
+        "rate_limited": 2,
+        "failed": 0,
+    }
+
+
+def test_slack_notifier_shared_http_client(slack_stub, webhook_url):
+    # Posts go through the process HTTP client, with the other outgoing requests
+    requests_count = get_http_client().stats().get(webhook_url.split("/")[2], {}).get("requests", 0)
+    notifier = SlackNotifier(rate=0)
+    notifier.notify(message="message", webhook_url=webhook_url, logger=LOGGER)
+    assert notifier.flush(timeout=5)
+    assert get_http_client().stats()[webhook_url.split("/")[2]]["requests"] == requests_count + 1
+
+
+def test_slack_notifier_retry_after_exhausted(slack_stub, webhook_url):
+    slack_stub.rate_limited = 10
+    slack_stub.retry_after = "0"
+    notifier = SlackNotifier(rate=0, max_retries=2)
+    notifier.notify(message="message", webhook_url=webhook_url, logger=LOGGER)
+    assert notifier.flush(timeout=5)
+    assert not slack_stub.posts
+    assert notifier.stats()[webhook_url]["failed"] == 1
+
+
+def test_slack_notifier_bounded_queue(slack_stub, webhook_url):
+    slack_stub.blocked.clear()
+    notifier = SlackNotifier(queue_size=2, rate=0)
+    assert notifier.notify(message="message 0", webhook_url=webhook_url, logger=LOGGER)
+    # The first message is in flight, two more fit in the queue
+    assert slack_stub.received.wait(timeout=5)
+    assert notifier.notify(message="message 1", webhook_url=webhook_url, logger=LOGGER)
+    assert notifier.notify(message="message 2", webhook_url=webhook_url, logger=LOGGER)
+    assert not notifier.notify(message="message 3", webhook_url=webhook_url, logger=LOGGER)
+    assert not notifier.flush(timeout=0.1)
+
+    slack_stub.blocked.set()
+    assert notifier.flush(timeout=5)
+    assert posted_texts(slack_stub=slack_stub) == ["message 0", "message 1\n\nmessage 2"]
+    assert notifier.stats()[webhook_url]["dropped"] == 1
+
+
+def test_slack_notifier_per_webhook_senders(start_stub_server, slack_stub, webhook_url):
+    # A blocked webhook does not delay the others
+    notifier = SlackNotifier(rate=0)
+    other_server = start_slack_stub(start_stub_server=start_stub_server)
+    other_server.blocked.clear()
+    try:
+        notifier.notify(message="blocked", webhook_url=f"{other_server.url}/", logger=LOGGER)
+        notifier.notify(message="message", webhook_url=webhook_url, logger=LOGGER)
+        assert not notifier.flush(timeout=0.5)
+        assert posted_texts(slack_stub=slack_stub) == ["message"]
+
+    finally:
+        other_server.blocked.set()
+
+
+def test_slack_messages_flushed_on_sigterm(slack_stub, webhook_url):
+    slack_stub.latency = 0.05
+    # Senders started in this process are not inherited by the child
+    send_slack_message(message="parent message", webhook_url=webhook_url, logger=LOGGER)
+    queued = FORK_CTX.Event()
+    process = FORK_CTX.Process(
+        target=notify_and_wait_for_sigterm, kwargs={"webhook_url": webhook_url, "queued": queued}
+    )
+    signal_handler = signal.getsignal(signal.SIGTERM)
+    flush_slack_messages_on_sigterm()
+    try:
+        process.start()
+    finally:
+        signal.signal(signal.SIGTERM, signal_handler)
+
+    assert queued.wait(timeout=10)
+    os.kill(process.pid, signal.SIGTERM)
+    process.join(timeout=10)
+    assert process.exitcode == -signal.SIGTERM
+    assert get_slack_notifier().flush(timeout=5)
+    posted_messages = [message for text in posted_texts(slack_stub=slack_stub) for message in text.split("\n\n")]
+    assert sorted(posted_messages) == ["message 1", "message 2", "parent message"]
+
+
+def test_slack_messages_flushed_on_exit(slack_stub, webhook_url):
+    slack_stub.latency = 0.05
+    subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "from simple_logger.logger import get_logger\n"
+            "from ci_jobs_trigger.utils.general import send_slack_message\n"
+            "for idx in range(3):\n"
+            f"    send_slack_message(message=str(idx) * 3000, webhook_url='{webhook_url}', logger=get_logger('test'))\n",
+        ],
+        check=True,
+        timeout=30,
+    )
+    assert posted_texts(slack_stub=slack_stub) == [str(idx) * 3000 for idx in range(3)]
+
+
+@pytest.mark.parametrize(
+    "messages, chunks_count",
+    [
+        (["message"] * 3, 1),
+        ([str(idx) * 1500 for idx in range(5)], 3),
+        (["line\n" * 2000, "x" * 9000, "message"], 6),
+    ],
+    ids=["short", "long", "longer-than-limit"],
+)
+def test_split_slack_message(messages, chunks_count):
+    chunks = split_slack_message(messages=messages, max_length=4000)
+    assert len(chunks) == chunks_count
+    assert all(len(chunk) <= 4000 for chunk in chunks)
+    assert "".join(chunks).replace("\n\n", "") == "".join(messages).replace("\n\n", "")
+
+
+def test_slack_digest(slack_stub, webhook_url):
+    errors_webhook_url = f"{webhook_url}-errors"
+    with slack_digest(title="unit of work", logger=LOGGER):
+        send_slack_message(message="message 0", webhook_url=webhook_url, logger=LOGGER)
+        # Messages sent from the dispatcher threads are collected too
+        with TriggerDispatcher() as dispatcher:
+            for idx in range(1, 4):
+                dispatcher.submit(
+                    backend="jenkins",
+                    func=send_slack_message,
+                    message=f"message {idx}",
+                    webhook_url=webhook_url,
+                    logger=LOGGER,
+                )
+
+        send_slack_message(message="error", webhook_url=errors_webhook_url, logger=LOGGER)
+        assert not get_slack_notifier().stats().get(webhook_url)
+
+    assert get_slack_notifier().flush(timeout=5)
+    # One message per webhook
+    error_digest, digest = sorted(posted_texts(slack_stub=slack_stub), key=lambda post: "error" not in post)
+    assert error_digest == "unit of work: 1 notifications\n\nerror"
+    assert digest.startswith("unit of work: 4 notifications\n\n")
+    assert sorted(digest.split("\n\n")[1:]) == [f"message {idx}" for idx in range(4)]
+
+
+def test_slack_digest_chunks(slack_stub, webhook_url):
+    messages = [str(idx % 10) * 500 for idx in range(30)]
+    with slack_digest(title="unit of work", logger=LOGGER):
+        for message in messages:
+            send_slack_message(message=message, webhook_url=webhook_url, logger=LOGGER)
+
+    assert get_slack_notifier().flush(timeout=5)
+    posts = posted_texts(slack_stub=slack_stub)
+    assert len(posts) == 5
+    assert all(len(post) <= SLACK_MAX_MESSAGE_LENGTH for post in posts)
+    assert [post.split("\n\n")[0] for post in posts] == [
+        f"unit of work: 30 notifications ({idx}/5)" for idx in range(1, 6)
+    ]
+    assert [message for post in posts for message in post.split("\n\n")[1:]] == messages
+
+
+def test_slack_digest_disabled(slack_stub, webhook_url):
+    notifier = get_slack_notifier()
+    with slack_digest(title="unit of work", logger=LOGGER, enabled=False):
+        send_slack_message(message="message", webhook_url=webhook_url, logger=LOGGER)
+        assert notifier.flush(timeout=5)
+        assert posted_texts(slack_stub=slack_stub) == ["message"]
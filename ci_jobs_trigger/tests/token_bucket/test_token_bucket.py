@@ -0,0 +1,13 @@
+import time
+
+from ci_jobs_trigger.utils.token_bucket import TokenBucket
+
+
+def test_token_bucket_rate():
+    bucket = TokenBucket(rate=100, burst=5)
+    start_time = time.monotonic()
+    waits = [bucket.acquire() for _ in range(25)]
+    # The burst is free, the next 20 tokens take 0.2 seconds
+    assert not any(waits[:5])
+    assert 0.15 < time.monotonic() - start_time < 1
+    assert TokenBucket(rate=0, burst=1).acquire() == 0
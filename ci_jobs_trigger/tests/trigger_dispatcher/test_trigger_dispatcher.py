@@ -0,0 +1,228 @@
+import threading
+import time
+from collections import Counter
+
+import pytest
+from simple_logger.logger import get_logger
+
+from ci_jobs_trigger.libs.operators_iib_trigger.iib_trigger import LOG_PREFIX, fetch_update_iib_and_trigger_jobs
+from ci_jobs_trigger.utils.general import send_slack_message
+from ci_jobs_trigger.utils.slack_notifier import SlackNotifier
+from ci_jobs_trigger.utils.trigger_dispatcher import TriggerDispatcher
+
+LOGGER = get_logger("test_trigger_dispatcher")
+IIB_TRIGGER_MODULE_PATH = "ci_jobs_trigger.libs.operators_iib_trigger.iib_trigger"
+LIBS_UTILS_MODULE_PATH = "ci_jobs_trigger.libs.utils.general"
+BACKEND_LATENCY = 0.05
+
+
+class StubBackends:
+    # Jenkins and openshift-ci triggers which take BACKEND_LATENCY seconds; records the max concurrent triggers
+    def __init__(self, failed_jobs=(), broken_jobs=(), queued_jobs=()):
+        self.failed_jobs = set(failed_jobs)
+        self.broken_jobs = set(broken_jobs)
+        self.queued_jobs = set(queued_jobs)
+        self.triggered = Counter()
+        self.running = Counter()
+        self.max_running = Counter()
+        self._lock = threading.Lock()
+
+    def trigger(self, backend, job):
+        if job in self.broken_jobs:
+            raise RuntimeError(f"{backend} is down")
+
+        with self._lock:
+            self.running[backend] += 1
+            self.max_running[backend] = max(self.max_running[backend], self.running[backend])
+
+        time.sleep(BACKEND_LATENCY)
+        with self._lock:
+            self.running[backend] -= 1
+            self.triggered[backend] += 1
+
+        return job not in self.failed_jobs
+
+    def jenkins_trigger_job(self, job, config_data, logger, operator_iib=False):
+        if self.trigger(backend="jenkins", job=job):
+            if job in self.queued_jobs:
+                return True, {"url": "http://jenkins/queue/item/1/", "queue_id": 1, "queued": True}
+
+            return True, {"url": f"http://jenkins/job/{job}/1/"}
+
+        return False, None
+
+    def openshift_ci_trigger_job(self, job_name, trigger_token):
+        return MockOpenshiftCIResponse(ok=self.trigger(backend="openshift-ci", job=job_name))
+
+
+class MockOpenshiftCIResponse:
+    def __init__(self, ok):
+        self.ok = ok
+        self.text = "error"
+        self.headers = {"grpc-message": "error"}
+
+    @staticmethod
+    def json():
+        return {"id": "1"}
+
+
+def get_trigger_dict(jobs_count):
+    # Half of the jobs on each backend
+    trigger_dict = {"v4.15": {}}
+    for idx in range(jobs_count):
+        ci = "jenkins" if idx % 2 else "openshift-ci"
+        trigger_dict["v4.15"][f"{ci}-job-{idx}"] = {
+            "ci": ci,
+            "operators": {f"operator-{idx}": {"iib": f"iib:{idx}", "new-iib": True, "triggered": True}},
+        }
+
+    return trigger_dict
+
+
+@pytest.fixture()
+def stub_backends(mocker):
+    stub_backends = StubBackends(failed_jobs=("jenkins-job-1", "openshift-ci-job-2"))
+    mocker.patch(f"{LIBS_UTILS_MODULE_PATH}.jenkins_trigger_job", side_effect=stub_backends.jenkins_trigger_job)
+    mocker.patch(
+        f"{LIBS_UTILS_MODULE_PATH}.openshift_ci_trigger_job", side_effect=stub_backends.openshift_ci_trigger_job
+    )
+    mocker.patch(f"{LIBS_UTILS_MODULE_PATH}.send_slack_message")
+    return stub_backends
+
+
+@pytest.fixture()
+def run_iib_cycle(mocker, tmp_path):
+    # Runs fetch_update_iib_and_trigger_jobs with `jobs_count` jobs having a new IIB
+    def _run_iib_cycle(jobs_count, trigger_limits=None, **config):
+        trigger_dict = get_trigger_dict(jobs_count=jobs_count)
+        config_data = {
+            "trigger_token": "token",
+            "local_operators_latest_iib_filepath": str(tmp_path / "iib.json"),
+            "ci_jobs": {"v4.15": [{"name": job, "ci": data["ci"]} for job, data in trigger_dict["v4.15"].items()]},
+            "trigger_limits": trigger_limits,
+            **config,
+        }
+        mocker.patch(f"{IIB_TRIGGER_MODULE_PATH}.get_config", return_value=config_data)
+        mocker.patch(f"{IIB_TRIGGER_MODULE_PATH}.get_new_iib", return_value=trigger_dict)
+        cycle_results = {}
+        start_time = time.monotonic()
+        fetch_update_iib_and_trigger_jobs(logger=LOGGER, tmp_dir=str(tmp_path), cycle_results=cycle_results)
+        return cycle_results, time.monotonic() - start_time
+
+    return _run_iib_cycle
+
+
+def test_trigger_dispatcher_limits():
+    running = Counter()
+    max_running = Counter()
+    lock = threading.Lock()
+
+    def _trigger(name):
+        with lock:
+            running[name] += 1
+            max_running[name] = max(max_running[name], running[name])
+
+        time.sleep(0.02)
+        with lock:
+            running[name] -= 1
+
+        return name
+
+    limits = {"jenkins": {"max_parallel": 2, "rate": 0}, "openshift-ci": {"max_parallel": 6, "rate": 0}}
+    with TriggerDispatcher(limits=limits) as dispatcher:
+        futures = [
+            dispatcher.submit(backend=backend, func=_trigger, name=backend)
+            for backend in ("jenkins", "openshift-ci", "other")
+            for _ in range(12)
+        ]
+
+    assert [future.result() for future in futures][::12] == ["jenkins", "openshift-ci", "other"]
+    assert max_running == {"jenkins": 2, "openshift-ci": 6, "other": 1}
+    # Configured limits override the defaults, the rest of the defaults are kept
+    assert dispatcher.limits["jenkins"] == {"max_parallel": 2, "rate": 0, "burst": 4}
+
+
+def test_trigger_dispatcher_rate_limit():
+    with TriggerDispatcher(limits={"jenkins": {"max_parallel": 10, "rate": 50, "burst": 1}}) as dispatcher:
+        futures = [dispatcher.submit(backend="jenkins", func=time.monotonic) for _ in range(10)]
+
+    started_at = sorted(future.result() for future in futures)
+    # 10 triggers at 50 per second span at least 9 * 20ms
+    assert started_at[-1] - started_at[0] >= 0.15
+    assert dispatcher.rate_limit_waits["jenkins"] > 0
+
+
+def test_fetch_update_iib_and_trigger_jobs_failed_jobs(stub_backends, run_iib_cycle):
+    cycle_results, _ = run_iib_cycle(jobs_count=8)
+    assert cycle_results["failed_triggered_jobs"] == {
+        "jenkins": ["jenkins-job-1"],
+        "openshift-ci": ["openshift-ci-job-2"],
+    }
+    assert cycle_results["triggered_jobs"] == {
+        "openshift-ci": ["openshift-ci-job-0", "openshift-ci-job-4", "openshift-ci-job-6"],
+        "jenkins": ["jenkins-job-3", "jenkins-job-5", "jenkins-job-7"],
+    }
+
+
+def test_fetch_update_iib_and_trigger_jobs_trigger_error(stub_backends, run_iib_cycle):
+    stub_backends.broken_jobs = {"jenkins-job-3"}
+    cycle_results, _ = run_iib_cycle(jobs_count=8)
+
+    # The other triggers are still collected
+    assert cycle_results["failed_triggered_jobs"] == {
+        "jenkins": ["jenkins-job-1", "jenkins-job-3"],
+        "openshift-ci": ["openshift-ci-job-2"],
+    }
+    assert cycle_results["triggered_jobs"] == {
+        "openshift-ci": ["openshift-ci-job-0", "openshift-ci-job-4", "openshift-ci-job-6"],
+        "jenkins": ["jenkins-job-5", "jenkins-job-7"],
+    }
+    assert cycle_results["trigger_errors"] == {"jenkins-job-3": "jenkins is down"}
+
+
+def test_fetch_update_iib_and_trigger_jobs_queued_jobs(stub_backends, run_iib_cycle):
+    # Jenkins builds still queued when the start wait ended are not reported as triggered
+    stub_backends.queued_jobs = {"jenkins-job-5"}
+    cycle_results, _ = run_iib_cycle(jobs_count=8)
+    assert cycle_results["queued_jobs"] == {"jenkins": ["jenkins-job-5"]}
+    assert cycle_results["triggered_jobs"]["jenkins"] == ["jenkins-job-3", "jenkins-job-7"]
+
+
+@pytest.mark.parametrize(
+    "trigger_limits, max_running",
+    [
+        (
+            {
+                "jenkins": {"max_parallel": 8, "rate": 200, "burst": 8},
+                "openshift-ci": {"max_parallel": 16, "rate": 400, "burst": 16},
+            },
+            {"jenkins": 8, "openshift-ci": 16},
+        ),
+        (
+            {"jenkins": {"max_parallel": 1, "rate": 0}, "openshift-ci": {"max_parallel": 1, "rate": 0}},
+            {"jenkins": 1, "openshift-ci": 1},
+        ),
+    ],
+    ids=["parallel", "serial"],
+)
+def test_fetch_update_iib_and_trigger_jobs_max_parallel(stub_backends, run_iib_cycle, trigger_limits, max_running):
+    # Every trigger takes 50ms, the stub backends record how many triggers run at once
+    cycle_results, _ = run_iib_cycle(jobs_count=32, trigger_limits=trigger_limits)
+    assert {backend: len(jobs) for backend, jobs in cycle_results["triggered_jobs"].items()} == {
+        "openshift-ci": 15,
+        "jenkins": 15,
+    }
+    assert stub_backends.triggered == {"jenkins": 16, "openshift-ci": 16}
+    assert stub_backends.max_running == max_running
+
+
+def test_fetch_update_iib_and_trigger_jobs_slack_digest(mocker, stub_backends, run_iib_cycle):
+    mocker.patch(f"{LIBS_UTILS_MODULE_PATH}.send_slack_message", side_effect=send_slack_message)
+    notify_mock = mocker.patch.object(SlackNotifier, "notify")
+    run_iib_cycle(jobs_count=8, slack_digest=True, slack_webhook_url="webhook", slack_errors_webhook_url="errors")
+
+    # One message per webhook instead of one per triggered or failed job
+    messages = {_call.kwargs["webhook_url"]: _call.kwargs["message"] for _call in notify_mock.call_args_list}
+    assert notify_mock.call_count == 2
+    assert messages["webhook"].startswith(f"{LOG_PREFIX} New operators IIB: 6 notifications")
+    assert messages["errors"].startswith(f"{LOG_PREFIX} New operators IIB: 2 notifications")
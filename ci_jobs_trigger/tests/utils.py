@@ -1,3 +1,6 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
 class MockJenkinsJob:
     @staticmethod
     def get_parameters():
@@ -34,3 +37,32 @@ class MockRequestPost:
     @staticmethod
     def json():
         return {"id": 123456}
+
+
+class StubServer(ThreadingHTTPServer):
+    # Local HTTP server for the tests, the suites set their state as attributes (see `start_stub_server` fixture)
+    request_queue_size = 64
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _send(self, status, body=b"", headers=None):
+        self.send_response(status)
+        for header, value in (headers or {}).items():
+            self.send_header(header, value)
+
+        # A 304 response has no body
+        if status != 304:
+            self.send_header("Content-Length", str(len(body)))
+
+        self.end_headers()
+        if status != 304:
+            self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
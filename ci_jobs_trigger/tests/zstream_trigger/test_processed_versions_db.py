@@ -0,0 +1,199 @@
+import json
+import multiprocessing
+import sqlite3
+
+import pytest
+from simple_logger.logger import get_logger
+
+from ci_jobs_trigger.libs.openshift_ci.zstream_trigger.processed_versions_db import (
+    ProcessedVersionsDB,
+    get_processed_versions_db_path,
+    get_version_sort_key,
+)
+
+LOGGER = get_logger("test_processed_versions_db")
+
+
+@pytest.fixture()
+def db_path(tmp_path):
+    return str(tmp_path / "processed_versions.db")
+
+
+@pytest.fixture()
+def processed_versions_json_file(tmp_path):
+    json_file_path = tmp_path / "processed_versions.json"
+    json_file_path.write_text(
+        json.dumps({
+            "4.13": ["4.13.34", "4.13.9", "4.13.10"],
+            "4.14-rc": ["4.14.0-rc.2"],
+            "jobs_ledger": {
+                "4.15": {"version": "4.15.1", "jobs": {"job-1": {"status": "pending", "attempts": 1}}},
+            },
+        })
+    )
+    return str(json_file_path)
+
+
+def add_versions(db_path, base_version, versions):
+    with ProcessedVersionsDB(db_path=db_path, logger=LOGGER) as processed_versions_db:
+        for version in versions:
+            processed_versions_db.add_processed_version(base_version=base_version, version=version)
+
+
+def test_version_sort_key():
+    versions = ["4.13.10", "4.14.0", "4.13.9", "4.14.0-rc.10", "4.14.0-rc.2", "4.14.0-ec.1", "4.13.0"]
+    assert sorted(versions, key=get_version_sort_key) == [
+        "4.13.0",
+        "4.13.9",
+        "4.13.10",
+        "4.14.0-ec.1",
+        "4.14.0-rc.2",
+        "4.14.0-rc.10",
+        "4.14.0",
+    ]
+
+
+def test_get_processed_versions_db_path():
+    assert get_processed_versions_db_path(config={"processed_versions_file_path": "/data/versions.json"}) == (
+        "/data/versions.db"
+    )
+    assert get_processed_versions_db_path(
+        config={"processed_versions_file_path": "/data/versions.json", "processed_versions_db_path": "/db/z.db"}
+    ) == ("/db/z.db")
+
+
+def test_processed_versions(db_path):
+    add_versions(db_path=db_path, base_version="4.13", versions=["4.13.9", "4.13.10", "4.13.9"])
+
+    with ProcessedVersionsDB(db_path=db_path, logger=LOGGER) as processed_versions_db:
+        assert processed_versions_db.get_processed_versions(base_version="4.13") == ["4.13.10", "4.13.9"]
+        assert processed_versions_db.get_latest_processed_version(base_version="4.13") == "4.13.10"
+        assert processed_versions_db.get_latest_processed_version(base_version="4.14") is None
+        assert processed_versions_db.is_processed(base_version="4.13", version="4.13.2")
+        assert processed_versions_db.is_processed(base_version="4.13", version="4.13.10")
+        assert not processed_versions_db.is_processed(base_version="4.13", version="4.13.11")
+        assert not processed_versions_db.is_processed(base_version="4.14", version="4.14.0")
+
+
+def test_latest_processed_version_uses_index(db_path):
+    with ProcessedVersionsDB(db_path=db_path, logger=LOGGER) as processed_versions_db:
+        query_plan = processed_versions_db.connection.execute(
+            "EXPLAIN QUERY PLAN SELECT version FROM processed_versions WHERE base_version = ? "
+            "ORDER BY sort_key DESC LIMIT 1",
+            ("4.13",),
+        ).fetchall()
+
+    assert "processed_versions_sort_key" in str(query_plan)
+    assert "TEMP B-TREE" not in str(query_plan)
+
+
+def test_closed_db(db_path):
+    processed_versions_db = ProcessedVersionsDB(db_path=db_path, logger=LOGGER)
+    with processed_versions_db:
+        processed_versions_db.add_processed_version(base_version="4.13", version="4.13.1")
+
+    with pytest.raises(sqlite3.ProgrammingError, match="not open"):
+        processed_versions_db.get_latest_processed_version(base_version="4.13")
+
+
+def test_jobs_ledger(db_path):
+    with ProcessedVersionsDB(db_path=db_path, logger=LOGGER) as processed_versions_db:
+        processed_versions_db.update_jobs_ledger(
+            base_version="4.13",
+            version="4.13.9",
+            jobs_ledger={"job-1": {"status": "pending", "attempts": 1, "next_retry_at": 10.0}},
+        )
+        assert processed_versions_db.get_jobs_ledger(base_version="4.13", version="4.13.9") == {
+            "job-1": {"status": "pending", "attempts": 1, "execution_id": None, "next_retry_at": 10.0}
+        }
+
+        # A newer version replaces the ledger of the previous one
+        processed_versions_db.update_jobs_ledger(
+            base_version="4.13",
+            version="4.13.10",
+            jobs_ledger={"job-1": {"status": "succeeded", "attempts": 1, "execution_id": "id-1"}},
+        )
+        assert not processed_versions_db.get_jobs_ledger(base_version="4.13", version="4.13.9")
+        assert processed_versions_db.get_jobs_ledger(base_version="4.13", version="4.13.10")["job-1"]["status"] == (
+            "succeeded"
+        )
+
+
+def test_claim_jobs(db_path):
+    with ProcessedVersionsDB(db_path=db_path, logger=LOGGER) as processed_versions_db:
+        processed_versions_db.update_jobs_ledger(
+            base_version="4.13",
+            version="4.13.9",
+            jobs_ledger={
+                "job-1": {"status": "succeeded", "attempts": 1},
+                "job-2": {"status": "pending", "attempts": 2},
+            },
+        )
+        claim_kwargs = {"base_version": "4.13", "version": "4.13.9", "jobs": ["job-1", "job-2", "job-3"]}
+        assert processed_versions_db.claim_jobs(**claim_kwargs, claim_timeout=3600) == {"job-2": 2, "job-3": 0}
+        assert processed_versions_db.get_jobs_ledger(base_version="4.13", version="4.13.9")["job-3"]["status"] == (
+            "triggering"
+        )
+        # Claimed jobs are not claimed again until their claim expires
+        assert not processed_versions_db.claim_jobs(**claim_kwargs, claim_timeout=3600)
+
+        processed_versions_db.update_jobs_ledger(
+            base_version="4.13", version="4.13.9", jobs_ledger={"job-3": {"status": "triggering", "next_retry_at": 0}}
+        )
+        assert processed_versions_db.claim_jobs(**claim_kwargs, claim_timeout=3600) == {"job-3": 0}
+
+
+def test_import_json_file(db_path, processed_versions_json_file):
+    with ProcessedVersionsDB(
+        db_path=db_path, logger=LOGGER, json_file_path=processed_versions_json_file
+    ) as processed_versions_db:
+        assert processed_versions_db.get_latest_processed_version(base_version="4.13") == "4.13.34"
+        assert processed_versions_db.get_processed_versions(base_version="4.14-rc") == ["4.14.0-rc.2"]
+        assert processed_versions_db.get_jobs_ledger(base_version="4.15", version="4.15.1")["job-1"]["attempts"] == 1
+
+        # The file is imported only once, later changes to it are ignored
+        with open(processed_versions_json_file, "w") as fd:
+            json.dump({"4.13": ["4.13.35"]}, fd)
+
+        assert not processed_versions_db.import_json_file(json_file_path=processed_versions_json_file)
+
+    with ProcessedVersionsDB(
+        db_path=db_path, logger=LOGGER, json_file_path=processed_versions_json_file
+    ) as processed_versions_db:
+        assert processed_versions_db.get_latest_processed_version(base_version="4.13") == "4.13.34"
+
+
+def test_import_missing_json_file(db_path, tmp_path):
+    with ProcessedVersionsDB(
+        db_path=db_path, logger=LOGGER, json_file_path=str(tmp_path / "missing.json")
+    ) as processed_versions_db:
+        assert processed_versions_db.get_latest_processed_version(base_version="4.13") is None
+
+
+def test_concurrent_writers(db_path):
+    # The scheduled run and the http route run in different processes
+    with ProcessedVersionsDB(db_path=db_path, logger=LOGGER):
+        pass
+
+    ctx = multiprocessing.get_context("fork")
+    processes = [
+        ctx.Process(
+            target=add_versions,
+            kwargs={
+                "db_path": db_path,
+                "base_version": "4.13",
+                "versions": [f"4.13.{idx}" for idx in range(writer, 200, 4)],
+            },
+        )
+        for writer in range(4)
+    ]
+    for process in processes:
+        process.start()
+
+    for process in processes:
+        process.join(timeout=60)
+        assert process.exitcode == 0
+
+    with ProcessedVersionsDB(db_path=db_path, logger=LOGGER) as processed_versions_db:
+        assert len(processed_versions_db.get_processed_versions(base_version="4.13")) == 200
+        assert processed_versions_db.get_latest_processed_version(base_version="4.13") == "4.13.199"
@@ -1,11 +1,19 @@
+import multiprocessing
 import os
+import threading
+import time
 
 import pytest
 from simple_logger.logger import get_logger
 
 from ci_jobs_trigger.libs.openshift_ci.zstream_trigger.zstream_trigger import (
+    ACCEPTED_CLUSTER_VERSIONS_CACHE,
     OPENSHIFT_CI_ZSTREAM_TRIGGER_CONFIG_OS_ENV_STR,
+    get_zstream_trigger_metrics,
     process_and_trigger_jobs,
+    get_processed_versions_db,
+    get_retry_backoff,
+    trigger_jobs,
 )
 from ci_jobs_trigger.tests.zstream_trigger.manifests.versions import VERSIONS
 
@@ -25,8 +33,34 @@ def job_trigger_and_get_versions_mocker(mocker):
         GET_ACCEPTED_CLUSTER_VERSIONS_PATH,
         return_value=VERSIONS,
     )
-    openshift_ci_trigger_job_mocker = mocker.patch(TRIGGER_JOBS_PATH)
-    openshift_ci_trigger_job_mocker.ok = True
+    return mocker.patch(TRIGGER_JOBS_PATH, side_effect=trigger_job_response)
+
+
+def trigger_job_response(job_name, trigger_token):
+    return MockTriggerResponse(job_name=job_name)
+
+
+class MockTriggerResponse:
+    def __init__(self, job_name, ok=True):
+        self.job_name = job_name
+        self.ok = ok
+        self.status_code = 200 if ok else 500
+        self.text = "" if ok else "error"
+
+    def json(self):
+        return {"id": f"id-{self.job_name}"}
+
+
+def triggered_jobs_res(status, jobs):
+    return {"status": status, "jobs": {job: {"ok": True, "execution_id": f"id-{job}"} for job in jobs}}
+
+
+def drop_latency(trigger_res):
+    for version_res in trigger_res.values():
+        for job_res in version_res["jobs"].values():
+            assert job_res.pop("latency") >= 0
+
+    return trigger_res
 
 
 @pytest.fixture
@@ -35,12 +69,12 @@ def send_slack_message_mock(mocker):
 
 
 @pytest.fixture()
-def base_config_dict(tmp_path_factory):
+def base_config_dict(tmp_path):
     return {
         "trigger_token": "123456",
         "slack_webhook_url": "https://webhook",
         "slack_errors_webhook_url": "https://webhook-error",
-        "processed_versions_file_path": tmp_path_factory.getbasetemp() / "processed_versions.json",
+        "processed_versions_file_path": str(tmp_path / "processed_versions.json"),
     }
 
 
@@ -86,35 +120,255 @@ def test_process_and_trigger_jobs_config_with_empty_version(config_dict_empty_ve
 
 
 def test_process_and_trigger_jobs(config_dict, job_trigger_and_get_versions_mocker):
-    assert process_and_trigger_jobs(logger=LOGGER) == {"4.13": "Triggered", "4.13-rc": "Triggered"}
+    assert drop_latency(trigger_res=process_and_trigger_jobs(logger=LOGGER)) == {
+        "4.13": triggered_jobs_res(status="Triggered", jobs=["<openshift-ci-test-name-4.13>"]),
+        "4.13-rc": triggered_jobs_res(status="Triggered", jobs=["<openshift-ci-test-name-4.13-rc>"]),
+    }
 
 
-def test_process_and_trigger_jobs_already_triggered(mocker, config_dict, job_trigger_and_get_versions_mocker):
-    mocker.patch(
-        f"{LIBS_ZSTREAM_TRIGGER_PATH}.processed_versions_file",
-        return_value={"4.13": ["4.13.34", "4.13.33"]},
-    )
+def test_process_and_trigger_jobs_already_triggered(base_config_dict, config_dict, job_trigger_and_get_versions_mocker):
+    with get_processed_versions_db(config=base_config_dict, logger=LOGGER) as processed_versions_db:
+        processed_versions_db.add_processed_version(base_version="4.13", version="4.13.34")
 
-    assert process_and_trigger_jobs(logger=LOGGER) == {"4.13": "Already processed", "4.13-rc": "Triggered"}
+    trigger_res = process_and_trigger_jobs(logger=LOGGER)
+    assert trigger_res.pop("4.13") == "Already processed"
+    assert drop_latency(trigger_res=trigger_res) == {
+        "4.13-rc": triggered_jobs_res(status="Triggered", jobs=["<openshift-ci-test-name-4.13-rc>"]),
+    }
 
 
 def test_process_and_trigger_jobs_set_version(config_dict, job_trigger_and_get_versions_mocker):
-    assert process_and_trigger_jobs(version="4.13", logger=LOGGER) == {"4.13": True}
+    trigger_res = process_and_trigger_jobs(version="4.13", logger=LOGGER)
+    assert trigger_res["4.13"]["triggered"]
+    assert (
+        trigger_res["4.13"]["jobs"]["<openshift-ci-test-name-4.13>"]["execution_id"]
+        == "id-<openshift-ci-test-name-4.13>"
+    )
+
+
+def test_process_and_trigger_jobs_pass_version(base_config_dict, config_dict, job_trigger_and_get_versions_mocker):
+    with get_processed_versions_db(config=base_config_dict, logger=LOGGER) as processed_versions_db:
+        processed_versions_db.add_processed_version(base_version="4.13", version="4.13.34")
+
+    assert process_and_trigger_jobs(logger=LOGGER, version="4.13")["4.13"]["triggered"]
 
 
-def test_process_and_trigger_jobs_pass_version(mocker, config_dict, job_trigger_and_get_versions_mocker):
+def test_process_and_trigger_jobs_pass_version_not_in_config(config_dict, job_trigger_and_get_versions_mocker):
+    with pytest.raises(ValueError):
+        process_and_trigger_jobs(logger=LOGGER, version="4.14")
+
+
+def test_process_and_trigger_jobs_accepted_versions_fetched_once(
+    mocker, config_dict, job_trigger_and_get_versions_mocker
+):
+    get_accepted_cluster_versions_mock = mocker.patch(GET_ACCEPTED_CLUSTER_VERSIONS_PATH, return_value=VERSIONS)
+
+    process_and_trigger_jobs(logger=LOGGER)
+    process_and_trigger_jobs(logger=LOGGER)
+    assert get_accepted_cluster_versions_mock.call_count == 1
+    accepted_versions_stats = get_zstream_trigger_metrics(logger=LOGGER)["accepted_versions_cache"]
+    assert accepted_versions_stats["hits"] == 1
+    assert accepted_versions_stats["misses"] == 1
+    assert accepted_versions_stats["age"] is not None
+
+
+def test_accepted_versions_cache_shared_between_processes(mocker, base_config_dict):
+    # The scheduled runs and the route run in separate processes
+    get_accepted_cluster_versions_mock = mocker.patch(GET_ACCEPTED_CLUSTER_VERSIONS_PATH, return_value=VERSIONS)
+    process = multiprocessing.get_context("fork").Process(
+        target=ACCEPTED_CLUSTER_VERSIONS_CACHE.get, kwargs={"config": base_config_dict, "logger": LOGGER, "ttl": 300}
+    )
+    process.start()
+    process.join(timeout=30)
+    assert process.exitcode == 0
+
+    assert ACCEPTED_CLUSTER_VERSIONS_CACHE.get(config=base_config_dict, logger=LOGGER, ttl=300) == VERSIONS
+    get_accepted_cluster_versions_mock.assert_not_called()
+    assert ACCEPTED_CLUSTER_VERSIONS_CACHE.stats(config=base_config_dict, logger=LOGGER)["misses"] == 1
+
+
+def test_process_and_trigger_jobs_channel_not_accepted(
+    mocker, config_dict, job_trigger_and_get_versions_mocker, send_slack_message_mock
+):
+    mocker.patch(GET_ACCEPTED_CLUSTER_VERSIONS_PATH, return_value={"stable": VERSIONS["stable"]})
+    trigger_res = process_and_trigger_jobs(logger=LOGGER)
+    assert trigger_res["4.13-rc"] == "No accepted version found"
+    assert trigger_res["4.13"]["status"] == "Triggered"
+    assert any(
+        "No accepted version found for 4.13:rc" in call.kwargs["message"]
+        and call.kwargs["webhook_url"] == "https://webhook-error"
+        for call in send_slack_message_mock.call_args_list
+    )
+
+
+def test_process_and_trigger_jobs_no_accepted_versions(mocker, config_dict, job_trigger_and_get_versions_mocker):
+    mocker.patch(GET_ACCEPTED_CLUSTER_VERSIONS_PATH, return_value=None)
+    assert process_and_trigger_jobs(logger=LOGGER) == {
+        "4.13": "No accepted version found",
+        "4.13-rc": "No accepted version found",
+    }
+    job_trigger_and_get_versions_mocker.assert_not_called()
+
+
+def test_trigger_jobs_success_and_failure_split(mocker, base_config_dict, send_slack_message_mock):
     mocker.patch(
-        f"{LIBS_ZSTREAM_TRIGGER_PATH}.processed_versions_file",
-        return_value={"4.13": ["4.13.33", "4.13.32"]},
+        TRIGGER_JOBS_PATH,
+        side_effect=lambda job_name, trigger_token: MockTriggerResponse(job_name=job_name, ok=job_name != "job-2"),
     )
 
-    assert process_and_trigger_jobs(logger=LOGGER, version="4.13") == {"4.13": True}
+    trigger_res = trigger_jobs(
+        config=base_config_dict, jobs=["job-1", "job-2"], logger=LOGGER, zstream_version="4.13.1"
+    )
+    assert trigger_res["triggered"]
+    assert trigger_res["jobs"]["job-1"]["ok"]
+    assert trigger_res["jobs"]["job-1"]["execution_id"] == "id-job-1"
+    assert not trigger_res["jobs"]["job-2"]["ok"]
+    assert trigger_res["jobs"]["job-2"]["error"] == "500: error"
+    success_message, failure_message = [_call.kwargs for _call in send_slack_message_mock.call_args_list]
+    assert "['job-1']" in success_message["message"]
+    assert success_message["webhook_url"] == base_config_dict["slack_webhook_url"]
+    assert "['job-2']" in failure_message["message"]
+    assert failure_message["webhook_url"] == base_config_dict["slack_errors_webhook_url"]
+
+
+def test_trigger_jobs_request_exception(mocker, base_config_dict):
+    mocker.patch(TRIGGER_JOBS_PATH, side_effect=ConnectionError("connection refused"))
+
+    trigger_res = trigger_jobs(config=base_config_dict, jobs=["job-1"], logger=LOGGER, zstream_version="4.13.1")
+    assert not trigger_res["triggered"]
+    assert trigger_res["jobs"]["job-1"]["error"] == "connection refused"
 
 
-def test_process_and_trigger_jobs_pass_version_not_in_config(mocker, config_dict, job_trigger_and_get_versions_mocker):
+@pytest.mark.parametrize("max_parallel_triggers", [1, 10])
+def test_trigger_jobs_parallel(mocker, base_config_dict, max_parallel_triggers):
+    # Each trigger takes 20ms, with `max_parallel_triggers` the jobs of a version are triggered concurrently and
+    # never more than `max_parallel_triggers` at once.
+    jobs = [f"job-{idx}" for idx in range(20)]
+    lock = threading.Lock()
+    in_flight = {"current": 0, "max": 0}
+
+    def _trigger(job_name, trigger_token):
+        with lock:
+            in_flight["current"] += 1
+            in_flight["max"] = max(in_flight["max"], in_flight["current"])
+
+        time.sleep(0.02)
+        with lock:
+            in_flight["current"] -= 1
+
+        return MockTriggerResponse(job_name=job_name)
+
+    trigger_mock = mocker.patch(TRIGGER_JOBS_PATH, side_effect=_trigger)
+    base_config_dict["max_parallel_triggers"] = max_parallel_triggers
+    trigger_res = trigger_jobs(config=base_config_dict, jobs=jobs, logger=LOGGER, zstream_version="4.13.1")
+
+    assert trigger_res["triggered"]
+    assert list(trigger_res["jobs"]) == jobs
+    assert trigger_mock.call_count == len(jobs)
+    assert in_flight["max"] == max_parallel_triggers
+
+
+@pytest.fixture()
+def retry_config_dict(config_dict, get_config_mocker):
+    get_config_mocker.return_value["versions"] = {"4.13": ["job-1", "job-2"]}
+    return get_config_mocker.return_value
+
+
+def get_jobs_ledger(config):
+    with get_processed_versions_db(config=config, logger=LOGGER) as processed_versions_db:
+        return processed_versions_db.get_jobs_ledger(base_version="4.13", version="4.13.34")
+
+
+def expire_retry_backoff(config):
+    jobs_ledger = get_jobs_ledger(config=config)
+    for job_ledger in jobs_ledger.values():
+        job_ledger.pop("next_retry_at", None)
+
+    with get_processed_versions_db(config=config, logger=LOGGER) as processed_versions_db:
+        processed_versions_db.update_jobs_ledger(base_version="4.13", version="4.13.34", jobs_ledger=jobs_ledger)
+
+
+def test_process_and_trigger_jobs_retry_failed_jobs(mocker, retry_config_dict):
+    mocker.patch(GET_ACCEPTED_CLUSTER_VERSIONS_PATH, return_value=VERSIONS)
+    failing_jobs = {"job-2"}
+    trigger_job_mock = mocker.patch(
+        TRIGGER_JOBS_PATH,
+        side_effect=lambda job_name, trigger_token: MockTriggerResponse(
+            job_name=job_name, ok=job_name not in failing_jobs
+        ),
+    )
+    retry_config_dict["trigger_retry_backoff"] = "1h"
+
+    # job-1 succeeded, job-2 waits for its retry and the version is not marked as processed
+    assert process_and_trigger_jobs(logger=LOGGER)["4.13"]["status"] == "Partially triggered"
+    jobs_ledger = get_jobs_ledger(config=retry_config_dict)
+    assert jobs_ledger["job-1"]["status"] == "succeeded"
+    assert jobs_ledger["job-2"]["status"] == "pending"
+    assert jobs_ledger["job-2"]["next_retry_at"] > time.time() + 3000
+
+    trigger_job_mock.reset_mock()
+    assert process_and_trigger_jobs(logger=LOGGER)["4.13"]["status"] == "Pending retry"
+    assert not trigger_job_mock.called
+
+    # Once the backoff is over only job-2 is triggered again
+    expire_retry_backoff(config=retry_config_dict)
+    retry_config_dict["trigger_retry_backoff"] = "0s"
+    process_and_trigger_jobs(logger=LOGGER)
+    failing_jobs.clear()
+    trigger_job_mock.reset_mock()
+    trigger_res = process_and_trigger_jobs(logger=LOGGER)
+    assert trigger_res["4.13"]["status"] == "Triggered"
+    assert [_call.kwargs["job_name"] for _call in trigger_job_mock.call_args_list] == ["job-2"]
+    assert get_jobs_ledger(config=retry_config_dict)["job-2"]["attempts"] == 3
+
+    trigger_job_mock.reset_mock()
+    assert process_and_trigger_jobs(logger=LOGGER)["4.13"] == "Already processed"
+    assert not trigger_job_mock.called
+
+
+def test_process_and_trigger_jobs_concurrent_runs(mocker, retry_config_dict):
+    # The scheduled run and the route process the same version at the same time, each job is triggered once
+    mocker.patch(GET_ACCEPTED_CLUSTER_VERSIONS_PATH, return_value=VERSIONS)
+    barrier = threading.Barrier(parties=2, timeout=5)
+
+    def _trigger(job_name, trigger_token):
+        time.sleep(0.1)
+        return MockTriggerResponse(job_name=job_name)
+
+    trigger_job_mock = mocker.patch(TRIGGER_JOBS_PATH, side_effect=_trigger)
+    results = []
+
+    def _run():
+        barrier.wait()
+        results.append(process_and_trigger_jobs(logger=LOGGER)["4.13"])
+
+    threads = [threading.Thread(target=_run) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    assert sorted(_call.kwargs["job_name"] for _call in trigger_job_mock.call_args_list) == ["job-1", "job-2"]
+    assert "Triggered" in [_result["status"] for _result in results if isinstance(_result, dict)]
+    assert get_jobs_ledger(config=retry_config_dict)["job-1"]["attempts"] == 1
+
+
+def test_process_and_trigger_jobs_all_jobs_failed(mocker, retry_config_dict):
+    mocker.patch(GET_ACCEPTED_CLUSTER_VERSIONS_PATH, return_value=VERSIONS)
     mocker.patch(
-        f"{LIBS_ZSTREAM_TRIGGER_PATH}.processed_versions_file",
-        return_value={"4.13": ["4.13.33", "4.13.32"]},
+        TRIGGER_JOBS_PATH,
+        side_effect=lambda job_name, trigger_token: MockTriggerResponse(job_name=job_name, ok=False),
     )
-    with pytest.raises(ValueError):
-        process_and_trigger_jobs(logger=LOGGER, version="4.14")
+
+    assert process_and_trigger_jobs(logger=LOGGER)["4.13"]["status"] == "Failed"
+
+
+def test_get_retry_backoff():
+    assert [get_retry_backoff(attempts=attempts, backoff=60, max_backoff=300) for attempts in range(1, 6)] == [
+        60,
+        120,
+        240,
+        300,
+        300,
+    ]
@@ -0,0 +1,51 @@
+import contextlib
+import fcntl
+import os
+import tempfile
+
+DEFAULT_FILE_MODE = 0o644
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    # Exclusive advisory lock on `<path>.lock`, the state file itself is replaced on every write and cannot be locked
+    with open(f"{path}.lock", "a") as lock_fd:
+        fcntl.flock(lock_fd, fcntl.LOCK_EX)
+        try:
+            yield
+
+        finally:
+            fcntl.flock(lock_fd, fcntl.LOCK_UN)
+
+
+def atomic_write(path, data, lock=False):
+    # Readers see either the previous or the new content, never a partially written file, also if the writer is killed.
+    # The data is written to a temporary file in the same directory, flushed to disk and renamed over `path`.
+    with file_lock(path=path) if lock else contextlib.nullcontext():
+        dir_name, file_name = os.path.split(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=dir_name, prefix=f".{file_name}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb" if isinstance(data, bytes) else "w") as tmp_fd:
+                tmp_fd.write(data)
+                tmp_fd.flush()
+                os.fsync(tmp_fd.fileno())
+
+            try:
+                os.chmod(tmp_path, os.stat(path).st_mode & 0o777)
+            except FileNotFoundError:
+                os.chmod(tmp_path, DEFAULT_FILE_MODE)
+
+            os.replace(tmp_path, path)
+
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(tmp_path)
+
+            raise
+
+        # Persist the rename
+        dir_fd = os.open(dir_name, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
@@ -1 +0,0 @@
-DAYS_TO_SECONDS = 60 * 60 * 24
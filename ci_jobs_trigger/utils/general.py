@@ -1,10 +1,15 @@
-import json
+import copy
 import os
+import re
+import threading
 from multiprocessing import Process
 
-import requests
 from pyaml_env import parse_config
 
+from ci_jobs_trigger.utils.slack_notifier import get_slack_digest, get_slack_notifier
+
+ENV_VAR_PATTERN = re.compile(r"\$\{([^}{:]+)")
+
 
 class AddonsWebhookTriggerError(Exception):
     def __init__(self, msg):
@@ -23,36 +28,83 @@ class OpenshiftCiReTriggerError(Exception):
         return f"{self.log_prefix} Openshift CI job re-trigger failed: {self.msg}"
 
 
+class S3WriteConflictError(Exception):
+    def __init__(self, msg):
+        self.msg = msg
+
+    def __str__(self):
+        return f"S3 conditional write failed: {self.msg}"
+
+
+class ConfigCache:
+    # Parsed configs by path; a config is parsed again only when the file (mtime, inode, size) or the value of an
+    # environment variable it references changes.
+    def __init__(self):
+        self.reloads = {}
+        self._configs = {}
+        self._lock = threading.Lock()
+
+    def get(self, path, logger):
+        file_stat = os.stat(path)
+        file_key = (file_stat.st_mtime_ns, file_stat.st_ino, file_stat.st_size)
+        with self._lock:
+            cached = self._configs.get(path)
+
+        if not cached or cached["file_key"] != file_key or cached["env"] != self._env_values(names=cached["env"]):
+            with open(path) as fd:
+                config_data = fd.read()
+
+            cached = {
+                "file_key": file_key,
+                "env": self._env_values(names=set(ENV_VAR_PATTERN.findall(config_data))),
+                "config": parse_config(data=config_data, default_value=""),
+            }
+            with self._lock:
+                self._configs[path] = cached
+                self.reloads[path] = self.reloads.get(path, 0) + 1
+                reloads = self.reloads[path]
+
+            logger.info(f"Loaded config from {path}, reloads: {reloads}")
+
+        # Callers update the config they get
+        return copy.deepcopy(cached["config"])
+
+    @staticmethod
+    def _env_values(names):
+        return {name: os.environ.get(name) for name in names}
+
+
+CONFIG_CACHE = ConfigCache()
+
+
 def get_config(os_environ, logger):
     try:
-        return parse_config(path=os.environ.get(os_environ), default_value="")
+        return CONFIG_CACHE.get(path=os.environ.get(os_environ), logger=logger)
     except Exception as ex:
         logger.error(f"Failed to get config from {os_environ}. error: {ex}")
         return {}
 
 
 def send_slack_message(message, webhook_url, logger):
+    # Queued and sent in the background (see SlackNotifier), or collected by the active slack digest
     try:
         if webhook_url:
-            slack_data = {"text": message}
-            logger.info(f"Sending message to slack: {message}")
-            response = requests.post(
-                webhook_url,
-                data=json.dumps(slack_data),
-                headers={"Content-Type": "application/json"},
-            )
-            if response.status_code != 200:
-                logger.error(
-                    f"Request to slack returned an error {response.status_code} with the following message: {response.text}"
-                )
+            if digest := get_slack_digest():
+                digest.add(message=message, webhook_url=webhook_url)
+            else:
+                get_slack_notifier().notify(message=message, webhook_url=webhook_url, logger=logger)
     except Exception as ex:
         logger.error(f"Failed to send slack message. error: {ex}")
 
 
 def run_in_process(targets):
+    processes = {}
     for target, _kwargs in targets.items():
         proc = Process(target=target, kwargs=_kwargs)
         proc.start()
+        processes[target] = proc
+
+    return processes
 
 
 def process_webhook_exception(logger, ex, route, slack_errors_webhook_url=None):
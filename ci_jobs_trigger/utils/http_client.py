@@ -0,0 +1,130 @@
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+HTTP_POOL_MAXSIZE_OS_ENV_STR = "CI_JOBS_TRIGGER_HTTP_POOL_MAXSIZE"
+HTTP_TIMEOUT_OS_ENV_STR = "CI_JOBS_TRIGGER_HTTP_TIMEOUT"
+HTTP_RETRIES_OS_ENV_STR = "CI_JOBS_TRIGGER_HTTP_RETRIES"
+HTTP_BACKOFF_FACTOR_OS_ENV_STR = "CI_JOBS_TRIGGER_HTTP_BACKOFF_FACTOR"
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+TOO_MANY_REQUESTS_STATUS = 429
+
+_HTTP_CLIENT = None
+_HTTP_CLIENT_PID = None
+_HTTP_CLIENT_LOCK = threading.Lock()
+
+
+class _Retry(Retry):
+    # Non-idempotent requests (triggering a job, posting to slack) are retried only when the server rejected them
+    # with 429, retrying them on 5xx may run them twice.
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if status_code == TOO_MANY_REQUESTS_STATUS and self.status_forcelist and status_code in self.status_forcelist:
+            return True
+
+        return super().is_retry(method=method, status_code=status_code, has_retry_after=has_retry_after)
+
+
+class HttpClient:
+    def __init__(self, pool_maxsize=None, timeout=None, retries=None, backoff_factor=None):
+        self.pool_maxsize = pool_maxsize or int(os.environ.get(HTTP_POOL_MAXSIZE_OS_ENV_STR, 10))
+        self.timeout = timeout or float(os.environ.get(HTTP_TIMEOUT_OS_ENV_STR, 30))
+        self.retries = retries if retries is not None else int(os.environ.get(HTTP_RETRIES_OS_ENV_STR, 3))
+        self.backoff_factor = (
+            backoff_factor if backoff_factor is not None else float(os.environ.get(HTTP_BACKOFF_FACTOR_OS_ENV_STR, 0.5))
+        )
+        self._sessions = {}
+        self._latencies = {}
+        self._lock = threading.Lock()
+
+    def session(self, url, retries=None):
+        # One session (and connections pool) per host; `retries` overrides the client retries, e.g. for callers which
+        # handle 429 themselves
+        retries = self.retries if retries is None else retries
+        host = urlparse(url).netloc
+        with self._lock:
+            if (host, retries) not in self._sessions:
+                adapter = HTTPAdapter(
+                    pool_connections=1,
+                    pool_maxsize=self.pool_maxsize,
+                    max_retries=_Retry(
+                        total=retries,
+                        backoff_factor=self.backoff_factor,
+                        status_forcelist=RETRY_STATUSES,
+                        raise_on_status=False,
+                    ),
+                )
+                session = requests.Session()
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self._sessions[(host, retries)] = session
+
+            return self._sessions[(host, retries)]
+
+    def request(self, method, url, retries=None, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        start_time = time.monotonic()
+        try:
+            return self.session(url=url, retries=retries).request(method=method, url=url, **kwargs)
+
+        finally:
+            self._record_latency(host=urlparse(url).netloc, latency=time.monotonic() - start_time)
+
+    def get(self, url, **kwargs):
+        return self.request(method="GET", url=url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request(method="POST", url=url, **kwargs)
+
+    def stats(self):
+        with self._lock:
+            sessions = dict(self._sessions)
+            latencies = {host: dict(latency) for host, latency in self._latencies.items()}
+
+        connections = {}
+        for (host, _), session in sessions.items():
+            new_connections, requests_count = connections.get(host, (0, 0))
+            for adapter in set(session.adapters.values()):
+                pools = adapter.poolmanager.pools
+                for pool_key in pools.keys():
+                    pool = pools[pool_key]
+                    new_connections += pool.num_connections
+                    requests_count += pool.num_requests
+
+            connections[host] = (new_connections, requests_count)
+
+        stats = {}
+        for host, (new_connections, requests_count) in connections.items():
+            host_latency = latencies.get(host, {"count": 0, "total": 0.0, "max": 0.0})
+            stats[host] = {
+                "requests": requests_count,
+                "new_connections": new_connections,
+                "reused_connections": max(requests_count - new_connections, 0),
+                "average_latency": host_latency["total"] / host_latency["count"] if host_latency["count"] else 0.0,
+                "max_latency": host_latency["max"],
+            }
+
+        return stats
+
+    def _record_latency(self, host, latency):
+        with self._lock:
+            host_latency = self._latencies.setdefault(host, {"count": 0, "total": 0.0, "max": 0.0})
+            host_latency["count"] += 1
+            host_latency["total"] += latency
+            host_latency["max"] = max(host_latency["max"], latency)
+
+
+def get_http_client():
+    # One client per process, connections inherited from the parent process are not shared
+    global _HTTP_CLIENT, _HTTP_CLIENT_PID
+
+    with _HTTP_CLIENT_LOCK:
+        if not _HTTP_CLIENT or _HTTP_CLIENT_PID != os.getpid():
+            _HTTP_CLIENT = HttpClient()
+            _HTTP_CLIENT_PID = os.getpid()
+
+        return _HTTP_CLIENT
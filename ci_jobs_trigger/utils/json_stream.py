@@ -0,0 +1,94 @@
+import codecs
+import json
+
+WHITESPACE = " \t\n\r"
+
+
+class _JsonStreamReader:
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._decoder = json.JSONDecoder()
+        self._utf8_decoder = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self):
+        if self._eof:
+            return False
+
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self._eof = True
+            chunk = self._utf8_decoder.decode(b"", final=True)
+
+        elif isinstance(chunk, bytes):
+            chunk = self._utf8_decoder.decode(chunk)
+
+        self._buffer = self._buffer[self._pos :] + chunk
+        self._pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in WHITESPACE:
+                self._pos += 1
+
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+
+            if not self._fill():
+                raise json.JSONDecodeError("Unexpected end of data", self._buffer, self._pos)
+
+    def consume(self, expected=None):
+        char = self.peek()
+        if expected and char not in expected:
+            raise json.JSONDecodeError(f"Expected one of {expected!r}", self._buffer, self._pos)
+
+        self._pos += 1
+        return char
+
+    def decode_value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+                # A number at the end of the buffer may continue in the next chunk
+                if end < len(self._buffer) or self._eof:
+                    self._pos = end
+                    return value
+
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+
+            self._fill()
+
+
+def iter_json_array_items(chunks, array_key, metadata):
+    # Yields the items of `array_key` in a top-level JSON object one at a time, without loading the whole document.
+    # Other top-level keys are stored in `metadata`, keys after the array are set only once the iteration is done.
+    reader = _JsonStreamReader(chunks=chunks)
+    reader.consume(expected="{")
+    if reader.peek() == "}":
+        return
+
+    while True:
+        key = reader.decode_value()
+        reader.consume(expected=":")
+        if key == array_key:
+            reader.consume(expected="[")
+            if reader.peek() == "]":
+                reader.consume()
+
+            else:
+                while True:
+                    yield reader.decode_value()
+                    if reader.consume(expected=",]") == "]":
+                        break
+
+        else:
+            metadata[key] = reader.decode_value()
+
+        if reader.consume(expected=",}") == "}":
+            return
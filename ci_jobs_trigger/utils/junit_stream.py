@@ -0,0 +1,37 @@
+from xml.etree import ElementTree
+
+JUNIT_SUITE_TAGS = ("testsuites", "testsuite")
+
+
+def _xmltodict_attributes(element):
+    return {f"@{key}": value for key, value in element.attrib.items()}
+
+
+def iter_junit_testcases(chunks):
+    # Yields the testcases of a junit xml while it is parsed, so the consumer can stop once it found what it needs.
+    # Testcases have the `xmltodict` keys for their attributes and failure ({"@name": ..., "failure": {"#text": ...}}).
+    # Elements are dropped once parsed, memory is bounded by one testcase and not by the file size.
+    parser = ElementTree.XMLPullParser(events=("start", "end"))
+    parents = []
+    for chunk in chunks:
+        parser.feed(chunk)
+        for event, element in parser.read_events():
+            if event == "start":
+                parents.append(element)
+                continue
+
+            parents.pop()
+            if element.tag == "testcase":
+                testcase = _xmltodict_attributes(element=element)
+                if (failure := element.find("failure")) is not None:
+                    testcase["failure"] = _xmltodict_attributes(element=failure)
+                    if failure_text := (failure.text or "").strip():
+                        testcase["failure"]["#text"] = failure_text
+
+                yield testcase
+
+            if parents and parents[-1].tag in JUNIT_SUITE_TAGS:
+                # The element is the last child of its suite, all the previous ones were already dropped
+                del parents[-1][:]
+
+    parser.close()
@@ -0,0 +1,89 @@
+from __future__ import annotations
+import datetime
+import logging
+import multiprocessing
+import random
+from typing import Any, Dict
+
+from croniter import CroniterBadCronError, croniter
+from pyhelper_utils.general import stt, tts
+
+from ci_jobs_trigger.utils.general import send_slack_message
+
+
+class Scheduler:
+    def __init__(
+        self,
+        logger: logging.Logger,
+        log_prefix: str,
+        cron: croniter | None = None,
+        run_interval: int = 0,
+        run_interval_jitter: int = 0,
+        run_now_event: Any = None,
+    ) -> None:
+        self.logger = logger
+        self.log_prefix = log_prefix
+        self.cron = cron
+        self.run_interval = run_interval
+        self.run_interval_jitter = run_interval_jitter
+        self.run_now_event = run_now_event or multiprocessing.Event()
+        self._next_run: datetime.datetime | None = None
+
+    def next_run(self) -> datetime.datetime:
+        next_run = self._next_run
+        if next_run is None:
+            if self.cron:
+                next_run = self.cron.get_next(datetime.datetime)
+            else:
+                jitter = random.uniform(0, self.run_interval_jitter) if self.run_interval_jitter else 0
+                next_run = datetime.datetime.now() + datetime.timedelta(seconds=self.run_interval + jitter)
+
+            self._next_run = next_run
+
+        return next_run
+
+    def wait(self) -> bool:
+        # Returns True when woken up by `run_now_event`; the scheduled run is kept and will still happen on time
+        seconds = max(int((self.next_run() - datetime.datetime.now()).total_seconds()), 0)
+        if seconds > 0:
+            self.logger.info(f"{self.log_prefix} Sleeping for {stt(seconds=seconds)}...")
+
+        if self.run_now_event.wait(timeout=seconds):
+            self.run_now_event.clear()
+            self.logger.info(f"{self.log_prefix} Run requested on demand")
+            return True
+
+        self._next_run = None
+        return False
+
+
+def get_cron_iter(cron_schedule: str, config: Dict, logger: logging.Logger, log_prefix: str) -> croniter | None:
+    try:
+        return croniter(cron_schedule, start_time=datetime.datetime.now(), day_or=False)
+    except CroniterBadCronError:
+        err_msg: str = f"Invalid cron schedule: {cron_schedule}"
+        logger.error(f"{log_prefix} {err_msg}")
+        send_slack_message(
+            message=err_msg,
+            webhook_url=config.get("slack_errors_webhook_url"),
+            logger=logger,
+        )
+
+        return None
+
+
+def get_scheduler(config: Dict, logger: logging.Logger, log_prefix: str, run_now_event: Any = None) -> Scheduler | None:
+    cron = None
+    if cron_schedule := config.get("cron_schedule"):
+        cron = get_cron_iter(cron_schedule=cron_schedule, config=config, logger=logger, log_prefix=log_prefix)
+        if not cron:
+            return None
+
+    return Scheduler(
+        logger=logger,
+        log_prefix=log_prefix,
+        cron=cron,
+        run_interval=tts(ts=config.get("run_interval", "24h")),
+        run_interval_jitter=tts(ts=config.get("run_interval_jitter", 0)),
+        run_now_event=run_now_event,
+    )
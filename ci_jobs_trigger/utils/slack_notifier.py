@@ -0,0 +1,291 @@
+import atexit
+import contextlib
+import contextvars
+import json
+import os
+import queue
+import signal
+import threading
+import time
+
+from ci_jobs_trigger.utils.http_client import get_http_client
+from ci_jobs_trigger.utils.token_bucket import TokenBucket
+
+SLACK_QUEUE_SIZE_OS_ENV_STR = "CI_JOBS_TRIGGER_SLACK_QUEUE_SIZE"
+SLACK_RATE_OS_ENV_STR = "CI_JOBS_TRIGGER_SLACK_RATE"
+SLACK_BURST_OS_ENV_STR = "CI_JOBS_TRIGGER_SLACK_BURST"
+SLACK_MAX_RETRIES_OS_ENV_STR = "CI_JOBS_TRIGGER_SLACK_MAX_RETRIES"
+SLACK_FLUSH_TIMEOUT_OS_ENV_STR = "CI_JOBS_TRIGGER_SLACK_FLUSH_TIMEOUT"
+SLACK_MAX_MESSAGE_LENGTH = 4000
+SLACK_DIGEST_HEADER_MAX_LENGTH = 200
+SLACK_MESSAGES_SEPARATOR = "\n\n"
+TOO_MANY_REQUESTS_STATUS = 429
+DEFAULT_RETRY_AFTER = 1
+
+_SLACK_NOTIFIER = None
+_SLACK_NOTIFIER_LOCK = threading.Lock()
+_SLACK_DIGEST = contextvars.ContextVar("slack_digest", default=None)
+
+
+class WebhookSender:
+    # Posts the messages queued for one webhook in order, paced by a token bucket.
+    # Messages queued while waiting are coalesced into one post (up to SLACK_MAX_MESSAGE_LENGTH).
+    def __init__(self, webhook_url, http_client, queue_size, rate, burst, max_retries):
+        self.webhook_url = webhook_url
+        self.http_client = http_client
+        self.max_retries = max_retries
+        self.stats = {"queued": 0, "posts": 0, "sent": 0, "dropped": 0, "rate_limited": 0, "failed": 0}
+        self._stats_lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._bucket = TokenBucket(rate=rate, burst=burst)
+        self._pending = None
+        self._thread = threading.Thread(target=self._run, name="slack-notifier", daemon=True)
+        self._thread.start()
+
+    def put(self, message, logger):
+        try:
+            self._queue.put_nowait((message, logger))
+            self._count(key="queued")
+            return True
+
+        except queue.Full:
+            self._count(key="dropped")
+            logger.error(f"Slack messages queue is full, dropping message: {message}")
+            return False
+
+    def flush(self, timeout):
+        # Waits until all the queued messages were handled, returns False on timeout
+        with self._queue.all_tasks_done:
+            return self._queue.all_tasks_done.wait_for(lambda: not self._queue.unfinished_tasks, timeout=timeout)
+
+    def get_stats(self):
+        with self._stats_lock:
+            return dict(self.stats)
+
+    def _count(self, key, value=1):
+        with self._stats_lock:
+            self.stats[key] += value
+
+    def _run(self):
+        while True:
+            messages = [self._pending or self._queue.get()]
+            self._pending = None
+            self._bucket.acquire()
+            # Messages queued meanwhile go in the same post
+            length = len(messages[0][0])
+            while True:
+                try:
+                    message, logger = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+
+                length += len(SLACK_MESSAGES_SEPARATOR) + len(message)
+                if length > SLACK_MAX_MESSAGE_LENGTH:
+                    self._pending = (message, logger)
+                    break
+
+                messages.append((message, logger))
+
+            try:
+                self._post(
+                    message=SLACK_MESSAGES_SEPARATOR.join(_message for _message, _ in messages), logger=messages[0][1]
+                )
+                self._count(key="sent", value=len(messages))
+            except Exception as ex:
+                self._count(key="failed", value=len(messages))
+                messages[0][1].error(f"Failed to send slack message. error: {ex}")
+
+            finally:
+                for _ in messages:
+                    self._queue.task_done()
+
+    def _post(self, message, logger):
+        logger.info(f"Sending message to slack: {message}")
+        for _ in range(self.max_retries + 1):
+            self._count(key="posts")
+            # 429 is handled here, with the webhook stats and `max_retries`
+            response = self.http_client.post(
+                self.webhook_url,
+                retries=0,
+                data=json.dumps({"text": message}),
+                headers={"Content-Type": "application/json"},
+            )
+            if response.status_code != TOO_MANY_REQUESTS_STATUS:
+                break
+
+            # Nothing is sent to this webhook until Slack allows it again
+            self._count(key="rate_limited")
+            retry_after = float(response.headers.get("Retry-After") or DEFAULT_RETRY_AFTER)
+            logger.warning(f"Slack rate limited the webhook, retrying in {retry_after} seconds")
+            time.sleep(retry_after)
+
+        if response.status_code != 200:
+            raise ValueError(f"Request to slack returned an error {response.status_code}: {response.text}")
+
+
+class SlackNotifier:
+    # Sends slack messages in the background, `notify` only queues the message.
+    # Each webhook gets its own bounded queue and sender thread; senders are per process (threads do not survive fork).
+    def __init__(self, queue_size=None, rate=None, burst=None, max_retries=None):
+        self.queue_size = queue_size or int(os.environ.get(SLACK_QUEUE_SIZE_OS_ENV_STR, 1000))
+        self.rate = rate if rate is not None else float(os.environ.get(SLACK_RATE_OS_ENV_STR, 1))
+        self.burst = burst or float(os.environ.get(SLACK_BURST_OS_ENV_STR, 3))
+        self.max_retries = (
+            max_retries if max_retries is not None else int(os.environ.get(SLACK_MAX_RETRIES_OS_ENV_STR, 5))
+        )
+        self._pid = None
+        self._senders = {}
+        self._http_client = None
+        self._lock = threading.Lock()
+
+    def notify(self, message, webhook_url, logger):
+        return self._get_sender(webhook_url=webhook_url).put(message=message, logger=logger)
+
+    def flush(self, timeout=None):
+        # Returns False if some messages were not handled within `timeout` seconds
+        timeout = timeout if timeout is not None else float(os.environ.get(SLACK_FLUSH_TIMEOUT_OS_ENV_STR, 10))
+        deadline = time.monotonic() + timeout
+        flushed = True
+        for sender in self._process_senders().values():
+            flushed &= sender.flush(timeout=max(deadline - time.monotonic(), 0))
+
+        return flushed
+
+    def stats(self):
+        return {webhook_url: sender.get_stats() for webhook_url, sender in self._process_senders().items()}
+
+    def _process_senders(self):
+        with self._lock:
+            return dict(self._senders) if self._pid == os.getpid() else {}
+
+    def _get_sender(self, webhook_url):
+        with self._lock:
+            if self._pid != os.getpid():
+                # First use in this process, senders inherited from the parent process have no thread
+                self._pid = os.getpid()
+                self._senders = {}
+                self._http_client = get_http_client()
+                atexit.register(self.flush)
+
+            if webhook_url not in self._senders:
+                self._senders[webhook_url] = WebhookSender(
+                    webhook_url=webhook_url,
+                    http_client=self._http_client,
+                    queue_size=self.queue_size,
+                    rate=self.rate,
+                    burst=self.burst,
+                    max_retries=self.max_retries,
+                )
+
+            return self._senders[webhook_url]
+
+
+def get_slack_notifier():
+    global _SLACK_NOTIFIER
+
+    with _SLACK_NOTIFIER_LOCK:
+        if not _SLACK_NOTIFIER:
+            _SLACK_NOTIFIER = SlackNotifier()
+
+        return _SLACK_NOTIFIER
+
+
+def flush_slack_messages_on_sigterm():
+    # Queued messages are sent before the process is terminated, processes started later inherit the handler
+    def _handler(signum, frame):
+        get_slack_notifier().flush()
+        signal.signal(signum, signal.SIG_DFL)
+        os.kill(os.getpid(), signum)
+
+    signal.signal(signal.SIGTERM, _handler)
+
+
+def split_slack_message(messages, max_length=SLACK_MAX_MESSAGE_LENGTH):
+    # Joins the messages into as few chunks of at most `max_length` as possible, longer messages are split by lines
+    chunks = []
+    for message in messages:
+        for part in split_long_slack_message(message=message, max_length=max_length):
+            if chunks and len(chunks[-1]) + len(SLACK_MESSAGES_SEPARATOR) + len(part) <= max_length:
+                chunks[-1] += f"{SLACK_MESSAGES_SEPARATOR}{part}"
+            else:
+                chunks.append(part)
+
+    return chunks
+
+
+def split_long_slack_message(message, max_length):
+    if len(message) <= max_length:
+        return [message]
+
+    parts = []
+    part = ""
+    for line in message.splitlines(keepends=True):
+        for idx in range(0, len(line), max_length):
+            piece = line[idx : idx + max_length]
+            if len(part) + len(piece) > max_length:
+                parts.append(part)
+                part = ""
+
+            part += piece
+
+    if part:
+        parts.append(part)
+
+    return parts
+
+
+class SlackDigest:
+    # Collects the messages sent during one unit of work, per webhook, and sends them as one message when it ends
+    def __init__(self, title, logger):
+        self.title = title
+        self.logger = logger
+        self._messages = {}
+        self._lock = threading.Lock()
+
+    def add(self, message, webhook_url):
+        with self._lock:
+            self._messages.setdefault(webhook_url, []).append(message)
+
+    def chunks(self):
+        with self._lock:
+            messages = {webhook_url: list(_messages) for webhook_url, _messages in self._messages.items()}
+
+        webhooks_chunks = {}
+        for webhook_url, _messages in messages.items():
+            chunks = split_slack_message(
+                messages=_messages, max_length=SLACK_MAX_MESSAGE_LENGTH - SLACK_DIGEST_HEADER_MAX_LENGTH
+            )
+            header = f"{self.title[: SLACK_DIGEST_HEADER_MAX_LENGTH - 50]}: {len(_messages)} notifications"
+            webhooks_chunks[webhook_url] = [
+                f"{header}{f' ({idx}/{len(chunks)})' if len(chunks) > 1 else ''}{SLACK_MESSAGES_SEPARATOR}{chunk}"
+                for idx, chunk in enumerate(chunks, start=1)
+            ]
+
+        return webhooks_chunks
+
+    def send(self):
+        for webhook_url, chunks in self.chunks().items():
+            for chunk in chunks:
+                get_slack_notifier().notify(message=chunk, webhook_url=webhook_url, logger=self.logger)
+
+
+@contextlib.contextmanager
+def slack_digest(title, logger, enabled=True):
+    # Messages sent by `send_slack_message` in this context (and in threads started with a copy of it) are sent as one
+    # digest when the context ends. A digest inside another one is merged into the outer digest.
+    if not enabled or _SLACK_DIGEST.get():
+        yield _SLACK_DIGEST.get()
+        return
+
+    digest = SlackDigest(title=title, logger=logger)
+    token = _SLACK_DIGEST.set(digest)
+    try:
+        yield digest
+
+    finally:
+        _SLACK_DIGEST.reset(token)
+        digest.send()
+
+
+def get_slack_digest():
+    return _SLACK_DIGEST.get()
@@ -0,0 +1,33 @@
+from __future__ import annotations
+import threading
+import time
+
+
+class TokenBucket:
+    # Allows `rate` calls per second on average and up to `burst` calls at once; `rate` 0 means unlimited
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = float(rate)
+        self.burst = max(float(burst), 1.0)
+        self._tokens = self.burst
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        # Blocks until a token is available, returns the time waited in seconds
+        if not self.rate:
+            return 0.0
+
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+
+                wait_time = (1 - self._tokens) / self.rate
+
+            time.sleep(wait_time)
+            waited += wait_time
@@ -0,0 +1,67 @@
+from __future__ import annotations
+import contextvars
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+from ci_jobs_trigger.utils.token_bucket import TokenBucket
+
+DEFAULT_TRIGGER_LIMITS: Dict[str, Dict[str, float]] = {
+    "jenkins": {"max_parallel": 4, "rate": 2, "burst": 4},
+    "openshift-ci": {"max_parallel": 8, "rate": 5, "burst": 10},
+}
+DEFAULT_BACKEND_TRIGGER_LIMITS: Dict[str, float] = {"max_parallel": 1, "rate": 0, "burst": 1}
+
+
+class TriggerDispatcher:
+    # Runs triggers concurrently, each CI backend gets its own workers (`max_parallel`) and token bucket
+    # (`rate` triggers per second, `burst`) so a slow or strict backend does not hold back the others.
+    # `limits` overrides DEFAULT_TRIGGER_LIMITS per backend.
+    def __init__(self, limits: Dict[str, Dict[str, float]] | None = None) -> None:
+        self.limits: Dict[str, Dict[str, float]] = {
+            backend: dict(backend_limits) for backend, backend_limits in DEFAULT_TRIGGER_LIMITS.items()
+        }
+        for backend, backend_limits in (limits or {}).items():
+            self.limits.setdefault(backend, dict(DEFAULT_BACKEND_TRIGGER_LIMITS)).update(backend_limits or {})
+
+        self.rate_limit_waits: Dict[str, float] = {}
+        self._executors: Dict[str, ThreadPoolExecutor] = {}
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> TriggerDispatcher:
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.shutdown()
+
+    def submit(self, backend: str, func: Callable, **kwargs: Any) -> Future:
+        executor, bucket = self._get_backend(backend=backend)
+        # The trigger runs with the caller's context (e.g. its slack digest)
+        return executor.submit(contextvars.copy_context().run, self._run, backend, bucket, func, kwargs)
+
+    def shutdown(self) -> None:
+        for executor in self._executors.values():
+            executor.shutdown(wait=True)
+
+    def _get_backend(self, backend: str) -> tuple[ThreadPoolExecutor, TokenBucket]:
+        with self._lock:
+            if backend not in self._executors:
+                backend_limits = self.limits.get(backend, DEFAULT_BACKEND_TRIGGER_LIMITS)
+                self._executors[backend] = ThreadPoolExecutor(
+                    max_workers=max(int(backend_limits.get("max_parallel", 1)), 1),
+                    thread_name_prefix=f"trigger-{backend}",
+                )
+                self._buckets[backend] = TokenBucket(
+                    rate=backend_limits.get("rate", 0), burst=backend_limits.get("burst", 1)
+                )
+                self.rate_limit_waits[backend] = 0.0
+
+            return self._executors[backend], self._buckets[backend]
+
+    def _run(self, backend: str, bucket: TokenBucket, func: Callable, kwargs: Dict[str, Any]) -> Any:
+        waited = bucket.acquire()
+        with self._lock:
+            self.rate_limit_waits[backend] += waited
+
+        return func(**kwargs)